@@ -0,0 +1,299 @@
+# backtest.py
+"""
+Бэктест стратегий на записанных играх (снимки пишет bot.py, если задан RECORD_DIR).
+
+Каждая игра прогоняется через analyze_single_event с симулированными часами:
+снимки live-списка и summary подаются в порядке записи, а игра "опрашивается"
+с тем же интервалом, что и в live (poll_interval_for), только без ожидания.
+Игры обрабатываются параллельно в пуле процессов. Базовый темп (LINE_MODE=pace) каждая игра
+получает готовым — по четвертям игр, закончившимся до её начала, — так что результат
+не зависит от --workers и не заглядывает в будущее.
+
+Примеры:
+    python backtest.py records/
+    python backtest.py records/ --workers 8 --set STRATEGY_3Q_MIN_POINTS=14 --set STRATEGY_4Q_MAX_DIFF=5
+    python backtest.py records/ --odds 1.9 --json
+"""
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+
+# bot.py требует токен при импорте; в бэктесте Telegram не используется
+os.environ.setdefault("BOT_TOKEN", "0:backtest")
+
+import bot
+
+
+# ------------ Загрузка записанных игр ------------
+def find_games(root: str) -> Dict[int, List[str]]:
+    """event_id -> файлы игры (игра через полночь UTC лежит в двух папках-датах)"""
+    games: Dict[int, List[str]] = defaultdict(list)
+    for path in glob.glob(os.path.join(root, "**", "*.jsonl.gz"), recursive=True):
+        stem = os.path.basename(path)[: -len(".jsonl.gz")]
+        try:
+            games[int(stem)].append(path)
+        except ValueError:
+            continue
+    return games
+
+
+def load_game(paths: List[str]) -> List[Dict[str, Any]]:
+    """Все снимки игры, отсортированные по времени"""
+    records = []
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except (EOFError, OSError):
+            # файл оборван (бот упал во время записи) — берём то, что успели прочитать
+            continue
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+# ------------ Прогон одной игры ------------
+def _init_worker(overrides: Dict[str, Any]):
+    for name, value in overrides.items():
+        setattr(bot, name, value)
+
+
+def _final_points(event: Dict[str, Any], summary: Dict[str, Any], quarter: int):
+    periods = bot.parse_period_scores(summary.get("summary")) if summary else []
+    if len(periods) >= quarter:
+        return periods[quarter - 1][0] + periods[quarter - 1][1]
+    h = bot.safe_get(event, "homeScore", f"period{quarter}")
+    a = bot.safe_get(event, "awayScore", f"period{quarter}")
+    if h is None or a is None:
+        return None
+    return int(h) + int(a)
+
+
+# ------------ Базовый темп по сыгранным раньше играм ------------
+def game_quarters(event_id: int, paths: List[str]) -> Dict[str, Any]:
+    """Начало игры и её завершённые четверти основного времени: (конец, лига, хозяева, гости, очки, минуты, id, четверть)"""
+    records = load_game(paths)
+    event, summary, ends = None, {}, {}
+    for rec in records:
+        if rec["kind"] == "summary":
+            summary = {**summary, **rec["data"]}
+            continue
+        event = rec["data"]
+        period, _ = bot.get_current_period_and_clock(event)
+        finished = str(bot.safe_get(event, "status", "type", default="")).lower() == "finished"
+        for q in range(1, 5):
+            if q not in ends and (period > q or finished):
+                ends[q] = rec["t"]
+    quarters = []
+    if event is not None:
+        league = bot.safe_get(event, "tournament", "name", default="")
+        home = bot.safe_get(event, "homeTeam", "name", default="")
+        away = bot.safe_get(event, "awayTeam", "name", default="")
+        minutes = (bot.event_period_seconds(event) or bot.PACE_PERIOD_SECONDS) / 60
+        for q, (h, a) in enumerate(bot.get_period_scores(event, summary)[:4], 1):
+            if q in ends:
+                quarters.append((ends[q], league, home, away, h + a, minutes, event_id, q))
+    return {"event_id": event_id, "start": records[0]["t"] if records else 0.0, "quarters": quarters}
+
+
+def _quarters_item(item):
+    return game_quarters(*item)
+
+
+def baselines_before(games: List[Dict[str, Any]], window: int, default: float) -> Dict[int, Dict[tuple, List[float]]]:
+    """event_id -> PaceBaselines.stats по четвертям, закончившимся до начала игры (один проход по времени)"""
+    observations = sorted(q for g in games for q in g["quarters"])
+    pace = bot.PaceBaselines(window, default)
+    snapshots, i = {}, 0
+    for g in sorted(games, key=lambda g: (g["start"], g["event_id"])):
+        while i < len(observations) and observations[i][0] < g["start"]:
+            pace.observe(*observations[i][1:])
+            i += 1
+        snapshots[g["event_id"]] = {key: list(s) for key, s in pace.stats.items()}
+    return snapshots
+
+
+def replay_game(event_id: int, paths: List[str], baseline: Optional[Dict[tuple, List[float]]] = None) -> Dict[str, Any]:
+    records = load_game(paths)
+    rows: List[tuple] = []
+    current = {"summary": {}}
+
+    async def recorded_summary(_event_id, finished=False, parts=tuple(bot.SUMMARY_PARTS)):
+        return {part: data for part, data in current["summary"].items() if part in parts}
+
+    bot.get_event_summary = recorded_summary
+    bot.publish = lambda *args, **kwargs: None
+    bot.log_match = lambda *args, **kwargs: None
+    bot.save_signal_log = lambda *args, **kwargs: rows.append(args)
+    bot.sent_signals.discard(event_id)
+    bot.incident_states.pop(event_id, None)
+    # базовый темп — на начало игры (baselines_before) + её собственные четверти, как в live;
+    # накопленное воркером по другим играм не переносится (иначе результат зависит от --workers)
+    bot.pace_baselines = bot.PaceBaselines(bot.PACE_WINDOW, bot.PACE_DEFAULT_PPM)
+    bot.pace_baselines.stats = {key: list(s) for key, s in (baseline or {}).items()}
+
+    async def run():
+        event = None
+        next_due = None
+        analyses = 0
+        for rec in records:
+            t = rec["t"]
+            if rec["kind"] == "summary":
+                # бот запрашивает только нужные части — снимок может содержать одну из них
+                current["summary"] = {**current["summary"], **rec["data"]}
+            else:
+                event = rec["data"]
+            if event is None:
+                continue
+            interval = bot.poll_interval_for(event)
+            if interval is None:
+                next_due = None
+                continue
+            if next_due is None or next_due > t + interval:
+                next_due = t
+            if t >= next_due:
+                await bot.analyze_single_event(event)
+                analyses += 1
+                next_due = t + interval
+        return event, analyses
+
+    event, analyses = asyncio.run(run())
+
+    # сигналы без итога: игра закончилась (4Q) или пропала из записи — считаем по финальному счёту
+    for quarter, sent in bot.sent_signals.for_event(event_id).items():
+        if sent.get("reported_result") is not None or event is None:
+            continue
+        pts = _final_points(event, current["summary"], quarter)
+        if pts is None:
+            continue
+        _, passed = bot.format_result_message(event_id, sent, pts)
+        rows.append((event_id, "", "", "", f"{quarter}Q", sent.get("line", 0), "", "PASSED" if passed else "FAILED", pts))
+    bot.sent_signals.discard(event_id)
+    bot.incident_states.pop(event_id, None)
+    bot.checked_periods.pop(event_id, None)
+
+    signals = {}
+    for _, _, _, _, quarter, line, _, status, points in rows:
+        if status == "PENDING":
+            signals[quarter] = {"quarter": quarter, "line": line, "status": "PENDING", "points": None}
+        elif quarter in signals:
+            signals[quarter].update(status=status, points=points)
+    return {
+        "event_id": event_id,
+        "league": bot.safe_get(event or {}, "tournament", "name", default=""),
+        "records": len(records),
+        "analyses": analyses,
+        "duration": (records[-1]["t"] - records[0]["t"]) if records else 0.0,
+        "signals": list(signals.values()),
+    }
+
+
+def _replay_item(item):
+    return replay_game(*item)
+
+
+# ------------ Отчёт ------------
+def build_report(games: List[Dict[str, Any]], odds: float) -> Dict[str, Any]:
+    by_strategy: Dict[str, Dict[str, Any]] = defaultdict(
+        lambda: {"signals": 0, "passed": 0, "failed": 0, "unsettled": 0, "pnl": 0.0}
+    )
+    for g in games:
+        for sig in g["signals"]:
+            s = by_strategy[sig["quarter"]]
+            s["signals"] += 1
+            if sig["status"] == "PASSED":
+                s["passed"] += 1
+                s["pnl"] += odds - 1
+            elif sig["status"] == "FAILED":
+                s["failed"] += 1
+                s["pnl"] -= 1
+            else:
+                s["unsettled"] += 1
+    for s in by_strategy.values():
+        settled = s["passed"] + s["failed"]
+        s["hit_rate"] = round(s["passed"] / settled, 4) if settled else 0.0
+        s["roi"] = round(s["pnl"] / settled, 4) if settled else 0.0
+        s["pnl"] = round(s["pnl"], 2)
+    return {
+        "games": len(games),
+        "records": sum(g["records"] for g in games),
+        "analyses": sum(g["analyses"] for g in games),
+        "simulated_seconds": sum(g["duration"] for g in games),
+        "odds": odds,
+        "strategies": dict(sorted(by_strategy.items())),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"Игр: {report['games']}, снимков: {report['records']}, анализов: {report['analyses']}")
+    print(f"Симулировано: {report['simulated_seconds'] / 3600:.1f} ч за {report['wall_seconds']:.1f} с")
+    print(f"Коэффициент: {report['odds']}")
+    for name, s in report["strategies"].items():
+        print(
+            f"[{name}] сигналов: {s['signals']}, прошло: {s['passed']}, не прошло: {s['failed']}, "
+            f"без итога: {s['unsettled']}, hit rate: {s['hit_rate']:.1%}, PnL: {s['pnl']:+.2f}, ROI: {s['roi']:+.1%}"
+        )
+
+
+def parse_overrides(pairs: List[str]) -> Dict[str, Any]:
+    overrides = {}
+    for pair in pairs:
+        name, _, raw = pair.partition("=")
+        if not hasattr(bot, name):
+            raise SystemExit(f"Неизвестный параметр: {name}")
+        overrides[name] = type(getattr(bot, name))(raw)
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бэктест стратегий на записанных играх")
+    parser.add_argument("root", help="папка с записями (RECORD_DIR)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--odds", type=float, default=1.87, help="коэффициент для PnL (ставка 1)")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="переопределить константу bot.py, например STRATEGY_3Q_MIN_POINTS=14")
+    parser.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    overrides = parse_overrides(args.set)
+    items = sorted(find_games(args.root).items())
+    if not items:
+        print("Записанных игр не найдено", file=sys.stderr)
+        return 1
+
+    started = time.monotonic()
+    ctx = multiprocessing.get_context("spawn")
+    chunksize = max(1, len(items) // (args.workers * 4))
+    with ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=_init_worker, initargs=(overrides,)) as pool:
+        if overrides.get("LINE_MODE", bot.LINE_MODE) == "pace":
+            # линии зависят от истории — сначала собираем четверти всех игр, потом раздаём базовый темп
+            quarters = list(pool.map(_quarters_item, items, chunksize=chunksize))
+            baselines = baselines_before(
+                quarters, overrides.get("PACE_WINDOW", bot.PACE_WINDOW), overrides.get("PACE_DEFAULT_PPM", bot.PACE_DEFAULT_PPM)
+            )
+            items = [(event_id, paths, baselines[event_id]) for event_id, paths in items]
+        games = list(pool.map(_replay_item, items, chunksize=chunksize))
+    report = build_report(games, args.odds)
+    report["wall_seconds"] = time.monotonic() - started
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# bench_decode.py
+"""
+Сравнение способов разбора JSON на записанных ответах SofaScore (RECORD_DIR).
+
+Из записанных игр собираются "тики": live-список со снимком каждой игры + incidents
+тех игр, по которым они записаны. Тела сериализуются обратно в байты и разбираются
+каждым бэкендом: json, orjson, msgspec целиком и msgspec с проекциями bot.py.
+Печатает время разбора на тик и память, которую держат разобранные объекты.
+
+Примеры:
+    python bench_decode.py records/
+    python bench_decode.py records/ --ticks 500 --repeat 5
+
+Снимки, записанные с включёнными проекциями, уже урезаны — для честного сравнения
+лучше записывать с JSON_PROJECT=0.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, Any, List
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+import backtest
+import bot
+
+
+def build_ticks(root: str, ticks: int) -> List[List[tuple]]:
+    """[тик] -> [(endpoint, body), ...]"""
+    events: List[List[Dict[str, Any]]] = []
+    incidents: List[List[Any]] = []
+    for _, paths in sorted(backtest.find_games(root).items()):
+        evs, incs = [], []
+        for rec in backtest.load_game(paths):
+            if rec["kind"] == "event":
+                evs.append(rec["data"])
+            elif isinstance(rec["data"], dict) and "incidents" in rec["data"]:
+                incs.append(rec["data"]["incidents"])
+        if evs:
+            events.append(evs)
+        if incs:
+            incidents.append(incs)
+    result = []
+    for k in range(ticks):
+        live = {"events": [evs[k % len(evs)] for evs in events]}
+        bodies = [("live", json.dumps(live).encode())]
+        bodies += [("incidents", json.dumps(incs[k % len(incs)]).encode()) for incs in incidents]
+        result.append(bodies)
+    return result
+
+
+def backends() -> Dict[str, Any]:
+    found = {"json": lambda body, endpoint: json.loads(body)}
+    if bot.orjson is not None:
+        found["orjson"] = lambda body, endpoint: bot.orjson.loads(body)
+    if bot.msgspec is not None:
+        found["msgspec"] = lambda body, endpoint: bot.msgspec.json.decode(body)
+        decoders = {endpoint: bot.msgspec.json.Decoder(t) for endpoint, t in bot.JSON_PROJECTIONS.items()}
+        found["msgspec + проекция"] = lambda body, endpoint: decoders[endpoint].decode(body) if endpoint in decoders else bot.msgspec.json.decode(body)
+    return found
+
+
+def measure(decode, ticks: List[List[tuple]], repeat: int) -> Dict[str, float]:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for bodies in ticks:
+            for endpoint, body in bodies:
+                decode(body, endpoint)
+        best = min(best, time.perf_counter() - started)
+    # память: сколько держат разобранные объекты одного тика
+    tracemalloc.start()
+    kept = [decode(body, endpoint) for endpoint, body in ticks[0]]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {"ms_per_tick": best / len(ticks) * 1000, "kb_per_tick": size / 1024}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора JSON на записанных ответах SofaScore")
+    parser.add_argument("root", help="папка с записями (RECORD_DIR)")
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    ticks = build_ticks(args.root, args.ticks)
+    if not ticks or not ticks[0]:
+        print("Записанных игр не найдено", file=sys.stderr)
+        return 1
+    size = sum(len(body) for body in (b for bodies in ticks for _, b in bodies)) / len(ticks)
+    print(f"Тиков: {len(ticks)}, ответов на тик: {len(ticks[0])}, тело на тик: {size / 1024:.1f} КБ")
+
+    baseline = None
+    for name, decode in backends().items():
+        r = measure(decode, ticks, args.repeat)
+        baseline = baseline or r
+        print(
+            f"{name:20} {r['ms_per_tick']:8.3f} мс/тик  x{baseline['ms_per_tick'] / r['ms_per_tick']:5.2f}  "
+            f"{r['kb_per_tick']:8.1f} КБ/тик"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,3 @@
-from telegram import Update
-from telegram.ext import CallbackContext
 # bot.py
 import os
 import time
@@ -7,34 +5,33 @@ import json
 import threading
 
 import logging
+import logging.handlers
 
-# Логирование в файл matches.log
 logging.basicConfig(
-    filename="matches.log",
     level=logging.INFO,
     format="%(asctime)s - %(message)s"
 )
 
-# Функция для записи проверки матча
-def log_match(match_name, status="checked"):
-    logging.info(f"{match_name} - {status}")
-
-# Команда /checked для просмотра последних матчей
-def checked(update: Update, context: CallbackContext):
-    try:
-        with open("matches.log", "r", encoding="utf-8") as f:
-            lines = f.readlines()[-10:]  # последние 10 записей
-        if not lines:
-            update.message.reply_text("Пока нет проверенных матчей.")
-        else:
-            update.message.reply_text("Последние проверки:\n" + "".join(lines))
-    except FileNotFoundError:
-        update.message.reply_text("Лог-файл ещё не создан.")
-
+import argparse
 import asyncio
+import atexit
+import bisect
+import gzip
+import heapq
+import itertools
+import math
+import multiprocessing
+import queue
+import random
+import re
+import signal
 import sqlite3
-from datetime import datetime
-from typing import Dict, Any, List, Optional
+import sys
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, TypedDict
 
 
 # aiohttp fallback: если aiohttp не установлен, используем requests в async-обёртке
@@ -47,6 +44,7 @@ except Exception:
         def __init__(self, r):
             self._r = r
             self.status = r.status_code
+            self.headers = r.headers
         async def text(self):
             return self._r.text
         async def json(self):
@@ -59,22 +57,51 @@ except Exception:
         async def __aexit__(self, exc_type, exc, tb):
             return False
 
+    class _SimpleRequest:
+        # как в aiohttp: session.get(...) можно и await'ить, и использовать в async with
+        def __init__(self, coro):
+            self._coro = coro
+        def __await__(self):
+            return self._coro.__await__()
+        async def __aenter__(self):
+            return await self._coro
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
+
     class SimpleClientSession:
-        def __init__(self):
+        # свой пул потоков (а не общий executor loop'а) и пул соединений requests того же размера:
+        # запросы к SofaScore не отнимают потоки у остальных run_in_executor
+        def __init__(self, pool_size=10, per_host=10, timeout=10):
+            from requests.adapters import HTTPAdapter
             self._s = requests.Session()
-        async def get(self, url, **kwargs):
-            loop = asyncio.get_event_loop()
-            resp = await loop.run_in_executor(None, lambda: self._s.get(url, **kwargs))
-            return _SimpleResponse(resp)
-        async def post(self, url, **kwargs):
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=per_host, pool_block=True)
+            self._s.mount("https://", adapter)
+            self._s.mount("http://", adapter)
+            self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="http")
+            self._timeout = timeout
+            self.limit = pool_size
+            self.in_flight = 0
+        async def _request(self, method, url, **kwargs):
             loop = asyncio.get_event_loop()
-            resp = await loop.run_in_executor(None, lambda: self._s.post(url, **kwargs))
+            kwargs.setdefault("timeout", self._timeout)
+            self.in_flight += 1
+            try:
+                resp = await loop.run_in_executor(self._executor, lambda: self._s.request(method, url, **kwargs))
+            finally:
+                self.in_flight -= 1
             return _SimpleResponse(resp)
+        def get(self, url, **kwargs):
+            return _SimpleRequest(self._request("GET", url, **kwargs))
+        def post(self, url, **kwargs):
+            return _SimpleRequest(self._request("POST", url, **kwargs))
+        def pool_stats(self):
+            return {"limit": self.limit, "in_flight": self.in_flight, "queued": self._executor._work_queue.qsize()}
         async def close(self):
             try:
-                await asyncio.get_event_loop().run_in_executor(None, self._s.close)
+                await asyncio.get_event_loop().run_in_executor(self._executor, self._s.close)
             except Exception:
                 pass
+            self._executor.shutdown(wait=False)
 
     aiohttp = types.SimpleNamespace(ClientSession=SimpleClientSession)
 
@@ -87,7 +114,9 @@ RENDER_EXTERNAL_URL = os.getenv("RENDER_EXTERNAL_URL")  # пример https://t
 if not TOKEN:
     raise RuntimeError("BOT_TOKEN не задан в environment variables")
 
-bot = telebot.TeleBot(TOKEN)
+# threaded=False: обработчики выполняются в пуле UpdateDispatcher (webhook) или в потоке polling,
+# а не во внутреннем пуле telebot
+bot = telebot.TeleBot(TOKEN, threaded=False)
 server = Flask(__name__)
 
 # ------------ Асинхронный loop в отдельном потоке ------------
@@ -99,25 +128,290 @@ def _start_loop(loop):
     loop.run_forever()
 
 
-threading.Thread(target=_start_loop, args=(_async_loop,), daemon=True).start()
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+
+def start_async_loop():
+    """Запустить поток с loop'ом (один раз; при импорте модуля поток не стартует)"""
+    global _loop_thread
+    with _loop_lock:
+        if _loop_thread is None:
+            _loop_thread = threading.Thread(target=_start_loop, args=(_async_loop,), name="asyncio-loop", daemon=True)
+            _loop_thread.start()
 
 
 def run_coro(coro):
     """Запланировать корутину в фоновом loop'е"""
+    start_async_loop()
     return asyncio.run_coroutine_threadsafe(coro, _async_loop)
 
 
+# ------------ Метрики (Prometheus text format, отдаются на /metrics) ------------
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED") == "1"  # включает /debug/profile
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        lines += [f"{self.name}{_labels(key)} {value}" for key, value in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values: Dict[tuple, List[float]] = {}  # labels -> [count по бакетам..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v[i] += 1
+                    break
+            else:
+                v[len(self.buckets)] += 1
+            v[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(v)) for key, v in self._values.items()]
+        for key, v in items:
+            cumulative = 0
+            for b, n in zip(self.buckets + ("+Inf",), v[:-1]):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', str(b)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {v[-1]}")
+            lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+        return lines
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in key) + "}"
+
+
+# Текущие значения (глубина очередей, счётчики компонентов) снимаются в момент запроса /metrics
+_gauges: List[tuple] = []  # (name, help, fn -> число или {labels_tuple: число})
+
+
+def register_gauge(name: str, help_text: str, fn):
+    _gauges.append((name, help_text, fn))
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for m in METRICS:
+        lines += m.render()
+    for name, help_text, fn in _gauges:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        if isinstance(value, dict):
+            lines += [f"{name}{_labels(key)} {v}" for key, v in value.items()]
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+SOFASCORE_REQUESTS = Counter("sofascore_requests_total", "Запросы к SofaScore по эндпойнту и результату")
+SOFASCORE_SECONDS = Histogram("sofascore_request_seconds", "Время запроса к SofaScore")
+ERRORS = Counter("errors_total", "Перехваченные исключения по месту и типу")
+ANALYZE_SECONDS = Histogram("analyze_event_seconds", "Время analyze_single_event")
+STRATEGY_SECONDS = Histogram("strategy_eval_seconds", "Время оценки стратегии", (0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+TICK_SECONDS = Histogram("monitor_tick_seconds", "Длительность тика монитора (цель — LIVE_LIST_INTERVAL)")
+TICK_OVERRUNS = Counter("monitor_tick_overruns_total", "Тики дольше LIVE_LIST_INTERVAL")
+DB_BATCH_SECONDS = Histogram("db_batch_seconds", "Время записи пачки в SQLite")
+TELEGRAM_SEND_SECONDS = Histogram("telegram_send_seconds", "Время запроса sendMessage")
+TELEGRAM_DELIVERY_SECONDS = Histogram("telegram_delivery_seconds", "От обнаружения сигнала до подтверждения Telegram", LATENCY_BUCKETS + (30.0, 60.0))
+SIGNALS_TOTAL = Counter("signals_sent_total", "Отправленные сигналы по стратегии")
+RESULTS_TOTAL = Counter("signal_results_total", "Итоги сигналов по стратегии и статусу")
+METRICS = [
+    SOFASCORE_REQUESTS, SOFASCORE_SECONDS, ERRORS, ANALYZE_SECONDS, STRATEGY_SECONDS, TICK_SECONDS,
+    TICK_OVERRUNS, DB_BATCH_SECONDS, TELEGRAM_SEND_SECONDS, TELEGRAM_DELIVERY_SECONDS, SIGNALS_TOTAL, RESULTS_TOTAL,
+]
+SINGLE_FLIGHT_TOTAL = Counter("single_flight_total", "Запросы к SofaScore: leader — сделал запрос, shared — дождался чужого")
+ANALYZE_SKIPPED = Counter("analyze_skipped_total", "Пропущенные анализы: прошлый анализ этой игры ещё идёт")
+METRICS += [SINGLE_FLIGHT_TOTAL, ANALYZE_SKIPPED]
+
+
+def count_error(where: str, exc: BaseException):
+    ERRORS.inc(where=where, type=type(exc).__name__)
+
+
+class SamplingProfiler:
+    """
+    Простой сэмплирующий профайлер: каждые interval секунд снимает стеки всех потоков
+    (sys._current_frames) и считает, в каких функциях они находятся. Без накладных расходов,
+    пока не запущен.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+
+    def run(self, seconds: float, top: int = 30) -> str:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        self_counts: Dict[tuple, int] = {}
+        total_counts: Dict[tuple, int] = {}
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                thread = names.get(ident, str(ident))
+                key = (thread, frame.f_code.co_filename, frame.f_code.co_name, frame.f_lineno)
+                self_counts[key] = self_counts.get(key, 0) + 1
+                seen = set()
+                while frame is not None:
+                    fkey = (thread, frame.f_code.co_filename, frame.f_code.co_name)
+                    if fkey not in seen:
+                        seen.add(fkey)
+                        total_counts[fkey] = total_counts.get(fkey, 0) + 1
+                    frame = frame.f_back
+            samples += 1
+            time.sleep(self.interval)
+        lines = [f"samples: {samples}, interval: {self.interval * 1000:.1f} ms", "", "self (где поток стоит сейчас):"]
+        for (thread, filename, func, lineno), n in sorted(self_counts.items(), key=lambda x: -x[1])[:top]:
+            lines.append(f"{n / samples:7.1%}  [{thread}] {func} {os.path.basename(filename)}:{lineno}")
+        lines += ["", "total (функция есть в стеке):"]
+        for (thread, filename, func), n in sorted(total_counts.items(), key=lambda x: -x[1])[:top]:
+            lines.append(f"{n / samples:7.1%}  [{thread}] {func} {os.path.basename(filename)}")
+        return "\n".join(lines) + "\n"
+
+
 # ------------ База для логов сигналов ------------
 DB_PATH = "signals.db"
+DB_BATCH_ROWS = int(os.getenv("DB_BATCH_ROWS", "100"))  # максимум операций в одной транзакции
+DB_BATCH_MS = int(os.getenv("DB_BATCH_MS", "200"))  # сколько ждём добора пачки после первой операции
+# сводки для /stats: (таблица, колонка периода, длина префикса ts — "YYYY-MM-DD" / "YYYY-MM")
+ROLLUP_TABLES = (("signal_rollup", "day", 10), ("signal_rollup_month", "month", 7))
 _conn = None
 _conn_lock = threading.Lock()
+db_writer: Optional["DBWriter"] = None
+
+
+class DBWriter(threading.Thread):
+    """
+    Фоновый поток записи в SQLite. Операции (функции от курсора) складываются в очередь,
+    поток забирает их пачками — не больше DB_BATCH_ROWS или за DB_BATCH_MS — и выполняет
+    одной транзакцией. Event loop никогда не ждёт commit/fsync.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        super().__init__(name="db-writer", daemon=True)
+        self._conn = conn
+        self._queue: "queue.Queue" = queue.Queue()
+        self._after: List[Any] = []  # колбэки после commit текущей транзакции
+        self.stats: Dict[str, Any] = {"written": 0, "batches": 0, "errors": 0, "last_batch_ms": 0.0}
+
+    def submit(self, op):
+        self._queue.put(op)
+
+    def after_commit(self, fn):
+        """Из операции (поток записи): вызвать fn, когда её транзакция закоммичена; при откате — не вызывается"""
+        self._after.append(fn)
+
+    def _transaction(self, ops):
+        self._after = []
+        try:
+            with self._conn:
+                cur = self._conn.cursor()
+                for op in ops:
+                    op(cur)
+        except Exception:
+            self._after = []
+            raise
+        for fn in self._after:
+            fn()
+        self._after = []
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться записи всего, что уже поставлено в очередь"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self, timeout: Optional[float] = 10):
+        """Дописать очередь и остановить поток (вызывается при выходе)"""
+        if self.is_alive():
+            self._queue.put(None)
+            self.join(timeout)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + DB_BATCH_MS / 1000
+            while len(batch) < DB_BATCH_ROWS:
+                left = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=left) if left > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            ops = [op for op in batch if callable(op)]
+            stopping = any(op is None for op in batch)
+            if ops:
+                self._write(ops)
+            for op in batch:
+                if isinstance(op, threading.Event):
+                    op.set()
+
+    def _write(self, ops):
+        started = time.monotonic()
+        try:
+            self._transaction(ops)  # одна транзакция на пачку
+            self.stats["written"] += len(ops)
+            self.stats["batches"] += 1
+        except Exception:
+            # одна битая операция не должна терять всю пачку — повторяем по одной
+            for op in ops:
+                try:
+                    self._transaction([op])
+                    self.stats["written"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    count_error("db_writer", e)
+        self.stats["last_batch_ms"] = (time.monotonic() - started) * 1000
+        DB_BATCH_SECONDS.observe(time.monotonic() - started)
 
 
 def init_db():
-    global _conn
+    global _conn, db_writer
     with _conn_lock:
         if _conn is None:
             _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
             cur = _conn.cursor()
             cur.execute(
                 """CREATE TABLE IF NOT EXISTS signals (
@@ -131,400 +425,2457 @@ def init_db():
                     line REAL,
                     recommendation TEXT,
                     status TEXT,
-                    points_in_quarter INTEGER
+                    points_in_quarter INTEGER,
+                    period_seconds INTEGER,
+                    strategy TEXT,
+                    chat_ids TEXT
+                )"""
+            )
+            columns = {row[1] for row in cur.execute("PRAGMA table_info(signals)")}
+            if "period_seconds" not in columns:
+                # длина четверти игры сигнала — для базового темпа при загрузке и сверке (у старых строк — NULL)
+                cur.execute("ALTER TABLE signals ADD COLUMN period_seconds INTEGER")
+            if "strategy" not in columns:
+                # имя правила; у старых строк — NULL, их стратегия — четверть ("3Q")
+                cur.execute("ALTER TABLE signals ADD COLUMN strategy TEXT")
+            if "chat_ids" not in columns:
+                # чаты, получившие сигнал — итог уходит им; у старых строк — NULL (получатели неизвестны)
+                cur.execute("ALTER TABLE signals ADD COLUMN chat_ids TEXT")
+            # (event_id, quarter) покрывает и поиск по одному event_id
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_signals_event_quarter ON signals (event_id, quarter)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_signals_ts ON signals (ts)")
+            # сверка итогов читает только PENDING — частичный индекс не растёт вместе с историей
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_signals_pending ON signals (ts) WHERE status = 'PENDING'")
+            # сводки для /stats: сигналы и итоги по дню / месяцу (UTC), лиге и стратегии; ведутся в _write_signal
+            for table, period, width in ROLLUP_TABLES:
+                columns = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+                if columns and "void" not in columns:
+                    # сводка старого формата (VOID не считался) — данные производные, пересобираем
+                    cur.execute(f"DROP TABLE {table}")
+                cur.execute(
+                    f"""CREATE TABLE IF NOT EXISTS {table} (
+                        {period} TEXT,
+                        league TEXT,
+                        strategy TEXT,
+                        signals INTEGER NOT NULL DEFAULT 0,
+                        passed INTEGER NOT NULL DEFAULT 0,
+                        failed INTEGER NOT NULL DEFAULT 0,
+                        void INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY ({period}, league, strategy)
+                    ) WITHOUT ROWID"""
+                )
+                if "void" not in columns:
+                    # первый запуск со сводкой — один раз собираем её по уже накопленным сигналам
+                    cur.execute(
+                        f"""INSERT INTO {table} ({period}, league, strategy, signals, passed, failed, void)
+                        SELECT substr(ts, 1, {width}), COALESCE(league, ''), COALESCE(strategy, quarter), COUNT(*),
+                               SUM(status = 'PASSED'), SUM(status = 'FAILED'), SUM(status = 'VOID')
+                        FROM signals GROUP BY 1, 2, 3"""
+                    )
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS checks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts TEXT,
+                    event_id INTEGER,
+                    home TEXT,
+                    away TEXT,
+                    home_lc TEXT,
+                    away_lc TEXT,
+                    league TEXT,
+                    league_lc TEXT,
+                    status TEXT
+                )"""
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_checks_ts ON checks (ts)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_checks_league ON checks (league_lc, ts)")
+            # команда и статус ищутся по словам (check_terms) — индексы по целым строкам не нужны
+            for index in ("idx_checks_home", "idx_checks_away", "idx_checks_status"):
+                cur.execute(f"DROP INDEX IF EXISTS {index}")
+            exists = cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='check_terms'").fetchone()
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS check_terms (
+                    kind TEXT,
+                    term TEXT,
+                    check_id INTEGER,
+                    PRIMARY KEY (kind, term, check_id)
+                ) WITHOUT ROWID"""
+            )
+            if not exists:
+                rows = cur.execute("SELECT id, home, away, status FROM checks").fetchall()
+                cur.executemany(
+                    "INSERT OR IGNORE INTO check_terms (kind, term, check_id) VALUES (?,?,?)",
+                    [(kind, term, cid) for cid, home, away, status in rows for kind, term in check_terms(home, away, status)],
+                )
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER,
+                    text TEXT
+                )"""
+            )
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS subscriptions (
+                    chat_id INTEGER PRIMARY KEY,
+                    created_at TEXT,
+                    leagues TEXT,
+                    strategies TEXT,
+                    quarters TEXT
                 )"""
             )
             _conn.commit()
+            db_writer = DBWriter(_conn)
+            db_writer.start()
+            atexit.register(db_writer.stop)
 
 
-def save_signal_log(event_id, league, home, away, quarter, line, recommendation, status, points):
+def read_db() -> sqlite3.Connection:
+    """Отдельное соединение для чтения (запись — только через DBWriter)"""
     init_db()
-    ts = datetime.utcnow().isoformat()
-    with _conn_lock:
-        cur = _conn.cursor()
-        cur.execute(
-            "INSERT INTO signals (ts,event_id,league,home,away,quarter,line,recommendation,status,points_in_quarter) VALUES (?,?,?,?,?,?,?,?,?,?)",
-            (ts, event_id, league, home, away, quarter, line, recommendation, status, points),
-        )
-        _conn.commit()
+    return sqlite3.connect(DB_PATH)
 
 
-# ------------ Состояние анализа ------------
-analyzing = False
-monitor_task_future = None
-# Отправленные сигналы: event_id -> {quarter: True}
-sent_signals: Dict[int, Dict[int, Dict[str, Any]]] = {}
-
-# ------------ HTTP клиента (aiohttp) ------------
-aio_session: Optional[aiohttp.ClientSession] = None
+# растёт после commit каждого изменения сводок (поток DBWriter) — по нему /stats сбрасывает кэш
+rollup_version = 0
 
 
-async def get_aio_session():
-    global aio_session
-    if aio_session is None:
-        aio_session = aiohttp.ClientSession()
-    return aio_session
+def _rollup_committed():
+    global rollup_version
+    rollup_version += 1
 
 
-# ------------ Получение списка live матчей (SofaScore) ------------
-async def get_live_events() -> List[Dict[str, Any]]:
-    """
-    Возвращает список текущих live-событий (basketball).
-    Возвращаемый формат — список объектов с по крайней мере полями:
-      id, homeTeam.name, awayTeam.name, status (period, description), homeScore.current, awayScore.current
-    """
-    try:
-        session = await get_aio_session()
-        url = "https://api.sofascore.com/api/v1/sport/basketball/events/live"
-        async with session.get(url, timeout=10) as resp:
-            if resp.status != 200:
-                return []
-            data = await resp.json()
-            events = data.get("events") or data.get("events", [])
-            return events
-    except Exception:
-        # если SofaScore недоступен — возвращаем пустой список
-        return []
+def _bump_rollup(cur, ts, league, strategy, signals, status):
+    for table, period, width in ROLLUP_TABLES:
+        cur.execute(
+            f"""INSERT INTO {table} ({period}, league, strategy, signals, passed, failed, void) VALUES (?,?,?,?,?,?,?)
+            ON CONFLICT ({period}, league, strategy) DO UPDATE SET
+                signals = signals + excluded.signals, passed = passed + excluded.passed,
+                failed = failed + excluded.failed, void = void + excluded.void""",
+            (ts[:width], league or "", strategy, signals, int(status == "PASSED"), int(status == "FAILED"), int(status == "VOID")),
+        )
 
 
-# ------------ Получение подробностей матча (summary / incidents) ------------
-async def get_event_summary(event_id: int) -> Dict[str, Any]:
+def _write_signal(
+    cur, ts, event_id, league, home, away, quarter, line, recommendation, status, points, period_seconds=None, strategy=None,
+    chat_ids=None,
+) -> bool:
     """
-    Возвращает подробности матча: периодные очки, фолы, состав, play-by-play.
-    Попробуем несколько эндпойнтов SofaScore.
+    Записать сигнал (PENDING) или его итог; False — запись пропущена. На (event_id, quarter) — одна строка.
+    strategy — имя правила (по умолчанию — четверть, "3Q"); по нему ведутся сводки /stats.
+    chat_ids — чаты, которым разослан сигнал (им же уйдёт итог после рестарта).
     """
-    session = await get_aio_session()
-    base = "https://api.sofascore.com/api/v1/event"
-    result = {}
-    try:
-        # match summary содержит периодные счёты и базовую статистику
-        url_summary = f"{base}/{event_id}/match-summary"
-        async with session.get(url_summary, timeout=10) as r:
-            if r.status == 200:
-                result["summary"] = await r.json()
-    except Exception:
-        pass
+    if status != "PENDING":
+        # итог по сигналу — только обновление уже записанной PENDING-строки
+        row = cur.execute(
+            "SELECT id, ts, COALESCE(strategy, quarter) FROM signals WHERE event_id=? AND quarter=? AND status='PENDING'",
+            (event_id, quarter),
+        ).fetchone()
+        if row is None:
+            logging.warning(f"Итог {status} для {event_id} {quarter}: PENDING-сигнала нет или он уже закрыт, пропускаю")
+            return False
+        cur.execute("UPDATE signals SET ts=?, status=?, points_in_quarter=? WHERE id=?", (ts, status, points, row[0]))
+        # строка переезжает на день итога — как её посчитала бы пересборка сводки по signals
+        _bump_rollup(cur, row[1] or ts, league, row[2], -1, "PENDING")
+        _bump_rollup(cur, ts, league, row[2], 1, status)
+        db_writer.after_commit(_rollup_committed)
+        return True
+    if cur.execute("SELECT 1 FROM signals WHERE event_id=? AND quarter=? LIMIT 1", (event_id, quarter)).fetchone():
+        logging.warning(f"Сигнал {event_id} {quarter} уже записан, повтор пропускаю")
+        return False
+    cur.execute(
+        "INSERT INTO signals "
+        "(ts,event_id,league,home,away,quarter,line,recommendation,status,points_in_quarter,period_seconds,strategy,chat_ids) "
+        "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+        (
+            ts, event_id, league, home, away, quarter, line, recommendation, status, points, period_seconds,
+            strategy or quarter, None if chat_ids is None else ",".join(str(c) for c in chat_ids),
+        ),
+    )
+    _bump_rollup(cur, ts, league, strategy or quarter, 1, status)
+    db_writer.after_commit(_rollup_committed)
+    return True
 
-    try:
-        # incidents — play-by-play (замены, фолы, штрафные)
-        url_inc = f"{base}/{event_id}/incidents"
-        async with session.get(url_inc, timeout=10) as r2:
-            if r2.status == 200:
-                result["incidents"] = await r2.json()
-    except Exception:
-        pass
 
-    return result
+def save_signal_log(
+    event_id, league, home, away, quarter, line, recommendation, status, points, period_seconds=None, strategy=None,
+    chat_ids=None,
+):
+    """Поставить запись сигнала/итога в очередь DBWriter (не блокирует вызывающий поток)"""
+    init_db()
+    ts = datetime.utcnow().isoformat()
+    db_writer.submit(
+        lambda cur: _write_signal(
+            cur, ts, event_id, league, home, away, quarter, line, recommendation, status, points, period_seconds, strategy,
+            chat_ids,
+        )
+    )
 
 
-# ------------ Утилиты для парсинга данных ------------
-def safe_get(d: Dict, *keys, default=None):
-    cur = d
-    for k in keys:
-        if not isinstance(cur, dict):
-            return default
-        cur = cur.get(k)
-        if cur is None:
-            return default
-    return cur
+# ------------ История проверок матчей (/checked) ------------
+MATCH_LOG_PATH = "matches.log"
+MATCH_LOG_MAX_BYTES = int(os.getenv("MATCH_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+MATCH_LOG_BACKUPS = int(os.getenv("MATCH_LOG_BACKUPS", "5"))
+CHECK_HISTORY_RECENT = 100  # сколько последних проверок держим в памяти
 
 
-def parse_period_scores(summary_json: Dict[str, Any]):
-    """
-    Попытка извлечь очки по четвертям из match-summary или event->home/away periodScores.
-    Вернёт список кортежей: [(h1,a1),(h2,a2),...]
-    """
-    periods = []
-    # вариант: summary_json может иметь "periods" или "home"->"periodScores"
-    try:
-        if not summary_json:
-            return periods
-        # попытка 1: summary_json['periods']
-        p = summary_json.get("periods")
-        if p and isinstance(p, list):
-            for item in p:
-                # item может содержать "homeScore" и "awayScore"
-                hs = item.get("homeScore") or item.get("home")
-                ascore = item.get("awayScore") or item.get("away")
-                if hs is not None and ascore is not None:
-                    periods.append((int(hs), int(ascore)))
-            if periods:
-                return periods
-        # попытка 2: summary_json['homeTeam']['periods'] и ['awayTeam']['periods']
-        home = summary_json.get("homeTeam")
-        away = summary_json.get("awayTeam")
-        if home and away:
-            # найти periodScores
-            h_periods = home.get("periodScores") or home.get("periods")
-            a_periods = away.get("periodScores") or away.get("periods")
-            if h_periods and a_periods and len(h_periods) == len(a_periods):
-                for i in range(len(h_periods)):
-                    periods.append((int(h_periods[i].get("score", 0)), int(a_periods[i].get("score", 0))))
-                return periods
-    except Exception:
-        return periods
-    return periods
+def check_terms(home: Optional[str], away: Optional[str], status: Optional[str]) -> set:
+    """Слова записи проверки для поиска: ("team", "lakers"), ("status", "3q"), ..."""
+    terms = {("team", w) for name in (home, away) for w in re.findall(r"\w+", (name or "").lower())}
+    return terms | {("status", w) for w in re.findall(r"\w+", (status or "").lower())}
 
 
-def get_current_period_and_clock(event_obj: Dict[str, Any]):
+class CheckHistory:
     """
-    Попытка взять номер четверти и оставшееся/прошедшее время (строка)
+    История проверок матчей:
+    - matches.log — структурированный (JSON-строки) лог с ротацией по размеру;
+    - кольцевой буфер последних записей в памяти — для /checked без аргументов;
+    - таблица checks в SQLite с индексами — для поиска по лиге/дате; команда и статус — по словам
+      из check_terms (индекс по (kind, term)), так что "Lakers" находит "Los Angeles Lakers".
     """
-    try:
-        status = event_obj.get("status", {})
-        period = status.get("period") or status.get("currentPeriod") or 0
-        desc = status.get("description") or status.get("time") or ""
-        return int(period), str(desc)
-    except Exception:
-        return 0, ""
 
+    def __init__(self):
+        self.recent: deque = deque(maxlen=CHECK_HISTORY_RECENT)
+        self._log = logging.getLogger("matches")
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+        self._handler_ready = False
 
-# ------------ Правила (стратегии) ------------
-def evaluate_strategy_1(event, summary) -> Optional[Dict[str, Any]]:
-    """
-    Стратегия 1 — 3Q
-    Возвращаем dict с данными сигнала, или None
-    """
-    # получаем текущую четверть
-    period, clock = get_current_period_and_clock(event)
-    if period != 3:
-        return None
+    def _ensure_handler(self):
+        if not self._handler_ready:
+            handler = logging.handlers.RotatingFileHandler(
+                MATCH_LOG_PATH, maxBytes=MATCH_LOG_MAX_BYTES, backupCount=MATCH_LOG_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._log.addHandler(handler)
+            self._handler_ready = True
 
-    # счёт
-    home = safe_get(event, "homeTeam", "name", default="Home")
-    away = safe_get(event, "awayTeam", "name", default="Away")
-    home_score = safe_get(event, "homeScore", "current", default=safe_get(event, "homeScore", "period1"))
-    away_score = safe_get(event, "awayScore", "current", default=safe_get(event, "awayScore", "period1"))
-    try:
-        home_score = int(home_score)
-        away_score = int(away_score)
-    except Exception:
-        return None
+    def add(self, match_name: str, status: str, event_id=None, home: str = "", away: str = "", league: str = ""):
+        ts = datetime.utcnow().isoformat(timespec="seconds")
+        entry = {"ts": ts, "event_id": event_id, "match": match_name, "league": league, "status": status}
+        self.recent.append(entry)
+        self._ensure_handler()
+        self._log.info(json.dumps(entry, ensure_ascii=False))
+        init_db()
+        row = (ts, event_id, home, away, home.lower(), away.lower(), league, league.lower(), status)
+        terms = check_terms(home, away, status)
 
-    # периодные очки
-    periods = []
-    if summary and "summary" in summary:
-        periods = parse_period_scores(summary["summary"])
+        def write(cur):
+            cur.execute(
+                "INSERT INTO checks (ts,event_id,home,away,home_lc,away_lc,league,league_lc,status) VALUES (?,?,?,?,?,?,?,?,?)",
+                row,
+            )
+            check_id = cur.lastrowid
+            cur.executemany(
+                "INSERT OR IGNORE INTO check_terms (kind, term, check_id) VALUES (?,?,?)",
+                [(kind, term, check_id) for kind, term in terms],
+            )
 
-    # очки в 3-й четверти
-    points_3q = None
-    if len(periods) >= 3:
-        h1, a1 = periods[0]
-        h2, a2 = periods[1]
-        h3, a3 = periods[2]
-        points_3q = h3 + a3
-    else:
-        # fallback: оценим по разнице общего и суммы первых двух (если присутствуют)
-        if len(periods) >= 2:
-            s = sum([p[0] + p[1] for p in periods[:2]])
-            points_3q = (home_score + away_score) - s
-
-    # статистика фолов и темпа (из summary или incidents)
-    fouls_home = fouls_away = None
-    tempo_text = "неизвестно"
-    lineup_info = "unknown"
-    if summary:
-        # попытка взять командные фолы из summary
+        db_writer.submit(write)
+
+    def load_recent(self):
+        """Заполнить кольцевой буфер из БД после рестарта"""
+        conn = read_db()
         try:
-            sumj = summary.get("summary") or {}
-            teamStats = sumj.get("teamStats") or {}
-            # иногда в другом формате — игнорируем, а используем incidents
-        except Exception:
-            pass
-    # incidents — можно парсить play-by-play чтобы посчитать фолы
-    if summary and "incidents" in summary:
+            rows = conn.execute(
+                "SELECT ts, event_id, home, away, league, status FROM checks ORDER BY ts DESC LIMIT ?",
+                (CHECK_HISTORY_RECENT,),
+            ).fetchall()
+        finally:
+            conn.close()
+        self.recent.clear()
+        for ts, event_id, home, away, league, status in reversed(rows):
+            self.recent.append({"ts": ts, "event_id": event_id, "match": f"{home} – {away}", "league": league, "status": status})
+
+    def last(self, n: int = 10) -> List[Dict[str, Any]]:
+        return list(itertools.islice(reversed(self.recent), n))[::-1]
+
+    def query(self, team: str = "", league: str = "", date: str = "", status: str = "", limit: int = 10):
+        """
+        Поиск по истории без учёта регистра. team и status — по словам: каждое слово запроса — начало
+        слова в названии команды / статусе ("Lakers", "los ang", "3q", "signal 4Q", "pass");
+        league — по началу названия, date — YYYY-MM-DD
+        """
+        where, params = [], []
+        for kind, text in (("team", team), ("status", status)):
+            words = re.findall(r"\w+", text.lower())
+            if text and not words:
+                where.append("0")  # в запросе нет ни одного слова — совпадений нет
+            for word in words:
+                where.append("id IN (SELECT check_id FROM check_terms WHERE kind = ? AND term >= ? AND term < ?)")
+                params += [kind, word, word + "\uffff"]
+        if league:
+            l = league.lower()
+            where.append("league_lc >= ? AND league_lc < ?")
+            params += [l, l + "\uffff"]
+        if date:
+            where.append("ts >= ? AND ts < ?")
+            params += [date, date + "T\uffff"]
+        sql = "SELECT ts, event_id, home, away, league, status FROM checks"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC LIMIT ?"
+        params.append(limit)
+        conn = read_db()
         try:
-            inc = summary["incidents"]
-            # считаем фолы за текущую четверть
-            fouls_home = fouls_away = 0
-            for it in inc.get("incidents", []) if isinstance(inc, dict) else (inc or []):
-                typ = it.get("type")
-                team = it.get("team", {}).get("id")
-                # немного эвристики: тип "foul" или "personalFoul"
-                if typ and "foul" in str(typ).lower():
-                    if team == safe_get(event, "homeTeam", "id"):
-                        fouls_home += 1
-                    else:
-                        fouls_away += 1
-        except Exception:
-            fouls_home = fouls_away = None
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        return [
+            {"ts": ts, "event_id": event_id, "match": f"{home} – {away}", "league": league_, "status": status_}
+            for ts, event_id, home, away, league_, status_ in reversed(rows)
+        ]
 
-    # Простая логика: если в 3Q уже набрано >= 12 очков (за 5 минут/половину четверти)
-    # или points_3q >= 12 и tempo/фолы позволяют — даём сигнал.
-    if points_3q is None:
-        return None
-    # thresholds — регулируемые
-    if points_3q >= 12:
-        line_estimate = 37.5  # пример, можно вычислять динамически
-        return {
-            "strategy": "3Q",
-            "reason": f"Points in 3Q = {points_3q}",
-            "home": home,
-            "away": away,
-            "points_in_quarter": points_3q,
-            "line": line_estimate,
-            "fouls": (fouls_home, fouls_away),
-            "tempo": tempo_text,
-            "line_type": "ТБ",
-            "quarter": 3,
-            "clock": clock,
-        }
-    return None
 
+check_history = CheckHistory()
+# event_id -> четверть, в которой игра последний раз попала в историю проверок (чтобы писать раз в четверть)
+checked_periods: Dict[int, int] = {}
 
-def evaluate_strategy_2(event, summary) -> Optional[Dict[str, Any]]:
+
+# Функция для записи проверки матча
+def log_match(match_name, status="checked", event_id=None, home="", away="", league=""):
+    if shard_sink is not None:
+        shard_sink.put(("check", match_name, status, event_id, home, away, league))
+        return
+    check_history.add(match_name, status, event_id, home, away, league)
+
+
+def format_checks(entries: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"{e['ts'].replace('T', ' ')} - {e['match']}" + (f" ({e['league']})" if e.get("league") else "") + f" - {e['status']}"
+        for e in entries
+    )
+
+
+# ------------ Статистика сигналов (/stats) ------------
+# /stats читает только сводки (строк — дни или месяцы × лиги × стратегии), а не signals:
+# целые месяцы периода — из signal_rollup_month, края — из дневной signal_rollup
+STATS_DEFAULT_DAYS = int(os.getenv("STATS_DEFAULT_DAYS", "30"))
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "60"))  # ответ живёт, пока нет новых итогов, но не дольше
+STATS_ODDS = float(os.getenv("STATS_ODDS", "1.87"))  # коэффициент для ROI (как в backtest.py)
+STATS_TOP_LEAGUES = 5
+STATS_SECONDS = Histogram("stats_query_seconds", "Время запроса /stats к сводке (без кэша)", LATENCY_BUCKETS)
+METRICS.append(STATS_SECONDS)
+
+# (стратегия, лига, дней) -> (rollup_version, monotonic, текст)
+_stats_cache: Dict[tuple, tuple] = {}
+
+
+def parse_stats_args(args: List[str]):
     """
-    Стратегия 2 — 4Q
-    Возвращаем dict с данными сигнала, или None
+    "3Q 7d league=NBA" -> ("3Q", "NBA", 7). Период: today, Nd (дней), all; слова без ключа — название лиги.
+    days=None — за всё время.
     """
-    period, clock = get_current_period_and_clock(event)
-    if period != 4:
-        return None
+    strategy, league, days = "", [], STATS_DEFAULT_DAYS
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        low = arg.lower()
+        if sep and key == "league":
+            league.append(value)
+        elif sep and key == "strategy":
+            strategy = value.upper()
+        elif re.fullmatch(r"\dq", low):
+            strategy = arg.upper()
+        elif low in ("today", "сегодня"):
+            days = 0
+        elif low in ("all", "всё", "все"):
+            days = None
+        elif re.fullmatch(r"\d+[dд]", low):
+            days = int(low[:-1])
+        else:
+            league.append(arg)
+    return strategy, " ".join(league), days
 
-    home = safe_get(event, "homeTeam", "name", default="Home")
-    away = safe_get(event, "awayTeam", "name", default="Away")
+
+def query_stats(strategy: str = "", league: str = "", days: Optional[int] = STATS_DEFAULT_DAYS) -> Dict[str, Any]:
+    """Сигналы / прошло / не прошло / VOID по стратегиям и самые активные лиги за период"""
+    sources = []  # (таблица, условия по периоду, параметры)
+    if days is None:
+        sources.append(("signal_rollup_month", [], []))
+    else:
+        since = datetime.utcfromtimestamp(time.time() - days * 86400).date()
+        month = since if since.day == 1 else (since.replace(day=1) + timedelta(days=31)).replace(day=1)
+        if days > 62:
+            sources.append(("signal_rollup", ["day >= ?", "day < ?"], [since.isoformat(), month.isoformat()]))
+            sources.append(("signal_rollup_month", ["month >= ?"], [month.isoformat()[:7]]))
+        else:
+            sources.append(("signal_rollup", ["day >= ?"], [since.isoformat()]))
+    selects, params = [], []
+    for table, where, values in sources:
+        where = list(where)
+        values = list(values)
+        if strategy:
+            where.append("strategy = ? COLLATE NOCASE")
+            values.append(strategy)
+        if league:
+            where.append("league = ? COLLATE NOCASE")
+            values.append(league)
+        cond = ("WHERE " + " AND ".join(where)) if where else ""
+        selects.append(f"SELECT league, strategy, signals, passed, failed, void FROM {table} {cond}")
+        params += values
+    rows = " UNION ALL ".join(selects)
+    started = time.monotonic()
+    conn = read_db()
     try:
-        home_score = int(safe_get(event, "homeScore", "current", default=0))
-        away_score = int(safe_get(event, "awayScore", "current", default=0))
-    except Exception:
-        return None
+        by_strategy = conn.execute(
+            f"SELECT strategy, SUM(signals), SUM(passed), SUM(failed), SUM(void) FROM ({rows}) GROUP BY strategy ORDER BY strategy",
+            params,
+        ).fetchall()
+        leagues = [] if league else conn.execute(
+            f"SELECT league, SUM(signals), SUM(passed), SUM(failed), SUM(void) FROM ({rows}) "
+            f"GROUP BY league ORDER BY SUM(signals) DESC LIMIT {STATS_TOP_LEAGUES}",
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+    STATS_SECONDS.observe(time.monotonic() - started)
+    return {"strategies": by_strategy, "leagues": leagues}
 
-    diff = abs(home_score - away_score)
 
-    # quick thresholds
-    if diff <= 7:
-        # check fouls/time/tempo via summary/incidents (best-effort)
-        fouls_home = fouls_away = None
-        if summary and "incidents" in summary:
-            try:
-                inc = summary["incidents"]
-                fouls_home = fouls_away = 0
-                for it in inc.get("incidents", []) if isinstance(inc, dict) else (inc or []):
-                    if "foul" in str(it.get("type", "")).lower():
-                        if it.get("team", {}).get("id") == safe_get(event, "homeTeam", "id"):
-                            fouls_home += 1
-                        else:
-                            fouls_away += 1
-            except Exception:
-                fouls_home = fouls_away = None
+def _stats_line(signals: int, passed: int, failed: int, void: int) -> str:
+    # VOID (игра отменена / итога не дождались) — не ставка: нет ни в "без итога", ни в hit rate и ROI
+    settled = passed + failed
+    voided = f", аннулировано {void}" if void else ""
+    if not settled:
+        return f"сигналов {signals}{voided}, итогов пока нет"
+    pnl = passed * (STATS_ODDS - 1) - failed
+    return (
+        f"сигналов {signals}, прошло {passed}, не прошло {failed}{voided}, без итога {signals - settled - void}, "
+        f"hit rate {passed / settled:.1%}, ROI {pnl / settled:+.1%}"
+    )
 
-        line_estimate = 39.5
-        return {
-            "strategy": "4Q",
-            "reason": f"Diff={diff}",
-            "home": home,
-            "away": away,
-            "current_score": f"{home_score}:{away_score}",
-            "line": line_estimate,
-            "fouls": (fouls_home, fouls_away),
-            "quarter": 4,
-            "clock": clock,
-            "line_type": "ТБ",
-            "recommendation_type": "оптимальный",
-        }
-    return None
 
+def format_stats(stats: Dict[str, Any], strategy: str, league: str, days: Optional[int]) -> str:
+    period = "всё время" if days is None else ("сегодня" if days == 0 else f"{days} дн.")
+    title = f"📈 Статистика за {period}" + (f", {strategy}" if strategy else "") + (f", лига: {league}" if league else "")
+    if not stats["strategies"]:
+        return title + "\nСигналов нет."
+    lines = [title]
+    for name, *counts in stats["strategies"]:
+        lines.append(f"[{name}] " + _stats_line(*counts))
+    if len(stats["strategies"]) > 1:
+        lines.append("Всего: " + _stats_line(*(sum(row[i] for row in stats["strategies"]) for i in (1, 2, 3, 4))))
+    if stats["leagues"]:
+        lines.append("Лиги:")
+        lines += [f"— {name or '?'}: " + _stats_line(*counts) for name, *counts in stats["leagues"]]
+    lines.append(f"ROI — при коэффициенте {STATS_ODDS}")
+    return "\n".join(lines)
 
-# ------------ Отправка сигнала и отметка в sent_signals ------------
-def mark_signal_sent(event_id: int, quarter: int, payload: Dict[str, Any]):
-    sent_signals.setdefault(event_id, {})
-    sent_signals[event_id][quarter] = payload
 
+def stats_text(strategy: str = "", league: str = "", days: Optional[int] = STATS_DEFAULT_DAYS) -> str:
+    """Текст /stats; кэшируется, пока сводка не менялась (и не дольше STATS_CACHE_TTL — из-за смены дня)"""
+    key = (strategy, league.lower(), days)
+    now = time.monotonic()
+    hit = _stats_cache.get(key)
+    if hit is not None and hit[0] == rollup_version and now - hit[1] < STATS_CACHE_TTL:
+        return hit[2]
+    version = rollup_version
+    text = format_stats(query_stats(strategy, league, days), strategy, league, days)
+    if len(_stats_cache) >= 256:
+        _stats_cache.clear()
+    _stats_cache[key] = (version, now, text)
+    return text
 
-# ------------ Формирование текстов сообщений ------------
-def format_signal_message(event_id: int, signal: Dict[str, Any]):
-    # Универсальный формат
-    if signal["strategy"] == "3Q":
-        return (
-            f"🏀 Сигнал [3Q]\n"
-            f"Матч: {signal.get('home')} – {signal.get('away')}\n"
-            f"Текущий счёт: {safe_get(signal, 'current_score', default='-')}\n"
-            f"Время: {signal.get('clock')}\n\n"
-            f"📊 Данные:\n"
-            f"— Очки в 3Q: {signal.get('points_in_quarter')} \n"
-            f"— Фолы: {signal.get('fouls')}\n"
-            f"— Темп: {signal.get('tempo')}\n"
-            f"— Состав: {signal.get('line_type')}\n\n"
-            f"💡 Рекомендация: {signal.get('line_type')} {signal.get('line')}\n"
-            f"🎯 Вход: оптимальный\n"
-            f"Причина: {signal.get('reason')}"
-        )
-    else:
+
+# ------------ Подписки чатов ------------
+class Subscription:
+    """Подписка чата на сигналы. Пустой фильтр — без ограничений."""
+
+    __slots__ = ("chat_id", "leagues", "strategies", "quarters")
+
+    def __init__(self, chat_id: int, leagues=(), strategies=(), quarters=()):
+        self.chat_id = chat_id
+        self.leagues = frozenset(l.strip().lower() for l in leagues if l.strip())
+        self.strategies = frozenset(s.strip().upper() for s in strategies if s.strip())
+        self.quarters = frozenset(int(q) for q in quarters)
+
+    def matches(self, league: str, strategy: str, quarter: int) -> bool:
+        if self.leagues and not any(l in league for l in self.leagues):
+            return False
+        if self.strategies and strategy.upper() not in self.strategies:
+            return False
+        if self.quarters and quarter not in self.quarters:
+            return False
+        return True
+
+    def describe(self) -> str:
         return (
-            f"🏀 Сигнал [4Q]\n"
-            f"Матч: {signal.get('home')} – {signal.get('away')}\n"
-            f"Текущий счёт: {signal.get('current_score', '-')}\n"
-            f"Время: {signal.get('clock')}\n\n"
-            f"📊 Данные:\n"
-            f"— Фолы: {signal.get('fouls')}\n"
-            f"— Рекомендация: {signal.get('recommendation_type')}\n\n"
-            f"💡 Рекомендация: {signal.get('line_type')} {signal.get('line')}\n"
-            f"🎯 Вход: оптимальный\n"
-            f"Причина: {signal.get('reason')}"
+            f"Лиги: {', '.join(sorted(self.leagues)) or 'все'}\n"
+            f"Стратегии: {', '.join(sorted(self.strategies)) or 'все'}\n"
+            f"Четверти: {', '.join(str(q) for q in sorted(self.quarters)) or 'все'}"
         )
 
 
-def format_result_message(event_id: int, signal_payload: Dict[str, Any], points_in_quarter: int):
-    line = signal_payload.get("line", 0)
-    passed = (points_in_quarter > line)  # мы ставим ТБ
-    mark = "✅ Прошла" if passed else "❌ Не прошла"
-    return (
-        f"{'✅' if passed else '❌'} Итог [{signal_payload.get('quarter')}Q]\n"
-        f"Матч: {signal_payload.get('home')} – {signal_payload.get('away')}\n"
-        f"Ставка: {signal_payload.get('line_type')} {line}\n"
-        f"Очки в {signal_payload.get('quarter')}Q: {points_in_quarter} → {mark}"
-    ), passed
+class SubscriptionRegistry:
+    """
+    Подписки всех чатов: в памяти для рассылки, в SQLite (таблица subscriptions) — чтобы пережить рестарт.
+    Список получателей кэшируется по (лига, стратегия, четверть), так что сигнал считается один раз,
+    а подбор подписчиков не пересчитывается на каждый сигнал.
+    """
 
+    def __init__(self):
+        self._subs: Dict[int, Subscription] = {}
+        self._match_cache: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
 
-# ------------ Анализ одного события (game) ------------
-async def analyze_single_event(event: Dict[str, Any], chat_id: int):
+    def __len__(self):
+        return len(self._subs)
+
+    def load(self):
+        conn = read_db()
+        try:
+            rows = conn.execute("SELECT chat_id, leagues, strategies, quarters FROM subscriptions").fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for chat_id, leagues, strategies, quarters in rows:
+                self._subs[chat_id] = Subscription(
+                    chat_id,
+                    (leagues or "").split(","),
+                    (strategies or "").split(","),
+                    [q for q in (quarters or "").split(",") if q],
+                )
+            self._match_cache.clear()
+
+    def get(self, chat_id: int) -> Optional[Subscription]:
+        return self._subs.get(chat_id)
+
+    def put(self, sub: Subscription):
+        with self._lock:
+            self._subs[sub.chat_id] = sub
+            self._match_cache.clear()
+        row = (
+            sub.chat_id,
+            datetime.utcnow().isoformat(),
+            ",".join(sorted(sub.leagues)),
+            ",".join(sorted(sub.strategies)),
+            ",".join(str(q) for q in sorted(sub.quarters)),
+        )
+        init_db()
+        db_writer.submit(lambda cur: cur.execute(
+            "INSERT INTO subscriptions (chat_id, created_at, leagues, strategies, quarters) VALUES (?,?,?,?,?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET leagues=excluded.leagues, strategies=excluded.strategies, quarters=excluded.quarters",
+            row,
+        ))
+
+    def remove(self, chat_id: int) -> bool:
+        with self._lock:
+            removed = self._subs.pop(chat_id, None) is not None
+            self._match_cache.clear()
+        if removed:
+            init_db()
+            db_writer.submit(lambda cur: cur.execute("DELETE FROM subscriptions WHERE chat_id=?", (chat_id,)))
+        return removed
+
+    def all_chats(self) -> tuple:
+        return tuple(self._subs)
+
+    def match(self, league: str, strategy: str, quarter: int) -> tuple:
+        key = (league, strategy, quarter)
+        chats = self._match_cache.get(key)
+        if chats is None:
+            league_lc = league.lower()
+            with self._lock:
+                chats = tuple(s.chat_id for s in self._subs.values() if s.matches(league_lc, strategy, quarter))
+                self._match_cache[key] = chats
+        return chats
+
+
+subscriptions = SubscriptionRegistry()
+
+
+# ------------ Состояние анализа ------------
+# analyzing — общий конвейер мониторинга запущен (один на всех подписчиков)
+analyzing = False
+monitor_task_future = None
+SIGNAL_STATE_TTL = float(os.getenv("SIGNAL_STATE_TTL", str(3 * 3600)))  # сколько держать игру после ухода из live
+SIGNAL_STATE_RESTORE_HOURS = float(os.getenv("SIGNAL_STATE_RESTORE_HOURS", "12"))  # глубина восстановления при старте
+
+
+class SignalRecord:
+    """
+    Отправленный сигнал по одной четверти одной игры (компактно, без исходного payload).
+    recipients — чаты, которым ушёл сигнал: итог шлём им, а не тем, кто подходит по фильтрам сейчас;
+    None — получатели неизвестны (строка signals старого формата).
+    """
+
+    __slots__ = (
+        "event_id", "quarter", "strategy", "league", "home", "away", "line", "line_type", "reported_result", "recipients",
+    )
+
+    def __init__(
+        self, event_id, quarter, strategy, league, home, away, line, line_type="ТБ", reported_result=None, recipients=None
+    ):
+        self.event_id = event_id
+        self.quarter = quarter
+        self.strategy = strategy
+        self.league = league
+        self.home = home
+        self.away = away
+        self.line = line
+        self.line_type = line_type
+        self.reported_result = reported_result
+        self.recipients = recipients
+
+    def get(self, key: str, default=None):
+        # совместимость с форматтерами, которые работают с dict-сигналами
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+
+class SentSignalStore:
+    """
+    Отправленные сигналы: event_id -> {quarter: SignalRecord}. Служит для дедупликации и ожидания итогов.
+    Источник правды — таблица signals (save_signal_log пишет туда каждый сигнал и итог),
+    поэтому после рестарта состояние восстанавливается одним запросом по индексу ts.
+    Игры, которые SIGNAL_STATE_TTL секунд не появлялись в live, вытесняются из памяти.
+    """
+
+    def __init__(self):
+        self._events: Dict[int, Dict[int, SignalRecord]] = {}
+        self._last_seen: Dict[int, float] = {}
+
+    def __len__(self):
+        return len(self._events)
+
+    def get(self, event_id: int, quarter: int) -> Optional[SignalRecord]:
+        quarters = self._events.get(event_id)
+        return quarters.get(quarter) if quarters else None
+
+    def for_event(self, event_id: int) -> Dict[int, SignalRecord]:
+        return self._events.get(event_id) or {}
+
+    def add(self, record: SignalRecord):
+        self._events.setdefault(record.event_id, {})[record.quarter] = record
+        self._last_seen[record.event_id] = time.monotonic()
+
+    def mark_reported(self, event_id: int, quarter: int):
+        record = self.get(event_id, quarter)
+        if record is not None:
+            record.reported_result = True
+
+    def discard(self, event_id: int):
+        self._events.pop(event_id, None)
+        self._last_seen.pop(event_id, None)
+
+    def touch(self, event_ids):
+        """Игры, которые сейчас есть в live-списке"""
+        now = time.monotonic()
+        for event_id in event_ids:
+            if event_id in self._events:
+                self._last_seen[event_id] = now
+
+    def evict(self, ttl: float = SIGNAL_STATE_TTL) -> int:
+        deadline = time.monotonic() - ttl
+        stale = [event_id for event_id, seen in self._last_seen.items() if seen < deadline]
+        for event_id in stale:
+            self.discard(event_id)
+        return len(stale)
+
+    def restore(self, hours: float = SIGNAL_STATE_RESTORE_HOURS) -> int:
+        """Восстановить дедупликацию и ожидающие итоги из signals.db после рестарта"""
+        since = datetime.utcfromtimestamp(time.time() - hours * 3600).isoformat()
+        conn = read_db()
+        try:
+            rows = conn.execute(
+                "SELECT event_id, quarter, COALESCE(strategy, quarter), league, home, away, line, status, chat_ids "
+                "FROM signals WHERE ts >= ?",
+                (since,),
+            ).fetchall()
+        finally:
+            conn.close()
+        for event_id, quarter, strategy, league, home, away, line, status, chat_ids in rows:
+            try:
+                q = int(str(quarter).rstrip("Q"))
+            except ValueError:
+                continue
+            self.add(SignalRecord(
+                event_id, q, strategy, league, home, away, line,
+                reported_result=None if status == "PENDING" else True,
+                recipients=None if chat_ids is None else tuple(int(c) for c in chat_ids.split(",") if c),
+            ))
+        return len(rows)
+
+
+# Отправленные сигналы: event_id -> {quarter: SignalRecord}
+sent_signals = SentSignalStore()
+
+# ------------ HTTP клиента (aiohttp) ------------
+SOFASCORE_API = os.getenv("SOFASCORE_API", "https://api.sofascore.com/api/v1")  # loadtest.py подставляет свой сервер
+# Один пул соединений на весь процесс: keep-alive к api.sofascore.com, кэш DNS, лимиты сокетов
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))  # всего соединений (в fallback — потоков)
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "50"))  # соединений на один хост
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))  # держать простаивающее соединение, сек
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))  # кэш DNS, сек
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+
+aio_session: Optional[aiohttp.ClientSession] = None
+# Счётчик запросов к SofaScore (для метрик планировщика: запросов в секунду)
+http_stats: Dict[str, int] = {"requests": 0, "in_flight": 0}
+
+
+def _new_session():
+    if not hasattr(aiohttp, "TCPConnector"):
+        # fallback на requests: DNS кэширует ОС, сжатие (gzip/deflate) requests включает сам
+        return aiohttp.ClientSession(HTTP_POOL_SIZE, HTTP_POOL_PER_HOST, HTTP_TIMEOUT)
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE,
+        limit_per_host=HTTP_POOL_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE,
+        ttl_dns_cache=HTTP_DNS_TTL,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        headers={"Accept-Encoding": "gzip, deflate"},
+        auto_decompress=True,
+    )
+
+
+async def get_aio_session():
+    global aio_session
+    if aio_session is None:
+        aio_session = _new_session()
+    return aio_session
+
+
+def http_pool_stats() -> Dict[str, int]:
+    """Загрузка пула: лимит, запросов в работе, занятых/свободных соединений (или ждущих потока в fallback)"""
+    stats = {"limit": HTTP_POOL_SIZE, "in_flight": http_stats["in_flight"]}
+    session = aio_session
+    if session is None:
+        return stats
+    if hasattr(session, "pool_stats"):
+        stats.update(session.pool_stats())
+        return stats
+    connector = session.connector
+    # у aiohttp нет публичного API для этого — читаем внутренние поля осторожно
+    stats["in_use"] = len(getattr(connector, "_acquired", ()))
+    stats["idle"] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+    return stats
+
+
+async def close_aio_session():
+    global aio_session
+    if aio_session is not None:
+        session, aio_session = aio_session, None
+        await session.close()
+
+
+# ------------ Декодирование JSON (orjson / msgspec, если установлены) ------------
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")  # auto | msgspec | orjson | json
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _pick_json_backend(name: str):
+    if name in ("auto", "orjson") and orjson is not None:
+        return "orjson", orjson.loads
+    if name in ("auto", "msgspec", "orjson") and msgspec is not None:
+        return "msgspec", msgspec.json.decode
+    return "json", json.loads
+
+
+json_backend, json_loads = _pick_json_backend(JSON_BACKEND)
+
+
+# Проекции: только поля, которые читают стратегии, планировщик и /checked.
+# Остальное msgspec пропускает, не создавая объектов. Результат — обычные (маленькие) dict'ы,
+# поэтому safe_get, запись снимков и бэктест работают с ними так же, как с полным ответом.
+# Листовые значения — Any: SofaScore не всегда строг в типах, а проверка типов нам не нужна.
+class _TeamP(TypedDict, total=False):
+    id: Any
+    name: Any
+    shortName: Any
+
+
+class _ScoreP(TypedDict, total=False):
+    current: Any
+    display: Any
+    period1: Any
+    period2: Any
+    period3: Any
+    period4: Any
+    period5: Any
+    period6: Any
+    period7: Any
+    overtime: Any
+
+
+class _StatusP(TypedDict, total=False):
+    code: Any
+    description: Any
+    type: Any
+    period: Any
+    currentPeriod: Any
+
+
+class _TimeP(TypedDict, total=False):
+    played: Any
+    periodLength: Any
+    overtimeLength: Any
+    totalPeriodCount: Any
+    currentPeriodStartTimestamp: Any
+
+
+class _UniqueTournamentP(TypedDict, total=False):
+    id: Any
+    name: Any
+
+
+class _TournamentP(TypedDict, total=False):
+    id: Any
+    name: Any
+    uniqueTournament: Optional[_UniqueTournamentP]
+
+
+class _EventP(TypedDict, total=False):
+    id: Any
+    startTimestamp: Any
+    homeTeam: Optional[_TeamP]
+    awayTeam: Optional[_TeamP]
+    homeScore: Optional[_ScoreP]
+    awayScore: Optional[_ScoreP]
+    status: Optional[_StatusP]
+    time: Optional[_TimeP]
+    tournament: Optional[_TournamentP]
+    lastPeriod: Any
+
+
+class _LiveP(TypedDict, total=False):
+    events: List[_EventP]
+
+
+class _IncidentTeamP(TypedDict, total=False):
+    id: Any
+
+
+class _IncidentP(TypedDict, total=False):
+    id: Any
+    type: Any
+    incidentType: Any
+    incidentClass: Any
+    time: Any
+    period: Any
+    text: Any
+    homeScore: Any
+    awayScore: Any
+    isHome: Any
+    team: Optional[_IncidentTeamP]
+
+
+class _IncidentsP(TypedDict, total=False):
+    incidents: List[_IncidentP]
+
+
+# эндпойнт -> проекция (match-summary без проекции: формат периодных очков у SofaScore плавает)
+JSON_PROJECTIONS = {"live": _LiveP, "incidents": _IncidentsP}
+JSON_PROJECT = os.getenv("JSON_PROJECT", "1") == "1"
+_projection_decoders: Dict[str, Any] = {}
+if msgspec is not None and JSON_PROJECT:
+    _projection_decoders = {endpoint: msgspec.json.Decoder(t) for endpoint, t in JSON_PROJECTIONS.items()}
+
+DECODE_SECONDS = Histogram("json_decode_seconds", "Время разбора JSON-ответа SofaScore", (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+DECODE_FALLBACKS = Counter("json_projection_fallbacks_total", "Ответ не подошёл под проекцию — разобран целиком")
+METRICS += [DECODE_SECONDS, DECODE_FALLBACKS]
+
+
+def decode_json(body: bytes, endpoint: str) -> Any:
+    """Разобрать ответ эндпойнта: по проекции (msgspec), иначе целиком самым быстрым бэкендом"""
+    started = time.perf_counter()
+    try:
+        decoder = _projection_decoders.get(endpoint)
+        if decoder is not None:
+            try:
+                return decoder.decode(body)
+            except msgspec.ValidationError:
+                DECODE_FALLBACKS.inc(endpoint=endpoint)
+        return json_loads(body)
+    finally:
+        DECODE_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+
+
+# ------------ Circuit breaker по эндпойнтам SofaScore ------------
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))  # ошибок подряд до размыкания (429 — сразу)
+BACKOFF_BASE = float(os.getenv("BACKOFF_BASE", "1"))  # первая пауза после размыкания, сек
+BACKOFF_MAX = float(os.getenv("BACKOFF_MAX", "120"))
+BREAKER_REJECTED = Counter("sofascore_breaker_rejected_total", "Запросы, не отправленные из-за разомкнутого breaker'а")
+METRICS.append(BREAKER_REJECTED)
+
+
+class SofaScoreError(Exception):
+    """SofaScore ответил ошибкой (429 / 5xx)"""
+
+    def __init__(self, endpoint: str, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"{endpoint}: HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: breaker эндпойнта разомкнут"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class CircuitBreaker:
+    """
+    closed -> (BREAKER_FAILURES ошибок подряд или 429) -> open: запросы не отправляются
+    паузу = экспоненциальный backoff с jitter (не меньше Retry-After) -> half-open: один пробный запрос;
+    успех -> closed, ошибка -> снова open с удвоенной паузой. Пока breaker не closed, считается
+    только ошибка пробного запроса: запросы, ушедшие до размыкания, паузу не удлиняют.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0  # размыканий подряд (для роста паузы)
+        self.open_until = 0.0
+        self._probe = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if time.monotonic() < self.open_until or self._probe:
+            return False
+        self.state = "half-open"
+        self._probe = True  # пропускаем один пробный запрос
+        return True
+
+    def retry_in(self) -> float:
+        return max(0.0, self.open_until - time.monotonic()) if self.state != "closed" else 0.0
+
+    def success(self):
+        if self.state != "closed":
+            logging.info(f"SofaScore {self.name}: снова доступен")
+        self.state = "closed"
+        self.failures = self.opens = 0
+        self._probe = False
+
+    def release(self):
+        """Пробный запрос отменён (CancelledError) — ни успех, ни ошибка; слот освобождается"""
+        self._probe = False
+
+    def failure(self, retry_after: Optional[float] = None, rate_limited: bool = False, probe: bool = False):
+        if self.state != "closed" and not probe:
+            return  # запрос ушёл до размыкания — эта авария уже учтена
+        self.failures += 1
+        self._probe = False
+        if self.state == "closed" and not rate_limited and self.failures < BREAKER_FAILURES:
+            return
+        self.opens += 1
+        backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.opens - 1))
+        delay = max(retry_after or 0.0, backoff / 2 + random.random() * backoff / 2)
+        if self.state == "closed":
+            logging.warning(f"SofaScore {self.name}: breaker разомкнут на {delay:.1f} с")
+        self.state = "open"
+        self.open_until = time.monotonic() + delay
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    b = breakers.get(endpoint)
+    if b is None:
+        b = breakers[endpoint] = CircuitBreaker(endpoint)
+    return b
+
+
+# ------------ Кэш ответов SofaScore (ETag / Last-Modified + TTL) ------------
+HTTP_CACHE_MAX_ENTRIES = int(os.getenv("HTTP_CACHE_MAX_ENTRIES", "2000"))
+# TTL по эндпойнтам (сек): пока TTL не истёк — отдаём из кэша без запроса,
+# после — делаем условный запрос (If-None-Match / If-Modified-Since)
+CACHE_TTL: Dict[str, float] = {
+    "live": float(os.getenv("CACHE_TTL_LIVE", "0")),
+    "match-summary": float(os.getenv("CACHE_TTL_SUMMARY", "0")),
+    "incidents": float(os.getenv("CACHE_TTL_INCIDENTS", "0")),
+    "finished": float(os.getenv("CACHE_TTL_FINISHED", "3600")),  # завершённые игры больше не меняются
+}
+
+
+class ResponseCache:
+    """
+    LRU-кэш JSON-ответов по URL. Хранит распарсенные данные и валидаторы (ETag / Last-Modified),
+    чтобы на повторный запрос получить 304 вместо всего тела.
+    """
+
+    def __init__(self, max_entries: int = HTTP_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.stats: Dict[str, int] = {
+            "hits": 0,  # отдано из кэша без запроса (TTL не истёк)
+            "not_modified": 0,  # 304 — тело не качали
+            "misses": 0,  # полный ответ 200
+            "evictions": 0,
+            "bytes_downloaded": 0,
+            "bytes_saved": 0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def put(self, url: str, data: Any, size: int, etag: Optional[str], last_modified: Optional[str]):
+        self._entries[url] = {
+            "data": data,
+            "size": size,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": time.monotonic(),
+        }
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def touch(self, url: str):
+        entry = self._entries.get(url)
+        if entry is not None:
+            entry["stored_at"] = time.monotonic()
+
+    def conditional_headers(self, entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+http_cache = ResponseCache()
+
+
+async def fetch_json(url: str, endpoint: str, ttl: Optional[float] = None) -> Optional[Any]:
+    """
+    GET с кэшем: свежий по TTL ответ — из памяти, устаревший — условный запрос, 304 — из памяти.
+    Возвращает распарсенный JSON или None (404 и прочие не-ошибки).
+    429 / 5xx -> SofaScoreError, разомкнутый breaker эндпойнта -> CircuitOpenError.
+    """
+    if ttl is None:
+        ttl = CACHE_TTL.get(endpoint, 0)
+    entry = http_cache.get(url)
+    if entry is not None and ttl > 0 and time.monotonic() - entry["stored_at"] < ttl:
+        http_cache.stats["hits"] += 1
+        http_cache.stats["bytes_saved"] += entry["size"]
+        SOFASCORE_REQUESTS.inc(endpoint=endpoint, result="cache")
+        return entry["data"]
+
+    breaker = get_breaker(endpoint)
+    if not breaker.allow():
+        BREAKER_REJECTED.inc(endpoint=endpoint)
+        raise CircuitOpenError(endpoint)
+    probe = breaker.state == "half-open"  # allow() пропускает не в closed только пробный запрос
+    session = await get_aio_session()
+    http_stats["requests"] += 1
+    http_stats["in_flight"] += 1
+    started = time.monotonic()
+    result = "error"
+    try:
+        async with session.get(url, headers=http_cache.conditional_headers(entry)) as resp:
+            result = str(resp.status)
+            if resp.status == 304 and entry is not None:
+                http_cache.stats["not_modified"] += 1
+                http_cache.stats["bytes_saved"] += entry["size"]
+                http_cache.touch(url)
+                breaker.success()
+                return entry["data"]
+            if resp.status == 429 or resp.status >= 500:
+                raise SofaScoreError(endpoint, resp.status, parse_retry_after(resp.headers.get("Retry-After")))
+            if resp.status != 200:
+                breaker.success()  # 404 и т.п. — SofaScore отвечает, просто данных нет
+                return None
+            body = await resp.read()
+            data = decode_json(body, endpoint)
+            http_cache.stats["misses"] += 1
+            http_cache.stats["bytes_downloaded"] += len(body)
+            http_cache.put(url, data, len(body), resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+            breaker.success()
+            return data
+    except asyncio.CancelledError:
+        # отмена (остановка, таймаут вызывающего) — иначе пробный запрос half-open занят навсегда
+        if probe:
+            breaker.release()
+        raise
+    except Exception as e:
+        count_error(f"sofascore_{endpoint}", e)
+        breaker.failure(getattr(e, "retry_after", None), getattr(e, "status", None) == 429, probe)
+        raise
+    finally:
+        http_stats["in_flight"] -= 1
+        SOFASCORE_REQUESTS.inc(endpoint=endpoint, result=result)
+        SOFASCORE_SECONDS.observe(time.monotonic() - started, endpoint=endpoint)
+
+
+# ------------ Single-flight: один запрос на ключ для всех одновременных вызовов ------------
+class SingleFlight:
+    """
+    Одновременные вызовы с одним ключом получают результат одного запроса.
+    Запрос выполняется отдельной задачей: отмена одного из ждущих не отменяет его для остальных.
+    Работает только внутри _async_loop.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Any, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            SINGLE_FLIGHT_TOTAL.inc(name=self.name, result="leader")
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            SINGLE_FLIGHT_TOTAL.inc(name=self.name, result="shared")
+        return await asyncio.shield(task)
+
+    def _done(self, key, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # все ждущие могли быть отменены — не оставляем исключение "не прочитанным"
+
+
+live_flight = SingleFlight("live")
+summary_flight = SingleFlight("summary")
+
+
+# ------------ Запись сырых ответов SofaScore (для бэктеста) ------------
+RECORD_DIR = os.getenv("RECORD_DIR")  # если задан — пишем снимки live-игр для backtest.py
+RECORD_OPEN_FILES = 64
+
+
+class FeedRecorder(threading.Thread):
+    """
+    Пишет изменения данных по каждой игре в RECORD_DIR/<YYYY-MM-DD>/<event_id>.jsonl.gz.
+    Одна строка — один снимок: {"t": unix time, "kind": "event" | "summary", "data": ...}.
+    Сериализация, сравнение с прошлым снимком и сжатие — в этом потоке, loop только кладёт в очередь.
+    """
+
+    def __init__(self, root: str):
+        super().__init__(name="feed-recorder", daemon=True)
+        self.root = root
+        self._queue: "queue.Queue" = queue.Queue()
+        self._files: "OrderedDict[str, Any]" = OrderedDict()
+        self._last: Dict[tuple, str] = {}  # (event_id, kind) -> последний записанный JSON
+        self.stats: Dict[str, int] = {"records": 0, "skipped": 0}
+
+    def record(self, event_id: int, kind: str, data: Any):
+        self._queue.put((time.time(), event_id, kind, data))
+
+    def stop(self, timeout: Optional[float] = 10):
+        if self.is_alive():
+            self._queue.put(None)
+            self.join(timeout)
+
+    def forget(self, event_id: int):
+        """Игра ушла из live — закрыть её файл и забыть последние снимки"""
+        self._queue.put((None, event_id, None, None))
+
+    def _file(self, t: float, event_id: int):
+        path = os.path.join(self.root, datetime.utcfromtimestamp(t).strftime("%Y-%m-%d"), f"{event_id}.jsonl.gz")
+        f = self._files.get(path)
+        if f is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = self._files[path] = gzip.open(path, "at", encoding="utf-8")
+            while len(self._files) > RECORD_OPEN_FILES:
+                self._files.popitem(last=False)[1].close()
+        self._files.move_to_end(path)
+        return f
+
+    def _close(self, event_id: int):
+        suffix = os.sep + f"{event_id}.jsonl.gz"
+        for path in [p for p in self._files if p.endswith(suffix)]:
+            self._files.pop(path).close()
+        self._last.pop((event_id, "event"), None)
+        self._last.pop((event_id, "summary"), None)
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            t, event_id, kind, data = item
+            try:
+                if t is None:
+                    self._close(event_id)
+                    continue
+                payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+                if self._last.get((event_id, kind)) == payload:
+                    self.stats["skipped"] += 1
+                    continue
+                self._last[(event_id, kind)] = payload
+                self._file(t, event_id).write(f'{{"t":{t:.3f},"kind":"{kind}","data":{payload}}}\n')
+                self.stats["records"] += 1
+            except Exception:
+                pass
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+recorder: Optional[FeedRecorder] = None
+
+
+def record_snapshot(event_id: int, kind: str, data: Any):
+    """Снимок для бэктеста: пишет recorder этого процесса или (воркер шарда) координатор"""
+    if shard_sink is not None:
+        if RECORD_DIR:
+            shard_sink.put(("record", event_id, kind, data))
+    elif recorder is not None:
+        recorder.record(event_id, kind, data)
+
+
+def start_recorder():
+    global recorder
+    if RECORD_DIR and recorder is None:
+        recorder = FeedRecorder(RECORD_DIR)
+        recorder.start()
+        atexit.register(recorder.stop)
+
+
+# ------------ Получение списка live матчей (SofaScore) ------------
+LIVE_STALE_MAX = float(os.getenv("LIVE_STALE_MAX", "30"))  # сколько сек можно отдавать последний удачный список
+LIVE_STALE_SERVED = Counter("live_stale_served_total", "SofaScore недоступен — отдан последний удачный live-список")
+METRICS.append(LIVE_STALE_SERVED)
+# последний удачный live-список: {"events": [...], "at": monotonic}
+live_snapshot: Dict[str, Any] = {"events": None, "at": 0.0}
+
+
+async def get_live_events() -> Optional[List[Dict[str, Any]]]:
+    """
+    Возвращает список текущих live-событий (basketball).
+    Возвращаемый формат — список объектов с по крайней мере полями:
+      id, homeTeam.name, awayTeam.name, status (period, description), homeScore.current, awayScore.current
+    Если SofaScore недоступен — последний удачный список (не старше LIVE_STALE_MAX),
+    а если и его нет — None (в отличие от [] — "live-игр нет").
+    """
+    return await live_flight.do("live", _fetch_live_events)
+
+
+async def _fetch_live_events() -> Optional[List[Dict[str, Any]]]:
+    try:
+        url = f"{SOFASCORE_API}/sport/basketball/events/live"
+        data = await fetch_json(url, "live")
+        events = (data.get("events") or []) if data else []
+        live_snapshot.update(events=events, at=time.monotonic())
+        for ev in events:
+            record_snapshot(ev.get("id"), "event", ev)
+        return events
+    except Exception as e:
+        if not isinstance(e, CircuitOpenError):
+            count_error("get_live_events", e)
+        if live_snapshot["events"] is not None and time.monotonic() - live_snapshot["at"] <= LIVE_STALE_MAX:
+            LIVE_STALE_SERVED.inc()
+            return live_snapshot["events"]
+        return None
+
+
+# ------------ Получение подробностей матча (summary / incidents) ------------
+# части подробностей матча: ключ в результате -> эндпойнт SofaScore
+SUMMARY_PARTS: Dict[str, str] = {
+    "summary": "match-summary",  # периодные счёты и базовая статистика
+    "incidents": "incidents",  # play-by-play (замены, фолы, штрафные)
+}
+
+
+async def get_event_summary(event_id: int, finished: bool = False, parts=tuple(SUMMARY_PARTS)) -> Dict[str, Any]:
+    """
+    Возвращает подробности матча: периодные очки, фолы, состав, play-by-play.
+    parts — какие части нужны ("summary", "incidents"); запросы к ним идут параллельно.
+    finished=True — игра завершена, ответы можно долго держать в кэше.
+    Одновременные вызовы для одной игры делят один запрос (результат общий — не изменять).
+    """
+    parts = tuple(sorted(parts))
+    return await summary_flight.do((event_id, finished, parts), lambda: _fetch_event_summary(event_id, finished, parts))
+
+
+async def _fetch_event_summary(event_id: int, finished: bool, parts) -> Dict[str, Any]:
+    base = f"{SOFASCORE_API}/event"
+    ttl = CACHE_TTL["finished"] if finished else None
+    responses = await asyncio.gather(
+        *[fetch_json(f"{base}/{event_id}/{SUMMARY_PARTS[part]}", SUMMARY_PARTS[part], ttl) for part in parts],
+        return_exceptions=True,
+    )
+    result = {}
+    for part, data in zip(parts, responses):
+        if data is not None and not isinstance(data, BaseException):
+            result[part] = data
+    return result
+
+
+# ------------ Утилиты для парсинга данных ------------
+def safe_get(d: Dict, *keys, default=None):
+    cur = d
+    for k in keys:
+        if not isinstance(cur, dict):
+            return default
+        cur = cur.get(k)
+        if cur is None:
+            return default
+    return cur
+
+
+def parse_period_scores(summary_json: Dict[str, Any]):
+    """
+    Попытка извлечь очки по четвертям из match-summary или event->home/away periodScores.
+    Вернёт список кортежей: [(h1,a1),(h2,a2),...]
+    """
+    periods = []
+    # вариант: summary_json может иметь "periods" или "home"->"periodScores"
+    try:
+        if not summary_json:
+            return periods
+        # попытка 1: summary_json['periods']
+        p = summary_json.get("periods")
+        if p and isinstance(p, list):
+            for item in p:
+                # item может содержать "homeScore" и "awayScore"
+                hs = item.get("homeScore") or item.get("home")
+                ascore = item.get("awayScore") or item.get("away")
+                if hs is not None and ascore is not None:
+                    periods.append((int(hs), int(ascore)))
+            if periods:
+                return periods
+        # попытка 2: summary_json['homeTeam']['periods'] и ['awayTeam']['periods']
+        home = summary_json.get("homeTeam")
+        away = summary_json.get("awayTeam")
+        if home and away:
+            # найти periodScores
+            h_periods = home.get("periodScores") or home.get("periods")
+            a_periods = away.get("periodScores") or away.get("periods")
+            if h_periods and a_periods and len(h_periods) == len(a_periods):
+                for i in range(len(h_periods)):
+                    periods.append((int(h_periods[i].get("score", 0)), int(a_periods[i].get("score", 0))))
+                return periods
+    except Exception:
+        return periods
+    return periods
+
+
+def event_period_scores(event_obj: Dict[str, Any]):
+    """Очки по четвертям из самого live-события (homeScore.period1, ...) — без запроса match-summary"""
+    periods = []
+    for i in range(1, 10):
+        h = safe_get(event_obj, "homeScore", f"period{i}")
+        a = safe_get(event_obj, "awayScore", f"period{i}")
+        if h is None or a is None:
+            break
+        try:
+            periods.append((int(h), int(a)))
+        except (TypeError, ValueError):
+            break
+    return periods
+
+
+def get_period_scores(event_obj: Dict[str, Any], summary: Optional[Dict[str, Any]]):
+    """Очки по четвертям: из match-summary, если он есть, иначе из live-события"""
+    periods = []
+    if summary and "summary" in summary:
+        periods = parse_period_scores(summary["summary"])
+    return periods or event_period_scores(event_obj)
+
+
+def quarter_points(periods, quarter: int, total: Optional[int]) -> Optional[int]:
+    """
+    Очки (сумма команд) в четверти quarter: по периодным очкам, а если их ещё нет —
+    общий счёт total минус прошлые четверти. None — посчитать нельзя.
+    """
+    if len(periods) >= quarter:
+        return periods[quarter - 1][0] + periods[quarter - 1][1]
+    if total is not None and len(periods) >= quarter - 1:
+        return total - sum(h + a for h, a in periods[: quarter - 1])
+    return None
+
+
+def get_current_period_and_clock(event_obj: Dict[str, Any]):
+    """
+    Попытка взять номер четверти и оставшееся/прошедшее время (строка)
+    """
+    try:
+        status = event_obj.get("status", {})
+        period = status.get("period") or status.get("currentPeriod") or 0
+        desc = status.get("description") or status.get("time") or ""
+        return int(period), str(desc)
+    except Exception:
+        return 0, ""
+
+
+def get_period_seconds_left(event_obj: Dict[str, Any]) -> Optional[int]:
+    """
+    Сколько секунд осталось в текущей четверти.
+    Берём time.played/time.periodLength, если SofaScore их отдаёт, иначе ищем "MM:SS" в описании статуса.
+    """
+    try:
+        period, clock = get_current_period_and_clock(event_obj)
+        t = event_obj.get("time") or {}
+        length = t.get("periodLength")
+        played = t.get("played")
+        if length and played is not None and 1 <= period <= 4:
+            return max(0, int(length) * period - int(played))
+        m = re.search(r"(\d{1,2}):(\d{2})", clock)
+        if m:
+            return int(m.group(1)) * 60 + int(m.group(2))
+    except Exception:
+        pass
+    return None
+
+
+def is_break(event_obj: Dict[str, Any]) -> bool:
+    """Перерыв между четвертями / большой перерыв (по описанию статуса)"""
+    desc = str(safe_get(event_obj, "status", "description", default="")).lower()
+    return any(w in desc for w in ("half", "pause", "break", "перерыв"))
+
+
+# ------------ Инкрементальный разбор incidents (play-by-play) ------------
+def _incident_key(it: Dict[str, Any]):
+    team = it.get("team")
+    return (
+        it.get("id"),
+        it.get("type") or it.get("incidentType"),
+        it.get("time"),
+        it.get("homeScore"),
+        it.get("awayScore"),
+        team.get("id") if isinstance(team, dict) else None,
+    )
+
+
+class IncidentState:
+    """
+    Состояние play-by-play одной игры: курсор по уже обработанным incidents и накопленные
+    по четвертям фолы / очки / замены. Каждый тик применяются только новые incidents.
+    Если лента "откатилась" (инцидент удалён или исправлен) — состояние пересобирается с нуля.
+    """
+
+    __slots__ = (
+        "home_id", "count", "newest_first", "first_key", "last_key", "source",
+        "period", "last_score", "fouls", "points", "subs", "rebuilds",
+    )
+
+    def __init__(self, home_id):
+        self.home_id = home_id
+        self.rebuilds = 0
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.newest_first = True  # SofaScore отдаёт incidents от новых к старым
+        self.first_key = None
+        self.last_key = None
+        self.source = None
+        self.period = 1
+        self.last_score = (0, 0)
+        # period -> [home, away]
+        self.fouls: Dict[int, List[int]] = {}
+        self.points: Dict[int, List[int]] = {}
+        self.subs: Dict[int, List[int]] = {}
+
+    def _at(self, items: List[Dict[str, Any]], i: int) -> Dict[str, Any]:
+        """i-й incident в хронологическом порядке"""
+        return items[len(items) - 1 - i] if self.newest_first else items[i]
+
+    def _detect_order(self, items: List[Dict[str, Any]]):
+        try:
+            first, last = items[0].get("time"), items[-1].get("time")
+            if first is not None and last is not None and first != last:
+                self.newest_first = first > last
+        except Exception:
+            pass
+
+    def update(self, items: List[Dict[str, Any]]) -> "IncidentState":
+        if items is self.source:
+            return self  # тот же ответ (кэш / 304) — ничего нового
+        n = len(items)
+        if self.count and (
+            n < self.count
+            or _incident_key(self._at(items, 0)) != self.first_key
+            or _incident_key(self._at(items, self.count - 1)) != self.last_key
+        ):
+            # лента откатилась или исправлена — пересобираем
+            self._reset()
+            self.rebuilds += 1
+        if self.count == 0 and n:
+            self._detect_order(items)
+        for i in range(self.count, n):
+            self._apply(self._at(items, i))
+        if n:
+            self.first_key = _incident_key(self._at(items, 0))
+            self.last_key = _incident_key(self._at(items, n - 1))
+        self.count = n
+        self.source = items
+        return self
+
+    def _side(self, it: Dict[str, Any]) -> int:
+        team = it.get("team")
+        team_id = team.get("id") if isinstance(team, dict) else None
+        return 0 if team_id == self.home_id else 1
+
+    def _apply(self, it: Dict[str, Any]):
+        typ = str(it.get("type") or it.get("incidentType") or "").lower()
+        period = it.get("period")
+        if not isinstance(period, int):
+            period = self.period
+        if typ == "period":
+            # отметка конца четверти ("Q1", "2nd quarter", ...) — дальше идёт следующая
+            m = re.search(r"\d+", str(it.get("text") or ""))
+            if m:
+                self.period = int(m.group(0)) + 1
+        elif "foul" in typ:
+            self.fouls.setdefault(period, [0, 0])[self._side(it)] += 1
+        elif "substitution" in typ:
+            self.subs.setdefault(period, [0, 0])[self._side(it)] += 1
+        hs, as_ = it.get("homeScore"), it.get("awayScore")
+        if isinstance(hs, int) and isinstance(as_, int):
+            pts = self.points.setdefault(period, [0, 0])
+            pts[0] += max(0, hs - self.last_score[0])
+            pts[1] += max(0, as_ - self.last_score[1])
+            self.last_score = (hs, as_)
+
+    def fouls_total(self):
+        return (sum(f[0] for f in self.fouls.values()), sum(f[1] for f in self.fouls.values()))
+
+
+# event_id -> IncidentState; удаляется, когда игра пропадает из live
+incident_states: Dict[int, IncidentState] = {}
+
+
+def get_incident_state(event: Dict[str, Any], summary: Dict[str, Any]) -> Optional[IncidentState]:
+    """Обновить (только новыми incidents) и вернуть состояние play-by-play игры"""
+    if not summary or "incidents" not in summary:
+        return None
+    inc = summary["incidents"]
+    items = inc.get("incidents", []) if isinstance(inc, dict) else (inc or [])
+    event_id = event.get("id")
+    home_id = safe_get(event, "homeTeam", "id")
+    state = incident_states.get(event_id)
+    if state is None or state.home_id != home_id:
+        state = incident_states[event_id] = IncidentState(home_id)
+    return state.update(items)
+
+
+# ------------ Темп игры и базовые линии по лигам / командам ------------
+LINE_MODE = os.getenv("LINE_MODE", "pace")  # pace — линия по прогнозу темпа, fixed — константы стратегий
+# длина четверти, если SofaScore её не отдал (ни в live-событии, ни в записи сигнала)
+PACE_PERIOD_SECONDS = int(os.getenv("PACE_PERIOD_SECONDS", "600"))
+PACE_DEFAULT_PPM = float(os.getenv("PACE_DEFAULT_PPM", "4.0"))  # очки обеих команд в минуту без истории
+PACE_WINDOW = int(os.getenv("PACE_WINDOW", "50"))  # окно скользящего среднего базового темпа (четвертей)
+PACE_PRIOR_MINUTES = float(os.getenv("PACE_PRIOR_MINUTES", "3"))  # вес базового темпа в прогнозе, в минутах игры
+PACE_MIN_ELAPSED = int(os.getenv("PACE_MIN_ELAPSED", "60"))  # раньше темп четверти не показываем
+PACE_RESTORE_DAYS = float(os.getenv("PACE_RESTORE_DAYS", "30"))  # глубина загрузки итогов из signals при старте
+PACE_SEEN_MAX = 20000
+
+
+class PaceBaselines:
+    """
+    Базовый темп (очки обеих команд в минуту четверти) по лигам и командам.
+    Пока наблюдений меньше окна — обычное среднее, дальше — экспоненциальное с весом 1/окно;
+    обновление и чтение — несколько операций со словарём. Наблюдения — завершённые четверти
+    live-игр (и игр в бэктесте) и итоги из таблицы signals при старте; каждая четверть учитывается один раз.
+    """
+
+    def __init__(self, window: int = PACE_WINDOW, default: float = PACE_DEFAULT_PPM):
+        self.window = window
+        self.default = default
+        # ("league" | "team", имя) -> [темп, число наблюдений]
+        self.stats: Dict[tuple, List[float]] = {}
+        self._seen: OrderedDict = OrderedDict()  # (event_id, quarter) уже учтённых четвертей
+
+    def __len__(self):
+        return len(self.stats)
+
+    def _update(self, key: tuple, ppm: float):
+        s = self.stats.get(key)
+        if s is None:
+            self.stats[key] = [ppm, 1]
+            return
+        s[1] += 1
+        s[0] += (ppm - s[0]) / min(s[1], self.window)
+
+    def observe(self, league: str, home: str, away: str, points: int, minutes: float, event_id=None, quarter=None) -> bool:
+        """Учесть завершённую четверть: points очков за minutes минут"""
+        if minutes <= 0 or points < 0:
+            return False
+        if event_id is not None:
+            key = (event_id, quarter)
+            if key in self._seen:
+                return False
+            self._seen[key] = True
+            if len(self._seen) > PACE_SEEN_MAX:
+                self._seen.popitem(last=False)
+        ppm = points / minutes
+        if league:
+            self._update(("league", league), ppm)
+        for team in (home, away):
+            if team:
+                self._update(("team", team), ppm)
+        return True
+
+    def baseline(self, league: str, home: str, away: str) -> float:
+        """Ожидаемый темп игры: среднее по лиге и обеим командам с весом по числу наблюдений (+ общий темп по умолчанию)"""
+        total, weight = self.default, 1.0
+        for key in (("league", league), ("team", home), ("team", away)):
+            s = self.stats.get(key)
+            if s is not None:
+                w = min(s[1], self.window)
+                total += s[0] * w
+                weight += w
+        return total / weight
+
+    def load(self, days: float = PACE_RESTORE_DAYS) -> int:
+        """Итоги сигналов из signals.db (отдельное соединение только для чтения — годится и для шардов)"""
+        since = datetime.utcfromtimestamp(time.time() - days * 86400).isoformat()
+        try:
+            conn = sqlite3.connect(DB_PATH)
+            try:
+                rows = conn.execute(
+                    "SELECT event_id, quarter, league, home, away, points_in_quarter, period_seconds FROM signals "
+                    "WHERE ts >= ? AND status IN ('PASSED', 'FAILED') ORDER BY ts",
+                    (since,),
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return 0
+        loaded = 0
+        for event_id, quarter, league, home, away, points, period_seconds in rows:
+            try:
+                q = int(str(quarter).rstrip("Q"))
+            except ValueError:
+                continue
+            if points is not None:
+                minutes = (period_seconds or PACE_PERIOD_SECONDS) / 60
+                loaded += self.observe(league, home, away, int(points), minutes, event_id, q)
+        return loaded
+
+
+pace_baselines = PaceBaselines()
+
+
+def event_period_seconds(event: Dict[str, Any]) -> Optional[int]:
+    """Длина четверти (сек) из события SofaScore: 600 (FIBA) / 720 (NBA); None — не отдал"""
+    try:
+        return int(safe_get(event, "time", "periodLength", default=0)) or None
+    except (TypeError, ValueError):
+        return None
+
+
+def tempo_label(ppm: float, base: float) -> str:
+    ratio = ppm / base if base else 1.0
+    if ratio >= 1.1:
+        return "высокий"
+    if ratio <= 0.9:
+        return "низкий"
+    return "средний"
+
+
+# ------------ Признаки игры (общие для всех стратегий) ------------
+# Пороги и линии стратегий (переопределяются в backtest.py / tune.py)
+STRATEGY_3Q_MIN_POINTS = 12
+STRATEGY_3Q_LINE = 37.5
+STRATEGY_4Q_MAX_DIFF = 7
+STRATEGY_4Q_LINE = 39.5
+
+# имя признака -> (функция от Features, часть подробностей матча, без которой признак может быть неизвестен)
+FEATURES: Dict[str, tuple] = {}
+
+
+def feature(name: str, part: Optional[str] = None):
+    """Регистрирует признак игры; part — из какой части SUMMARY_PARTS он берётся (None — только live-событие)"""
+    def wrap(fn):
+        FEATURES[name] = (fn, part)
+        return fn
+    return wrap
+
+
+class Features:
+    """
+    Признаки одной игры на текущий тик. Каждый считается при первом обращении и дальше
+    берётся из кэша — сколько бы стратегий его ни читало. None — признак посчитать нельзя.
+    with_summary() — те же признаки с новыми подробностями матча: признаки только
+    по live-событию переносятся, зависящие от summary/incidents считаются заново.
+    """
+
+    __slots__ = ("event", "summary", "_cache")
+
+    def __init__(self, event: Dict[str, Any], summary: Optional[Dict[str, Any]] = None):
+        self.event = event
+        self.summary = summary or {}
+        self._cache: Dict[str, Any] = {}
+
+    def __getitem__(self, name: str):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        try:
+            value = FEATURES[name][0](self)
+        except (TypeError, ValueError, KeyError):
+            value = None
+        self._cache[name] = value
+        return value
+
+    def with_summary(self, summary: Dict[str, Any]) -> "Features":
+        other = Features(self.event, summary)
+        other._cache = {k: v for k, v in self._cache.items() if FEATURES[k][1] is None}
+        return other
+
+
+@feature("period")
+def _f_period(f: Features):
+    return get_current_period_and_clock(f.event)[0]
+
+
+@feature("clock")
+def _f_clock(f: Features):
+    return get_current_period_and_clock(f.event)[1]
+
+
+@feature("home")
+def _f_home(f: Features):
+    return safe_get(f.event, "homeTeam", "name", default="Home")
+
+
+@feature("away")
+def _f_away(f: Features):
+    return safe_get(f.event, "awayTeam", "name", default="Away")
+
+
+@feature("score")
+def _f_score(f: Features):
+    return int(safe_get(f.event, "homeScore", "current")), int(safe_get(f.event, "awayScore", "current"))
+
+
+@feature("current_score")
+def _f_current_score(f: Features):
+    score = f["score"]
+    return None if score is None else f"{score[0]}:{score[1]}"
+
+
+@feature("total")
+def _f_total(f: Features):
+    score = f["score"]
+    return None if score is None else score[0] + score[1]
+
+
+@feature("diff")
+def _f_diff(f: Features):
+    score = f["score"]
+    return None if score is None else abs(score[0] - score[1])
+
+
+@feature("periods", "summary")
+def _f_periods(f: Features):
+    return get_period_scores(f.event, f.summary)
+
+
+@feature("quarter_points", "summary")
+def _f_quarter_points(f: Features):
+    """Очки в текущей четверти (по периодным очкам или общий счёт минус прошлые четверти)"""
+    return quarter_points(f["periods"] or [], f["period"], f["total"])
+
+
+@feature("fouls", "incidents")
+def _f_fouls(f: Features):
+    """Командные фолы (home, away) из инкрементального состояния play-by-play"""
+    try:
+        state = get_incident_state(f.event, f.summary)
+    except Exception:
+        state = None
+    return state.fouls_total() if state is not None else None
+
+
+@feature("league")
+def _f_league(f: Features):
+    return safe_get(f.event, "tournament", "name", default="")
+
+
+@feature("period_seconds")
+def _f_period_seconds(f: Features):
+    return event_period_seconds(f.event) or PACE_PERIOD_SECONDS
+
+
+@feature("elapsed")
+def _f_elapsed(f: Features):
+    """Сколько секунд сыграно в текущей четверти"""
+    left = get_period_seconds_left(f.event)
+    if left is None:
+        return None
+    return min(max(0, f["period_seconds"] - left), f["period_seconds"])
+
+
+@feature("baseline_ppm")
+def _f_baseline_ppm(f: Features):
+    return pace_baselines.baseline(f["league"], f["home"], f["away"])
+
+
+@feature("ppm", "summary")
+def _f_ppm(f: Features):
+    """Темп текущей четверти: очки обеих команд в минуту"""
+    elapsed, points = f["elapsed"], f["quarter_points"]
+    if elapsed is None or points is None or elapsed < PACE_MIN_ELAPSED:
+        return None
+    return points * 60 / elapsed
+
+
+@feature("projected", "summary")
+def _f_projected(f: Features):
+    """
+    Прогноз очков за всю четверть: набранное + оставшиеся минуты по темпу, в котором
+    темп четверти смешан с базовым (лига, команды) с весом PACE_PRIOR_MINUTES минут игры.
+    """
+    elapsed, points = f["elapsed"], f["quarter_points"]
+    if elapsed is None or points is None:
+        return None
+    played = elapsed / 60
+    rate = (points + f["baseline_ppm"] * PACE_PRIOR_MINUTES) / (played + PACE_PRIOR_MINUTES)
+    return points + rate * (f["period_seconds"] / 60 - played)
+
+
+@feature("pace_line", "summary")
+def _f_pace_line(f: Features):
+    """Линия ТБ четверти по прогнозу (x.5 под прогнозом); None — прогноза нет или LINE_MODE=fixed"""
+    projected = f["projected"]
+    if LINE_MODE != "pace" or projected is None:
+        return None
+    return math.floor(projected - 0.5) + 0.5
+
+
+@feature("tempo", "summary")
+def _f_tempo(f: Features):
+    ppm, base = f["ppm"], f["baseline_ppm"]
+    if ppm is None:
+        return "неизвестно"
+    text = f"{tempo_label(ppm, base)}, {ppm:.1f} оч/мин при норме {base:.1f}"
+    projected = f["projected"]
+    return text if projected is None else f"{text}, прогноз четверти {projected:.0f}"
+
+
+# ------------ Правила (стратегии) ------------
+class Strategy:
+    """
+    Декларативное правило сигнала.
+      periods  — в каких четвертях правило вообще проверяется (остальные отсекаются планом);
+      inputs   — признаки для trigger: если хоть один None, правило не срабатывает;
+      trigger  — предикат от Features;
+      line     — линия от Features (функция — чтобы читать текущие пороги модуля);
+      reason   — текст причины от Features;
+      fields   — признаки, которые попадают в payload сигнала (и доступны шаблону);
+      template — текст сообщения, str.format по payload; extra — постоянные поля payload.
+    Сигнал по одной четверти один: из нескольких правил четверти срабатывает первое по порядку.
+    """
+
+    __slots__ = ("name", "periods", "inputs", "trigger", "line", "reason", "fields", "template", "extra")
+
+    def __init__(self, name, periods, inputs, trigger, line, reason, fields, template, extra=None):
+        self.name = name
+        self.periods = tuple(periods)
+        self.inputs = tuple(inputs)
+        self.trigger = trigger
+        self.line = line
+        self.reason = reason
+        self.fields = tuple(fields)
+        self.template = template
+        self.extra = extra or {}
+
+    def payload(self, f: Features, quarter: int) -> Dict[str, Any]:
+        sig = {name: f[name] for name in self.fields}
+        sig.update(self.extra)
+        sig.update(
+            strategy=self.name, reason=self.reason(f), line=self.line(f), quarter=quarter,
+            home=f["home"], away=f["away"], clock=f["clock"], period_seconds=f["period_seconds"],
+        )
+        sig.setdefault("line_type", "ТБ")
+        return sig
+
+
+# имя -> правило (в порядке регистрации) и скомпилированный план: четверть -> правила
+STRATEGIES: Dict[str, Strategy] = {}
+strategy_plan: Dict[int, List[Strategy]] = {}
+
+
+def compile_strategies():
+    """План оценки: правила по четвертям; заодно проверяем, что все признаки правил известны"""
+    plan: Dict[int, List[Strategy]] = defaultdict(list)
+    for rule in STRATEGIES.values():
+        unknown = [name for name in rule.inputs + rule.fields if name not in FEATURES]
+        if unknown:
+            raise ValueError(f"Стратегия {rule.name}: неизвестные признаки {unknown}")
+        for period in rule.periods:
+            plan[period].append(rule)
+    strategy_plan.clear()
+    strategy_plan.update(plan)
+
+
+def register_strategy(rule: Strategy) -> Strategy:
+    STRATEGIES[rule.name] = rule
+    compile_strategies()
+    return rule
+
+
+def rule_ready(rule: Strategy, f: Features) -> bool:
+    return all(f[name] is not None for name in rule.inputs)
+
+
+def evaluate_rule(rule: Strategy, f: Features) -> Optional[Dict[str, Any]]:
+    """payload сигнала, если правило применимо к текущей четверти и сработало, иначе None"""
+    period = f["period"]
+    if period not in rule.periods or not rule_ready(rule, f) or not rule.trigger(f):
+        return None
+    return rule.payload(f, period)
+
+
+def evaluate_strategies(f: Features, skip=None) -> List[tuple]:
+    """
+    Все сработавшие правила текущей четверти: [(rule, payload)].
+    skip(quarter) -> True — сигнал по четверти уже есть, правила не проверяем.
+    """
+    period = f["period"]
+    rules = strategy_plan.get(period)
+    if not rules or (skip is not None and skip(period)):
+        return []
+    for rule in rules:
+        t0 = time.perf_counter()
+        fired = rule_ready(rule, f) and rule.trigger(f)
+        STRATEGY_SECONDS.observe(time.perf_counter() - t0, strategy=rule.name)
+        if fired:
+            return [(rule, rule.payload(f, period))]
+    return []
+
+
+def pace_or_fixed_line(f: Features, fixed: float) -> float:
+    """Линия по прогнозу темпа четверти, а без прогноза (нет часов / очков, LINE_MODE=fixed) — константа стратегии"""
+    line = f["pace_line"]
+    return fixed if line is None else line
+
+
+SIGNAL_TEMPLATE_3Q = (
+    "🏀 Сигнал [3Q]\n"
+    "Матч: {home} – {away}\n"
+    "Текущий счёт: {current_score}\n"
+    "Время: {clock}\n\n"
+    "📊 Данные:\n"
+    "— Очки в 3Q: {quarter_points} \n"
+    "— Фолы: {fouls}\n"
+    "— Темп: {tempo}\n"
+    "— Состав: {line_type}\n\n"
+    "💡 Рекомендация: {line_type} {line}\n"
+    "🎯 Вход: оптимальный\n"
+    "Причина: {reason}"
+)
+
+SIGNAL_TEMPLATE_4Q = (
+    "🏀 Сигнал [4Q]\n"
+    "Матч: {home} – {away}\n"
+    "Текущий счёт: {current_score}\n"
+    "Время: {clock}\n\n"
+    "📊 Данные:\n"
+    "— Очки в 4Q: {quarter_points}\n"
+    "— Фолы: {fouls}\n"
+    "— Темп: {tempo}\n"
+    "— Рекомендация: {recommendation_type}\n\n"
+    "💡 Рекомендация: {line_type} {line}\n"
+    "🎯 Вход: оптимальный\n"
+    "Причина: {reason}"
+)
+
+# Стратегия 1 — 3Q: в третьей четверти уже набрано много очков
+register_strategy(Strategy(
+    "3Q", periods=(3,), inputs=("quarter_points",),
+    trigger=lambda f: f["quarter_points"] >= STRATEGY_3Q_MIN_POINTS,
+    line=lambda f: pace_or_fixed_line(f, STRATEGY_3Q_LINE),
+    reason=lambda f: f"Points in 3Q = {f['quarter_points']}",
+    fields=("quarter_points", "current_score", "fouls", "tempo"),
+    template=SIGNAL_TEMPLATE_3Q,
+))
+
+# Стратегия 2 — 4Q: в четвёртой четверти игра равная
+register_strategy(Strategy(
+    "4Q", periods=(4,), inputs=("diff",),
+    trigger=lambda f: f["diff"] <= STRATEGY_4Q_MAX_DIFF,
+    line=lambda f: pace_or_fixed_line(f, STRATEGY_4Q_LINE),
+    reason=lambda f: f"Diff={f['diff']}",
+    fields=("quarter_points", "current_score", "fouls", "tempo"),
+    template=SIGNAL_TEMPLATE_4Q,
+    extra={"recommendation_type": "оптимальный"},
+))
+
+
+def evaluate_strategy_1(event, summary) -> Optional[Dict[str, Any]]:
+    """Стратегия 1 — 3Q (dict с данными сигнала или None)"""
+    return evaluate_rule(STRATEGIES["3Q"], Features(event, summary))
+
+
+def evaluate_strategy_2(event, summary) -> Optional[Dict[str, Any]]:
+    """Стратегия 2 — 4Q (dict с данными сигнала или None)"""
+    return evaluate_rule(STRATEGIES["4Q"], Features(event, summary))
+
+
+# ------------ План запросов по игре ------------
+FETCH_PLAN_TOTAL = Counter("fetch_plan_total", "Части подробностей матча: запрошены (fetch) / не нужны (skip)")
+METRICS.append(FETCH_PLAN_TOTAL)
+
+
+def plan_fetch(f: Features) -> set:
+    """
+    Какие части подробностей матча ("summary", "incidents") нужны для этой игры сейчас.
+    Решаем по дешёвым данным live-списка и уже полученному (f.summary):
+      - итог прошлой четверти: нужен match-summary, только если в событии нет её очков;
+      - правила текущей четверти (если сигнала по ней ещё нет): неизвестен вход правила —
+        нужна его часть; правило сработает — нужны части полей сигнала (фолы — incidents);
+      - четверть без правил и без ожидающего итога, уже отправленный сигнал — ничего.
+    """
+    event_id = f.event.get("id")
+    period = f["period"]
+    need = set()
+    if period >= 2 and has_pending_result(event_id, period) and len(f["periods"] or ()) < period - 1:
+        need.add("summary")
+    if period in strategy_plan and not sent_signals.get(event_id, period):
+        for rule in strategy_plan[period]:
+            missing = {FEATURES[name][1] for name in rule.inputs if f[name] is None}
+            if missing:
+                need |= missing
+            elif rule.trigger(f):
+                need |= {FEATURES[name][1] for name in rule.fields if f[name] is None}
+                break
+    need.discard(None)
+    return need - f.summary.keys()
+
+
+# ------------ Отправка сигнала и отметка в sent_signals ------------
+def mark_signal_sent(
+    event_id: int, quarter: int, payload: Dict[str, Any], league: str = "", recipients: Optional[tuple] = None
+):
+    sent_signals.add(SignalRecord(
+        event_id, quarter, payload.get("strategy"), league, payload.get("home"), payload.get("away"),
+        payload.get("line", 0), payload.get("line_type", "ТБ"), recipients=recipients,
+    ))
+
+
+# ------------ Формирование текстов сообщений ------------
+class _SignalFields(dict):
+    def __missing__(self, key):
+        return "-"
+
+
+def format_signal_message(event_id: int, signal: Dict[str, Any]):
+    # текст — по шаблону правила, отсутствующие поля выводятся как "-"
+    fields = _SignalFields({k: v for k, v in signal.items() if v is not None})
+    return STRATEGIES[signal["strategy"]].template.format_map(fields)
+
+
+def format_result_message(event_id: int, signal_payload: Dict[str, Any], points_in_quarter: int):
+    line = signal_payload.get("line", 0)
+    passed = (points_in_quarter > line)  # мы ставим ТБ
+    mark = "✅ Прошла" if passed else "❌ Не прошла"
+    return (
+        f"{'✅' if passed else '❌'} Итог [{signal_payload.get('quarter')}Q]\n"
+        f"Матч: {signal_payload.get('home')} – {signal_payload.get('away')}\n"
+        f"Ставка: {signal_payload.get('line_type')} {line}\n"
+        f"Очки в {signal_payload.get('quarter')}Q: {points_in_quarter} → {mark}"
+    ), passed
+
+
+# ------------ Очередь исходящих сообщений Telegram ------------
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))  # сообщений/сек всего (лимит Telegram ~30)
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))  # сообщений/сек в один чат
+TG_SEND_CONCURRENCY = int(os.getenv("TG_SEND_CONCURRENCY", "4"))  # одновременных HTTPS-запросов к Telegram
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "5"))
+TG_MESSAGE_LIMIT = 4096  # максимум символов в одном сообщении Telegram
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 — уже есть)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundQueue:
+    """
+    Неблокирующая отправка сообщений из event loop'а. Сообщения копятся по чатам,
+    диспетчер отправляет их с учётом лимитов Telegram (token bucket на чат и общий),
+    склеивает накопившиеся для одного чата сообщения в одно, соблюдает retry_after из 429
+    и повторяет остальные ошибки с экспоненциальной задержкой.
+    Сам HTTPS-запрос (синхронный bot.send_message) выполняется в отдельном пуле потоков.
+    """
+
+    def __init__(self, send_fn=None):
+        self._send_fn = send_fn or bot.send_message
+        self._executor = ThreadPoolExecutor(max_workers=TG_SEND_CONCURRENCY, thread_name_prefix="tg-send")
+        self._slots = asyncio.Semaphore(TG_SEND_CONCURRENCY)
+        self._global = TokenBucket(TG_GLOBAL_RATE)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._pending: Dict[int, deque] = {}  # chat_id -> [(text, created_at, attempts)]
+        self._order: deque = deque()  # чаты, готовые к отправке
+        self._delayed: List[tuple] = []  # (ready_at, chat_id) — ждут лимит / retry_after / backoff
+        self._scheduled: set = set()  # чат в _order, _delayed или в процессе отправки
+        self._retry_at: Dict[int, float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._latencies: deque = deque(maxlen=1000)
+        self.stats: Dict[str, Any] = {
+            "queued": 0,
+            "sent": 0,  # отправлено сообщений (после склейки — запросов меньше)
+            "requests": 0,
+            "coalesced": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failed": 0,
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    def depth(self) -> int:
+        return sum(len(q) for q in self._pending.values())
+
+    async def close(self, timeout: float) -> List[tuple]:
+        """
+        Дождаться отправки очереди (не дольше timeout), остановить диспетчер
+        и вернуть то, что не успели отправить: [(chat_id, text), ...]
+        """
+        deadline = time.monotonic() + timeout
+        while self._scheduled and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        left = [(chat_id, item[0]) for chat_id, q in self._pending.items() for item in q]
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
+        return left
+
+    def put(self, chat_id: int, text: str, created_at: Optional[float] = None):
+        """Поставить сообщение в очередь. created_at — момент обнаружения сигнала (для задержки доставки)"""
+        self._pending.setdefault(chat_id, deque()).append((text, created_at or time.monotonic(), 0))
+        self.stats["queued"] += 1
+        if chat_id not in self._scheduled:
+            self._scheduled.add(chat_id)
+            self._order.append(chat_id)
+            self._wakeup.set()
+
+    def latency(self) -> Dict[str, float]:
+        """Задержка от обнаружения сигнала до подтверждения Telegram (сек) по последним сообщениям"""
+        lat = sorted(self._latencies)
+        if not lat:
+            return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {"p50": lat[len(lat) // 2], "p95": lat[min(len(lat) - 1, int(len(lat) * 0.95))], "max": lat[-1]}
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        b = self._buckets.get(chat_id)
+        if b is None:
+            b = self._buckets[chat_id] = TokenBucket(TG_CHAT_RATE)
+        return b
+
+    def _take_batch(self, chat_id: int) -> List[tuple]:
+        """Забрать из очереди чата сообщения, помещающиеся в одно сообщение Telegram"""
+        q = self._pending[chat_id]
+        batch = [q.popleft()]
+        size = len(batch[0][0])
+        while q and size + 2 + len(q[0][0]) <= TG_MESSAGE_LIMIT:
+            item = q.popleft()
+            size += 2 + len(item[0])
+            batch.append(item)
+        if not q:
+            del self._pending[chat_id]
+        return batch
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._order.append(heapq.heappop(self._delayed)[1])
+            if not self._order:
+                self._wakeup.clear()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            chat_id = self._order.popleft()
+            chat_wait = max(self._bucket(chat_id).delay(now), self._retry_at.get(chat_id, 0) - now)
+            if chat_wait > 0:
+                heapq.heappush(self._delayed, (now + chat_wait, chat_id))
+                continue
+            global_wait = self._global.delay(now)
+            if global_wait > 0:
+                self._order.appendleft(chat_id)
+                await asyncio.sleep(global_wait)
+                continue
+            await self._slots.acquire()
+            self._bucket(chat_id).take()
+            self._global.take()
+            asyncio.create_task(self._send(chat_id, self._take_batch(chat_id)))
+
+    async def _send(self, chat_id: int, batch: List[tuple]):
+        text = "\n\n".join(item[0] for item in batch)
+        delay = None
+        try:
+            self.stats["requests"] += 1
+            started = time.monotonic()
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._send_fn, chat_id, text)
+            now = time.monotonic()
+            TELEGRAM_SEND_SECONDS.observe(now - started)
+            self.stats["sent"] += len(batch)
+            self.stats["coalesced"] += len(batch) - 1
+            for item in batch:
+                self._latencies.append(now - item[1])
+                TELEGRAM_DELIVERY_SECONDS.observe(now - item[1])
+        except Exception as e:
+            count_error("telegram_send", e)
+            code = getattr(e, "error_code", None)
+            attempts = max(item[2] for item in batch) + 1
+            if code == 429:
+                self.stats["rate_limited"] += 1
+                retry_after = safe_get(getattr(e, "result_json", None) or {}, "parameters", "retry_after", default=1)
+                delay = float(retry_after)
+            elif code in (400, 403) or attempts > TG_MAX_RETRIES:
+                # чат недоступен / неверный запрос / исчерпали попытки — не повторяем
+                self.stats["failed"] += len(batch)
+            else:
+                delay = min(60.0, 2 ** attempts) * (0.5 + random.random() / 2)
+            if delay is not None:
+                self.stats["retries"] += 1
+                self._retry_at[chat_id] = time.monotonic() + delay
+                q = self._pending.setdefault(chat_id, deque())
+                for text_, created_at, _ in reversed(batch):
+                    q.appendleft((text_, created_at, attempts))
+        finally:
+            self._slots.release()
+            if chat_id in self._pending:
+                self._order.append(chat_id)
+            else:
+                self._scheduled.discard(chat_id)
+                self._retry_at.pop(chat_id, None)
+            self._wakeup.set()
+
+
+outbox: Optional[OutboundQueue] = None
+
+
+def enqueue_message(chat_id: int, text: str, created_at: Optional[float] = None):
+    """Отправить сообщение без ожидания (только из корутин на _async_loop)"""
+    global outbox
+    if outbox is None:
+        outbox = OutboundQueue()
+        outbox.start()
+    outbox.put(chat_id, text, created_at)
+
+
+def save_unsent_messages(items: List[tuple]):
+    """Неотправленные при остановке сообщения — в таблицу outbox, чтобы отправить после рестарта"""
+    if items:
+        db_writer.submit(lambda cur: cur.executemany("INSERT INTO outbox (chat_id, text) VALUES (?,?)", items))
+
+
+async def restore_unsent_messages() -> int:
+    conn = read_db()
+    try:
+        rows = conn.execute("SELECT id, chat_id, text FROM outbox ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    for _, chat_id, text in rows:
+        enqueue_message(chat_id, text)
+    if rows:
+        last_id = rows[-1][0]
+        db_writer.submit(lambda cur: cur.execute("DELETE FROM outbox WHERE id <= ?", (last_id,)))
+    return len(rows)
+
+
+def publish(
+    event: Dict[str, Any], strategy: str, quarter: int, text: str, created_at: Optional[float] = None
+) -> tuple:
+    """Разослать сообщение по сигналу всем подписчикам, чьи фильтры подходят; возвращает их chat_id"""
+    league = safe_get(event, "tournament", "name", default="")
+    chats = subscriptions.match(league, strategy, quarter)
+    for chat_id in chats:
+        enqueue_message(chat_id, text, created_at)
+    return chats
+
+
+def broadcast(text: str):
+    """Служебное сообщение всем подписчикам"""
+    for chat_id in subscriptions.all_chats():
+        enqueue_message(chat_id, text)
+
+
+# ------------ Доставка сигналов и итогов ------------
+# В процессе-воркере шардированного режима (см. ниже) сюда ставится очередь к координатору:
+# сигналы, итоги, записи в /checked и снимки для бэктеста уходят туда, а не в Telegram/БД.
+shard_sink = None
+
+
+def _slim_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля события, нужные для рассылки, /checked и БД"""
+    return {
+        "id": event.get("id"),
+        "tournament": {"name": safe_get(event, "tournament", "name", default="")},
+        "homeTeam": {"name": safe_get(event, "homeTeam", "name", default="Home")},
+        "awayTeam": {"name": safe_get(event, "awayTeam", "name", default="Away")},
+    }
+
+
+def deliver_signal(event: Dict[str, Any], quarter: int, sig: Dict[str, Any], detected_at: Optional[float] = None):
+    """Новый сигнал по четверти: разослать подписчикам, запомнить для итога, записать PENDING в БД"""
+    event_id = event.get("id")
+    league = safe_get(event, "tournament", "name", default="")
+    if shard_sink is not None:
+        mark_signal_sent(event_id, quarter, sig, league)  # локально — чтобы не слать повторно
+        shard_sink.put(("signal", _slim_event(event), quarter, sig, detected_at))
+        return
+    if sent_signals.get(event_id, quarter):
+        return  # уже отправлен (например, другим шардом при перебалансировке)
+    home = safe_get(event, "homeTeam", "name", default="Home")
+    away = safe_get(event, "awayTeam", "name", default="Away")
+    strategy = sig.get("strategy") or f"{quarter}Q"  # имя правила — в метриках, фильтрах подписок и /stats
+    recipients = publish(event, strategy, quarter, format_signal_message(event_id, sig), detected_at)
+    SIGNALS_TOTAL.inc(strategy=strategy)
+    log_match(f"{home} – {away}", f"signal {strategy}", event_id, home, away, league)
+    mark_signal_sent(event_id, quarter, sig, league, recipients)
+    # сохраняем лог с pending статус (будем обновлять после окончания четверти)
+    points = sig.get("quarter_points") if quarter == 3 else 0
+    save_signal_log(
+        event_id, league, home, away, f"{quarter}Q", sig.get("line", 0), "оптимальный", "PENDING", points,
+        period_seconds=sig.get("period_seconds"), strategy=strategy, chat_ids=recipients,
+    )
+
+
+def deliver_result(event: Dict[str, Any], quarter: int, points: int):
+    """Четверть с сигналом закончилась: разослать итог, обновить статус в БД (PASSED/FAILED)"""
+    event_id = event.get("id")
+    if shard_sink is not None:
+        sent_signals.mark_reported(event_id, quarter)
+        shard_sink.put(("result", _slim_event(event), quarter, points))
+        return
+    sent = sent_signals.get(event_id, quarter)
+    if sent is None or sent.reported_result is not None:
+        return
+    home = safe_get(event, "homeTeam", "name", default="Home")
+    away = safe_get(event, "awayTeam", "name", default="Away")
+    league = safe_get(event, "tournament", "name", default="")
+    res_msg, passed = format_result_message(event_id, sent, points)
+    strategy = sent.strategy or f"{quarter}Q"
+    if sent.recipients is None:
+        publish(event, strategy, quarter, res_msg)  # сигнал из строки старого формата — получатели неизвестны
+    else:
+        # итог — тем, кто получил сигнал, даже если с тех пор фильтры поменялись
+        for chat_id in sent.recipients:
+            enqueue_message(chat_id, res_msg)
+    # пометим что отправлено итоговое сообщение
+    sent_signals.mark_reported(event_id, quarter)
+    status = "PASSED" if passed else "FAILED"
+    RESULTS_TOTAL.inc(strategy=strategy, status=status)
+    log_match(f"{home} – {away}", f"{status.lower()} {strategy}", event_id, home, away, league)
+    save_signal_log(event_id, league, home, away, f"{quarter}Q", sent.get("line", 0), "оптимальный", status, points)
+
+
+# ------------ Анализ одного события (game) ------------
+# игры, анализ которых идёт прямо сейчас (в _async_loop)
+analyzing_events: set = set()
+
+
+async def analyze_single_event(event: Dict[str, Any]) -> bool:
     """
     Берёт event (как в live events), достаёт summary, проверяет стратегии и отправляет сигналы.
     А также отслеживает окончание четверти и посылает результат по ранее отправленным сигналам.
+    Если прошлый анализ этой игры ещё не закончился — пропускаем (False): иначе оба
+    увидят "сигнала ещё нет" в sent_signals и отправят его дважды.
+    False также, если не удалось получить нужные части подробностей матча — анализ неполный.
     """
     event_id = event.get("id")
-    # берем summary/incidents
-    summary = await get_event_summary(event_id)
+    if event_id in analyzing_events:
+        ANALYZE_SKIPPED.inc()
+        return False
+    analyzing_events.add(event_id)
+    try:
+        return await _analyze_event(event, event_id)
+    finally:
+        analyzing_events.discard(event_id)
+
+
+async def _analyze_event(event: Dict[str, Any], event_id: int) -> bool:
+    # берем только те части summary/incidents, которые нужны стратегиям и итогам (план — по live-событию);
+    # признаки игры считаются один раз за тик и общие для плана, всех правил и итогов
+    features = Features(event)
+    # последний тик доигранной игры (итог 4Q): подробности уже не изменятся
+    finished = str(safe_get(event, "status", "type", default="")).lower() == "finished"
+    tried: set = set()
+    complete = True
+    for _ in range(2):
+        parts = plan_fetch(features) - tried
+        if not parts:
+            break
+        tried |= parts
+        fetched = await get_event_summary(event_id, finished=finished, parts=parts)
+        if fetched:
+            record_snapshot(event_id, "summary", fetched)  # снимки для бэктеста — только с live-анализа
+        complete = complete and len(fetched) == len(parts)
+        features = features.with_summary({**features.summary, **fetched})
+    for part in SUMMARY_PARTS:
+        FETCH_PLAN_TOTAL.inc(part=part, result="fetch" if part in tried else "skip")
+    detected_at = time.monotonic()
 
     # parse some fields
-    home = safe_get(event, "homeTeam", "name", default="Home")
-    away = safe_get(event, "awayTeam", "name", default="Away")
-    period, clock = get_current_period_and_clock(event)
-
-    # Check Strategy 1 (3Q)
-    sig1 = evaluate_strategy_1(event, summary)
-    if sig1:
-        # не шлём повторно для одной и той же четверти
-        if not (sent_signals.get(event_id) and sent_signals[event_id].get(3)):
-            msg = format_signal_message(event_id, sig1)
-            try:
-                bot.send_message(chat_id, msg)
-            except Exception:
-                pass
-            mark_signal_sent(event_id, 3, sig1)
-            # сохраняем лог с pending статус (будем обновлять после окончания четверти)
-            save_signal_log(event_id, safe_get(event, "tournament", "name", default=""), home, away, "3Q", sig1.get("line", 0), "оптимальный", "PENDING", sig1.get("points_in_quarter"))
-
-    # Check Strategy 2 (4Q)
-    sig2 = evaluate_strategy_2(event, summary)
-    if sig2:
-        if not (sent_signals.get(event_id) and sent_signals[event_id].get(4)):
-            msg = format_signal_message(event_id, sig2)
-            try:
-                bot.send_message(chat_id, msg)
-            except Exception:
-                pass
-            mark_signal_sent(event_id, 4, sig2)
-            save_signal_log(event_id, safe_get(event, "tournament", "name", default=""), home, away, "4Q", sig2.get("line", 0), "оптимальный", "PENDING", 0)
+    home, away, period = features["home"], features["away"], features["period"]
+    league = safe_get(event, "tournament", "name", default="")
+    if checked_periods.get(event_id) != period:
+        checked_periods[event_id] = period
+        log_match(f"{home} – {away}", f"checked {period}Q", event_id, home, away, league)
+
+    # правила текущей четверти (не шлём повторно для одной и той же четверти)
+    for rule, sig in evaluate_strategies(features, skip=lambda q: sent_signals.get(event_id, q)):
+        deliver_signal(event, sig["quarter"], sig, detected_at)
 
     # Проверка: если четверть только что завершилась, и у нас есть отправленный сигнал для этой четверти — отправляем итог
     # Попытаемся распарсить period scores и понять очки в последней завершенной
-    periods = []
-    try:
-        if summary and "summary" in summary:
-            periods = parse_period_scores(summary["summary"])
-    except Exception:
-        periods = []
+    periods = features["periods"] or []
     # если в periods появилась запись для законченной четверти и у нас есть сигнал
     if periods:
         # если в event period == n и periods length >= n -> проверить предыдущую как завершённую
@@ -540,52 +2891,765 @@ async def analyze_single_event(event: Dict[str, Any], chat_id: int):
             # index in list is prev_q-1
             if prev_q <= len(periods):
                 pts = periods[prev_q - 1][0] + periods[prev_q - 1][1]
+                # завершённая четверть основного времени — в базовый темп лиги и команд
+                if prev_q <= 4:
+                    pace_baselines.observe(league, home, away, pts, features["period_seconds"] / 60, event_id, prev_q)
                 # проверяем, есть ли у нас сигнал на prev_q
-                sent = sent_signals.get(event_id, {}).get(prev_q)
+                sent = sent_signals.get(event_id, prev_q)
                 if sent and sent.get("reported_result") is None:
-                    # сформируем итог
-                    res_msg, passed = format_result_message(event_id, sent, pts)
-                    try:
-                        bot.send_message(chat_id, res_msg)
-                    except Exception:
-                        pass
-                    # пометим что отправлено итоговое сообщение
-                    sent_signals[event_id][prev_q]["reported_result"] = True
-                    # обновим запись в БД: status = PASSED/FAILED
-                    status = "PASSED" if passed else "FAILED"
-                    save_signal_log(event_id, safe_get(event, "tournament", "name", default=""), home, away, f"{prev_q}Q", sent.get("line", 0), "оптимальный", status, pts)
+                    deliver_result(event, prev_q, pts)
+    return complete
+
+
+# ------------ Планировщик опроса матчей ------------
+# Размер пула воркеров и интервалы опроса — через переменные окружения
+MONITOR_WORKERS = int(os.getenv("MONITOR_WORKERS", "8"))
+LIVE_LIST_INTERVAL = float(os.getenv("LIVE_LIST_INTERVAL", "1"))  # как часто обновляем список live
+POLL_FAST = float(os.getenv("POLL_FAST", "1"))  # конец четверти, для которой есть правила
+POLL_NORMAL = float(os.getenv("POLL_NORMAL", "3"))  # начало такой четверти, проверка итога
+POLL_SLOW = float(os.getenv("POLL_SLOW", "15"))  # четверти до последней с правилами, перерывы
+LATE_QUARTER_SECONDS = int(os.getenv("LATE_QUARTER_SECONDS", "300"))  # "конец четверти" — последние 5 минут
+
+
+def has_pending_result(event_id: int, period: int) -> bool:
+    """Есть ли сигнал по предыдущей четверти, итог которого ещё не отправлен"""
+    sent = sent_signals.get(event_id, period - 1)
+    return sent is not None and sent.reported_result is None
+
+
+def poll_interval_for(event: Dict[str, Any]) -> Optional[float]:
+    """
+    Интервал опроса игры (сек) по её состоянию и четвертям из strategy_plan. None — не опрашивать
+    вообще (ни одна стратегия уже не может сработать и итогов ждать не нужно).
+    """
+    period, _ = get_current_period_and_clock(event)
+    if has_pending_result(event.get("id"), period):
+        return POLL_NORMAL
+    if is_break(event):
+        return POLL_SLOW
+    if period in strategy_plan:
+        left = get_period_seconds_left(event)
+        if left is not None and left <= LATE_QUARTER_SECONDS:
+            return POLL_FAST
+        return POLL_NORMAL
+    if strategy_plan and 1 <= period < max(strategy_plan):
+        return POLL_SLOW  # правила будут в следующих четвертях
+    return None
+
+
+# Игру, у которой с прошлого полного анализа не изменились четверть, статус и счёт, не анализируем
+DELTA_DETECTION = os.getenv("DELTA_DETECTION", "1") == "1"
+ANALYZE_UNCHANGED = Counter("analyze_unchanged_total", "Игры без изменений с прошлого анализа — анализ не запускался")
+METRICS.append(ANALYZE_UNCHANGED)
+
+
+def _score_key(score):
+    return tuple(sorted(score.items())) if isinstance(score, dict) else score
+
+
+def event_fingerprint(event: Dict[str, Any]) -> Optional[int]:
+    """
+    Отпечаток полей live-события, от которых зависят стратегии и итоги: четверть, статус,
+    счёт (общий и по четвертям). Часы сюда не входят: пока счёт стоит (тайм-аут, перерыв,
+    штрафные без попаданий), стратегиям пересчитывать нечего. None — отпечаток не построить.
+    """
+    status = event.get("status") or {}
+    try:
+        return hash((
+            status.get("period") or status.get("currentPeriod"), status.get("code"), status.get("type"),
+            _score_key(event.get("homeScore")), _score_key(event.get("awayScore")),
+        ))
+    except TypeError:
+        return None
+
+
+class GameScheduler:
+    """
+    Очередь с приоритетом по времени следующего опроса игры + ограниченный пул воркеров.
+    Каждая игра находится в очереди не более одного раза; после анализа она
+    перепланируется с интервалом по своему состоянию (poll_interval_for).
+    Игра без изменений с прошлого полного анализа (event_fingerprint) в очередь не ставится,
+    пока не изменится или не будет ждать итог; изменившаяся — не раньше своего интервала.
+    """
+
+    def __init__(self, workers: int = MONITOR_WORKERS):
+        self.workers = max(1, workers)
+        self._heap: List[tuple] = []  # (due, seq, event_id)
+        self._due: Dict[int, float] = {}  # event_id -> актуальный due (старые записи в heap пропускаем)
+        self._events: Dict[int, Dict[str, Any]] = {}  # event_id -> последний объект из live-списка
+        self._running: set = set()
+        # event_id -> (отпечаток, monotonic) последнего полного анализа; удаляется, когда игра уходит из live
+        self._analyzed: Dict[int, tuple] = {}
+        self.paused = False  # нет свежего live-списка — игры не анализируем
+        self._seq = itertools.count()
+        self._ready: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        # накопители для метрик текущего тика
+        self._lags: List[float] = []
+        self._analyzed_count = 0
+        self._unchanged = 0
+        self._last_tick = time.monotonic()
+        self._last_evict = self._last_tick
+        self._last_requests = http_stats["requests"]
+        self.metrics: Dict[str, Any] = {
+            "tick": 0,
+            "games": 0,
+            "scheduled": 0,
+            "queue_depth": 0,
+            "lag_avg": 0.0,
+            "lag_max": 0.0,
+            "analyzed": 0,
+            "unchanged": 0,
+            "rps": 0.0,
+        }
+
+    def start(self):
+        self._ready = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatcher())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _push(self, event_id: int, due: float):
+        self._due[event_id] = due
+        heapq.heappush(self._heap, (due, next(self._seq), event_id))
+        self._wakeup.set()
+
+    def _is_unchanged(self, event_id: int, ev: Dict[str, Any]) -> bool:
+        last = self._analyzed.get(event_id)
+        if not DELTA_DETECTION or last is None or last[0] is None or last[0] != event_fingerprint(ev):
+            return False
+        # итог прошлой четверти проверяем всегда — он может прийти в summary без изменения live-события
+        return not has_pending_result(event_id, get_current_period_and_clock(ev)[0])
+
+    def _next_due(self, event_id: int, now: float, interval: float) -> float:
+        """Новая игра — сразу; изменившаяся после паузы — не раньше интервала от прошлого анализа"""
+        last = self._analyzed.get(event_id)
+        return now if last is None else max(now, last[1] + interval)
+
+    def refresh(self, events: List[Dict[str, Any]]):
+        """Обновить набор live-игр: новые — в очередь, пропавшие — убрать, ускорить те, чей интервал сократился"""
+        now = time.monotonic()
+        live = {}
+        for ev in events:
+            event_id = ev.get("id")
+            if event_id is not None:
+                live[event_id] = ev
+        for event_id in list(self._due):
+            if event_id not in live:
+                del self._due[event_id]
+        for event_id in list(incident_states):
+            if event_id not in live and event_id not in self._running:
+                del incident_states[event_id]
+        for event_id in list(checked_periods):
+            if event_id not in live:
+                del checked_periods[event_id]
+        for event_id in list(self._analyzed):
+            if event_id not in live:
+                del self._analyzed[event_id]
+        if recorder is not None:
+            for event_id in self._events:
+                if event_id not in live:
+                    recorder.forget(event_id)
+        self._events = live
+        sent_signals.touch(live)
+        for event_id, ev in live.items():
+            if event_id in self._running:
+                continue  # перепланируется сам после анализа
+            interval = poll_interval_for(ev)
+            if interval is None:
+                self._due.pop(event_id, None)
+                continue
+            if self._is_unchanged(event_id, ev):
+                self._due.pop(event_id, None)
+                self._unchanged += 1
+                ANALYZE_UNCHANGED.inc()
+                continue
+            due = self._due.get(event_id)
+            if due is None:
+                self._push(event_id, self._next_due(event_id, now, interval))
+            elif due > now + interval:
+                self._push(event_id, now + interval)
+
+    async def _dispatcher(self):
+        """Перекладывает наступившие по времени игры в очередь готовых к анализу"""
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, event_id = heapq.heappop(self._heap)
+                if self._due.get(event_id) != due:
+                    continue  # устаревшая запись
+                del self._due[event_id]
+                self._running.add(event_id)
+                self._ready.put_nowait((due, event_id))
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            due, event_id = await self._ready.get()
+            try:
+                ev = self._events.get(event_id)
+                if ev is None:
+                    continue  # игра пропала из live за время ожидания
+                if self.paused:
+                    continue  # перепланируется в finally
+                started = time.monotonic()
+                self._lags.append(started - due)
+                fingerprint = event_fingerprint(ev)
+                complete = False
+                try:
+                    complete = await analyze_single_event(ev)
+                except Exception as e:
+                    count_error("analyze_single_event", e)
+                ANALYZE_SECONDS.observe(time.monotonic() - started)
+                self._analyzed_count += 1
+                if complete:
+                    self._analyzed[event_id] = (fingerprint, started)
+                else:
+                    self._analyzed.pop(event_id, None)  # неполный анализ повторяем по обычному расписанию
+            finally:
+                self._running.discard(event_id)
+                ev = self._events.get(event_id)
+                interval = poll_interval_for(ev) if ev is not None else None
+                if interval is not None and not self._is_unchanged(event_id, ev):
+                    self._push(event_id, time.monotonic() + interval)
+
+    def end_tick(self):
+        """Снять метрики за прошедший тик"""
+        now = time.monotonic()
+        if now - self._last_evict >= 60:
+            sent_signals.evict()
+            self._last_evict = now
+        elapsed = max(now - self._last_tick, 1e-6)
+        requests_now = http_stats["requests"]
+        overdue = sum(1 for due in self._due.values() if due <= now)
+        lags = self._lags
+        self.metrics = {
+            "tick": self.metrics["tick"] + 1,
+            "games": len(self._events),
+            "scheduled": len(self._due) + len(self._running),
+            "queue_depth": self._ready.qsize() + overdue,
+            "lag_avg": (sum(lags) / len(lags)) if lags else 0.0,
+            "lag_max": max(lags) if lags else 0.0,
+            "analyzed": self._analyzed_count,
+            "unchanged": self._unchanged,
+            "rps": (requests_now - self._last_requests) / elapsed,
+        }
+        self._lags = []
+        self._analyzed_count = 0
+        self._unchanged = 0
+        self._last_tick = now
+        self._last_requests = requests_now
+        return self.metrics
+
+
+scheduler: Optional[GameScheduler] = None
 
 
 # ------------ Фоновый монитор всех live матчей ------------
-async def monitor_all_games(chat_id: int):
+async def monitor_all_games():
     """
-    Основной цикл: каждую секунду берём список live игр и анализируем каждую.
+    Основной цикл: раз в LIVE_LIST_INTERVAL берём список live игр и передаём его планировщику,
+    а сами игры анализируются воркерами планировщика по их собственному расписанию.
+    Конвейер один на всех подписчиков: нагрузка на SofaScore не зависит от их числа.
+    Нет live-списка (SofaScore недоступен дольше LIVE_STALE_MAX) — анализ на паузе,
+    следующий запрос — когда breaker разрешит.
     """
-    global analyzing
+    global scheduler
+    scheduler = GameScheduler()
+    scheduler.start()
+    live_breaker = get_breaker("live")
     try:
         while analyzing:
-            events = await get_live_events()
-            if not events:
-                # ничего не играется
-                await asyncio.sleep(1)
+            tick_started = time.monotonic()
+            try:
+                events = await get_live_events()
+                # по устаревшим данным сигналы не ищем: игры остаются в расписании, но не анализируются
+                scheduler.paused = events is None
+                if events is not None:
+                    scheduler.refresh(events)
+                scheduler.end_tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # ошибка одного тика не останавливает мониторинг
+                count_error("monitor_tick", e)
+            elapsed = time.monotonic() - tick_started
+            TICK_SECONDS.observe(elapsed)
+            if elapsed > LIVE_LIST_INTERVAL:
+                TICK_OVERRUNS.inc()
+            await asyncio.sleep(max(LIVE_LIST_INTERVAL - elapsed, live_breaker.retry_in(), 0.0))
+    finally:
+        await scheduler.stop()
+
+
+# ------------ Шардирование: анализ игр в нескольких процессах ------------
+MONITOR_SHARDS = int(os.getenv("MONITOR_SHARDS", "0"))  # > 1 — анализ в стольких процессах
+SHARD_VNODES = 64  # точек на кольце на один шард
+SHARD_RESTARTS = Counter("shard_restarts_total", "Перезапуски упавших процессов-шардов")
+METRICS.append(SHARD_RESTARTS)
+
+
+class HashRing:
+    """Консистентное хеширование event_id -> шард: при уходе/возврате шарда переезжает только его доля игр"""
+
+    def __init__(self, nodes=(), vnodes: int = SHARD_VNODES):
+        self.vnodes = vnodes
+        self._points: List[tuple] = []  # (hash, node), отсортировано
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return zlib.crc32(key.encode())
+
+    def add(self, node: int):
+        for i in range(self.vnodes):
+            bisect.insort(self._points, (self._hash(f"{node}:{i}"), node))
+
+    def remove(self, node: int):
+        self._points = [p for p in self._points if p[1] != node]
+
+    def __contains__(self, node: int) -> bool:
+        return any(p[1] == node for p in self._points)
+
+    def node(self, key) -> Optional[int]:
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, (self._hash(str(key)), -1))
+        return self._points[i % len(self._points)][1]
+
+
+def _shard_worker_main(shard_id: int, inbox, results):
+    """Точка входа процесса-шарда: свой loop, свой HTTP-пул, свой планировщик; наружу — только через results"""
+    global shard_sink
+    shard_sink = results
+    pace_baselines.load()
+    try:
+        asyncio.run(_shard_worker(shard_id, inbox, results))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _shard_worker(shard_id: int, inbox, results):
+    global scheduler
+    scheduler = GameScheduler()
+    scheduler.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            msgs = [await loop.run_in_executor(None, inbox.get)]
+            # отстали — берём всё накопившееся, из списков игр нужен только последний
+            while True:
+                try:
+                    msgs.append(inbox.get_nowait())
+                except queue.Empty:
+                    break
+            events = None
+            for msg in msgs:
+                if msg[0] == "stop":
+                    return
+                if msg[0] == "adopt":
+                    # игры, переехавшие к нам: отправленные по ним сигналы (чтобы не повторить и дождаться итога)
+                    for fields in msg[1]:
+                        sent_signals.add(SignalRecord(*fields))
+                elif msg[0] == "events":
+                    events = msg[1]
+                    scheduler.paused = False
+                elif msg[0] == "pause":
+                    scheduler.paused = True  # у координатора нет свежего live-списка
+            if events is not None:
+                scheduler.refresh(events)
+            results.put(("metrics", shard_id, os.getpid(), scheduler.end_tick()))
+    finally:
+        await scheduler.stop()
+        await close_aio_session()
+
+
+class ShardCoordinator:
+    """
+    Координатор (основной процесс): сам берёт live-список, делит игры между процессами-шардами
+    по HashRing и применяет то, что шарды прислали: сигналы/итоги (с дедупликацией по sent_signals),
+    /checked, снимки. Telegram, SQLite и webhook остаются в основном процессе.
+    Умерший шард убирается с кольца (его игры при следующем dispatch переходят к остальным) и
+    перезапускается с backoff; на кольцо он возвращается, только когда новый процесс прислал метрики.
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self._ctx = multiprocessing.get_context("spawn")
+        self.results = self._ctx.Queue()
+        self.workers: Dict[int, tuple] = {}  # shard -> (process, inbox)
+        self.ring = HashRing()
+        self.owner: Dict[int, int] = {}  # event_id -> шард
+        self.metrics: Dict[int, Dict[str, Any]] = {}
+        self._reader: Optional[threading.Thread] = None
+        self._last_evict = time.monotonic()
+        self._live: Dict[int, Dict[str, Any]] = {}
+        self._retry_at: Dict[int, float] = {}  # умерший шард -> когда перезапускать
+        self._failures: Dict[int, int] = {}  # шард -> падений подряд
+        self._started: Dict[int, float] = {}  # шард -> время запуска процесса
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+            self.ring.add(shard)
+        self._reader = threading.Thread(target=self._read_results, name="shard-results", daemon=True)
+        self._reader.start()
+
+    def _spawn(self, shard: int):
+        inbox = self._ctx.Queue()
+        proc = self._ctx.Process(
+            target=_shard_worker_main, args=(shard, inbox, self.results), name=f"shard-{shard}", daemon=True
+        )
+        proc.start()
+        self.workers[shard] = (proc, inbox)
+        self._started[shard] = time.monotonic()
+
+    def check_workers(self):
+        """
+        Умершие шарды: снять с кольца (игры переедут при dispatch) и запустить заново — не чаще,
+        чем позволяет backoff (шард, падающий сразу после запуска, ждёт всё дольше)
+        """
+        now = time.monotonic()
+        for shard, (proc, _) in list(self.workers.items()):
+            if proc.is_alive():
                 continue
-            # events может быть списком объектов с полем 'id'
-            tasks = []
-            for ev in events:
-                # асинхронно анализируем каждую игру, но не блокируем основной цикл
-                tasks.append(analyze_single_event(ev, chat_id))
-            # выполняем параллельно (ограничим время выполнения)
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
-            await asyncio.sleep(1)
-    except Exception:
-        # если ошибка в цикле — логируем и делаем паузу
+            if shard not in self._retry_at:
+                failures = 0 if now - self._started[shard] > BACKOFF_MAX else self._failures.get(shard, 0)
+                failures += 1
+                self._failures[shard] = failures
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+                logging.warning(f"Шард {shard} завершился (код {proc.exitcode}), перезапуск через {delay:.0f} с")
+                self._retry_at[shard] = now + delay
+                self.ring.remove(shard)
+                self.metrics.pop(shard, None)
+                for event_id in [e for e, s in self.owner.items() if s == shard]:
+                    del self.owner[event_id]
+            if now >= self._retry_at[shard]:
+                del self._retry_at[shard]
+                SHARD_RESTARTS.inc()
+                self._spawn(shard)
+
+    def dispatch(self, events: List[Dict[str, Any]]):
+        """Раздать live-список: каждому шарду — его игры; новым владельцам — отправленные сигналы по играм"""
+        live = {ev.get("id"): ev for ev in events if ev.get("id") is not None}
+        per_shard: Dict[int, List[Dict[str, Any]]] = {shard: [] for shard in self.workers}
+        adopt: Dict[int, List[tuple]] = {}
+        owner = {}
+        for event_id, ev in live.items():
+            shard = self.ring.node(event_id)
+            if shard is None:
+                continue
+            owner[event_id] = shard
+            per_shard[shard].append(ev)
+            if self.owner.get(event_id) != shard:
+                for rec in sent_signals.for_event(event_id).values():
+                    adopt.setdefault(shard, []).append(tuple(getattr(rec, f) for f in SignalRecord.__slots__))
+        self.owner = owner
+        for shard, (_, inbox) in self.workers.items():
+            if shard in self._retry_at:
+                continue  # процесса нет — ждёт перезапуска
+            if shard in adopt:
+                inbox.put(("adopt", adopt[shard]))
+            inbox.put(("events", per_shard[shard]))
+        # то, что в однопроцессном режиме делает GameScheduler.refresh
+        if recorder is not None:
+            for event_id in self._live:
+                if event_id not in live:
+                    recorder.forget(event_id)
+        self._live = live
+        sent_signals.touch(live)
+        now = time.monotonic()
+        if now - self._last_evict >= 60:
+            sent_signals.evict()
+            self._last_evict = now
+
+    def pause(self):
+        for _, inbox in self.workers.values():
+            inbox.put(("pause",))
+
+    def stop(self, timeout: float = 10):
+        for _, inbox in self.workers.values():
+            inbox.put(("stop",))
+        deadline = time.monotonic() + timeout
+        for proc, _ in self.workers.values():
+            proc.join(max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                proc.terminate()
+        self.results.put(None)
+        if self._reader is not None:
+            self._reader.join(timeout)
+
+    def _read_results(self):
+        while True:
+            msg = self.results.get()
+            if msg is None:
+                return
+            # всё, что трогает outbox / sent_signals, — в loop'е, как и в однопроцессном режиме
+            _async_loop.call_soon_threadsafe(self._apply, msg)
+
+    def _apply(self, msg):
         try:
-            bot.send_message(chat_id, "⚠️ Ошибка в мониторинге; пытаюсь восстановить через 5 сек.")
-        except Exception:
-            pass
-        await asyncio.sleep(5)
-        # loop продолжит работу, если analyzing True
+            kind = msg[0]
+            if kind == "signal":
+                _, event, quarter, sig, detected_at = msg
+                deliver_signal(event, quarter, sig, detected_at)
+            elif kind == "result":
+                _, event, quarter, points = msg
+                deliver_result(event, quarter, points)
+            elif kind == "check":
+                log_match(*msg[1:])
+            elif kind == "record":
+                record_snapshot(*msg[1:])
+            elif kind == "metrics":
+                _, shard, pid, metrics = msg
+                if pid != self.workers[shard][0].pid:
+                    return  # от уже умершего процесса
+                self.metrics[shard] = metrics
+                if shard not in self.ring:
+                    # перезапущенный шард отработал тик — забирает свою долю игр обратно
+                    logging.info(f"Шард {shard} снова в работе")
+                    self.ring.add(shard)
+        except Exception as e:
+            count_error("shard_apply", e)
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка по шардам для /status (формат как у GameScheduler.metrics)"""
+        ms = list(self.metrics.values())
+        return {
+            "shards": sum(1 for proc, _ in self.workers.values() if proc.is_alive()),
+            "games": len(self._live),
+            "scheduled": sum(m["scheduled"] for m in ms),
+            "queue_depth": sum(m["queue_depth"] for m in ms),
+            "unchanged": sum(m.get("unchanged", 0) for m in ms),
+            "lag_avg": max((m["lag_avg"] for m in ms), default=0.0),
+            "lag_max": max((m["lag_max"] for m in ms), default=0.0),
+            "rps": sum(m["rps"] for m in ms),
+        }
+
+
+coordinator: Optional[ShardCoordinator] = None
+
+
+async def monitor_sharded():
+    """monitor_all_games для MONITOR_SHARDS > 1: live-список здесь, анализ — в процессах-шардах"""
+    global coordinator
+    coordinator = ShardCoordinator(MONITOR_SHARDS)
+    coordinator.start()
+    live_breaker = get_breaker("live")
+    try:
+        while analyzing:
+            tick_started = time.monotonic()
+            try:
+                coordinator.check_workers()
+                events = await get_live_events()
+                # как в monitor_all_games: без свежего live-списка шарды ставят анализ на паузу
+                if events is None:
+                    coordinator.pause()
+                else:
+                    coordinator.dispatch(events)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                count_error("monitor_tick", e)
+            elapsed = time.monotonic() - tick_started
+            TICK_SECONDS.observe(elapsed)
+            if elapsed > LIVE_LIST_INTERVAL:
+                TICK_OVERRUNS.inc()
+            await asyncio.sleep(max(LIVE_LIST_INTERVAL - elapsed, live_breaker.retry_in(), 0.0))
+    finally:
+        # join процессов блокирующий — не держим loop
+        await asyncio.get_running_loop().run_in_executor(None, coordinator.stop)
+        coordinator = None
+
+
+MONITOR_RESTARTS = Counter("monitor_restarts_total", "Перезапуски упавшего конвейера мониторинга")
+METRICS.append(MONITOR_RESTARTS)
+
+
+async def supervise_monitor():
+    """
+    Держит monitor_all_games запущенным, пока analyzing: упал — перезапуск с backoff.
+    Подписчикам — одно сообщение на серию падений, а не на каждую попытку.
+    """
+    failures = 0
+    while analyzing:
+        started = time.monotonic()
+        try:
+            await (monitor_sharded() if MONITOR_SHARDS > 1 else monitor_all_games())
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            count_error("monitor_all_games", e)
+            logging.exception("Мониторинг упал")
+            if time.monotonic() - started > BACKOFF_MAX:
+                failures = 0  # проработал долго — это новый сбой, а не продолжение старого
+            failures += 1
+            MONITOR_RESTARTS.inc()
+            if failures == 1:
+                broadcast("⚠️ Ошибка в мониторинге; перезапускаю автоматически.")
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+            await asyncio.sleep(delay / 2 + random.random() * delay / 2)
+
+
+# ------------ Сверка итогов: сигналы по завершённым и пропавшим из live играм ------------
+# Итог 4Q в live не наступает (5-й четверти нет), а игра, ушедшая из live-списка, больше не анализируется.
+# Раз в SETTLE_INTERVAL берём PENDING-сигналы игр, которых нет в live, запрашиваем событие целиком
+# (малой параллельностью, с кэшем) и закрываем итоги по финальным очкам четвертей.
+SETTLE_INTERVAL = float(os.getenv("SETTLE_INTERVAL", "60"))
+SETTLE_BATCH = int(os.getenv("SETTLE_BATCH", "50"))  # игр за один проход
+SETTLE_CONCURRENCY = int(os.getenv("SETTLE_CONCURRENCY", "2"))  # одновременных запросов к SofaScore
+SETTLE_MIN_AGE = float(os.getenv("SETTLE_MIN_AGE", "120"))  # свежие сигналы оставляем live-анализу
+SETTLE_RECHECK = float(os.getenv("SETTLE_RECHECK", "300"))  # незавершённую игру перепроверяем не чаще
+SETTLE_GIVE_UP_HOURS = float(os.getenv("SETTLE_GIVE_UP_HOURS", "48"))  # дальше — VOID (итога не будет)
+# статусы SofaScore, после которых очков уже не будет
+SETTLE_VOID_STATUSES = ("canceled", "postponed", "interrupted", "abandoned")
+SETTLED_TOTAL = Counter("settled_total", "Итоги, закрытые фоновой сверкой, по статусу")
+METRICS.append(SETTLED_TOTAL)
+
+
+# event_id -> когда сверка последний раз запрашивала игру (monotonic): не закрытые тогда
+# (игра не доиграна, 404) ждут SETTLE_RECHECK и не занимают пачку следующих проходов
+settle_checked: Dict[int, float] = {}
+
+
+def pending_settlements(limit: int = SETTLE_BATCH) -> Dict[int, List[tuple]]:
+    """
+    event_id -> [(quarter, league, home, away, line, period_seconds, ts)] PENDING-сигналов старше SETTLE_MIN_AGE, кроме игр
+    в live (если live-список свежий, не старше LIVE_STALE_MAX) и игр, проверенных за последние SETTLE_RECHECK
+    """
+    now = time.monotonic()
+    live = set()
+    if live_snapshot["events"] is not None and now - live_snapshot["at"] <= LIVE_STALE_MAX:
+        live = {ev.get("id") for ev in live_snapshot["events"]}
+    before = datetime.utcfromtimestamp(time.time() - SETTLE_MIN_AGE).isoformat()
+    conn = read_db()
+    try:
+        rows = conn.execute(
+            "SELECT event_id, quarter, league, home, away, line, period_seconds, ts FROM signals "
+            "WHERE status = 'PENDING' AND ts < ? ORDER BY ts",
+            (before,),
+        ).fetchall()
+    finally:
+        conn.close()
+    games: Dict[int, List[tuple]] = {}
+    pending = set()
+    for event_id, *row in rows:
+        pending.add(event_id)
+        checked = settle_checked.get(event_id)
+        if event_id in live or (checked is not None and now - checked < SETTLE_RECHECK):
+            continue
+        if event_id not in games and len(games) >= limit:
+            continue
+        games.setdefault(event_id, []).append(tuple(row))
+    for event_id in [e for e in settle_checked if e not in pending]:
+        del settle_checked[event_id]
+    return games
+
+
+async def fetch_final_event(event_id: int) -> Optional[Dict[str, Any]]:
+    """Событие целиком (статус и счёт по четвертям); ответ кэшируется на SETTLE_RECHECK"""
+    data = await fetch_json(f"{SOFASCORE_API}/event/{event_id}", "event", SETTLE_RECHECK)
+    return data.get("event") if isinstance(data, dict) else None
+
+
+def settle_signal(event: Dict[str, Any], event_id: int, row: tuple, points: Optional[int]):
+    """
+    Закрыть один PENDING (points=None — VOID): через deliver_result, если сигнал ещё в памяти
+    (подписчики получат итог), иначе — только в БД. Уже отправленный итог не трогаем: его запись
+    может ещё стоять в очереди DBWriter; а _write_signal в транзакции обновит только PENDING-строку.
+    """
+    quarter, league, home, away, line, _, _ = row
+    q = int(str(quarter).rstrip("Q"))
+    status = "VOID" if points is None else ("PASSED" if points > (line or 0) else "FAILED")
+    sent = sent_signals.get(event_id, q)
+    if sent is not None and sent.reported_result is not None:
+        return
+    if status != "VOID" and sent is not None:
+        deliver_result({**event, "id": event_id}, q, points)
+        SETTLED_TOTAL.inc(status=status)
+        return
+    sent_signals.mark_reported(event_id, q)
+    init_db()
+    ts = datetime.utcnow().isoformat()
+
+    def write(cur):
+        if _write_signal(cur, ts, event_id, league, home, away, quarter, line, "оптимальный", status, points):
+            SETTLED_TOTAL.inc(status=status)
+
+    db_writer.submit(write)
+
+
+async def settle_event(event_id: int, rows: List[tuple], sem: asyncio.Semaphore):
+    settle_checked[event_id] = time.monotonic()
+    async with sem:
+        event = await fetch_final_event(event_id)
+    status_type = str(safe_get(event or {}, "status", "type", default="")).lower()
+    oldest = min(row[-1] for row in rows)
+    expired = oldest < datetime.utcfromtimestamp(time.time() - SETTLE_GIVE_UP_HOURS * 3600).isoformat()
+    if status_type == "finished":
+        periods = event_period_scores(event)
+        if len(periods) < max(int(str(row[0]).rstrip("Q")) for row in rows):
+            # в событии нет очков нужных четвертей — match-summary; игра завершена, ответ держим в кэше долго
+            async with sem:
+                summary = await get_event_summary(event_id, finished=True, parts=("summary",))
+            periods = get_period_scores(event, summary)
+        league = safe_get(event, "tournament", "name", default="")
+        home = safe_get(event, "homeTeam", "name", default="")
+        away = safe_get(event, "awayTeam", "name", default="")
+        # длина четверти — как в live-анализе: из события, иначе записанная с сигналом
+        seconds = event_period_seconds(event) or next((row[5] for row in rows if row[5]), None) or PACE_PERIOD_SECONDS
+        for q, (h, a) in enumerate(periods[:4], 1):
+            pace_baselines.observe(league, home, away, h + a, seconds / 60, event_id, q)
+        for row in rows:
+            q = int(str(row[0]).rstrip("Q"))
+            if q <= len(periods):
+                settle_signal(event, event_id, row, periods[q - 1][0] + periods[q - 1][1])
+            elif expired:
+                settle_signal(event, event_id, row, None)
+    elif status_type in SETTLE_VOID_STATUSES or expired:
+        for row in rows:
+            settle_signal(event or {}, event_id, row, None)
+
+
+async def settle_pending() -> int:
+    """Один проход сверки; возвращает число игр, по которым были запросы"""
+    loop = asyncio.get_running_loop()
+    games = await loop.run_in_executor(None, pending_settlements)
+    sem = asyncio.Semaphore(SETTLE_CONCURRENCY)
+    results = await asyncio.gather(*[settle_event(event_id, rows, sem) for event_id, rows in games.items()], return_exceptions=True)
+    for r in results:
+        if isinstance(r, BaseException) and not isinstance(r, (SofaScoreError, CircuitOpenError)):
+            count_error("settle", r)
+    return len(games)
+
+
+async def settlement_loop():
+    """Фоновая сверка итогов — своё расписание, не зависит от тиков монитора и подписчиков"""
+    while True:
+        try:
+            await settle_pending()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            count_error("settlement_loop", e)
+        await asyncio.sleep(max(SETTLE_INTERVAL, get_breaker("event").retry_in()))
+
+
+settlement_future = None
 
 
 # ------------ Telegram команды (webhook mode) ------------
@@ -594,24 +3658,17 @@ def cmd_start(message):
     bot.reply_to(message, "Бот запущен. Используй /start_analiz чтобы включить анализ, /stop_analiz чтобы выключить.")
 
 
-@bot.message_handler(commands=["start_analiz"])
-def cmd_start_analiz(message):
+def ensure_monitor():
+    """Запустить общий конвейер мониторинга, если он ещё не запущен"""
     global analyzing, monitor_task_future
     if analyzing:
-        bot.reply_to(message, "Анализ уже запущен.")
         return
     analyzing = True
-    bot.reply_to(message, "✅ Запускаю мониторинг live-матчей. Бот будет анализировать каждую секунду.")
-    # запускаем фоновой таск
-    monitor_task_future = run_coro(monitor_all_games(message.chat.id))
+    monitor_task_future = run_coro(supervise_monitor())
 
 
-@bot.message_handler(commands=["stop_analiz"])
-def cmd_stop_analiz(message):
+def stop_monitor():
     global analyzing, monitor_task_future
-    if not analyzing:
-        bot.reply_to(message, "Анализ уже остановлен.")
-        return
     analyzing = False
     # отмена таска (по возможности)
     if monitor_task_future:
@@ -619,24 +3676,255 @@ def cmd_stop_analiz(message):
             monitor_task_future.cancel()
         except Exception:
             pass
-    bot.reply_to(message, "⛔ Анализ остановлен. Бот больше не будет опрашивать матчи.")
+        monitor_task_future = None
+
+
+@bot.message_handler(commands=["start_analiz"])
+def cmd_start_analiz(message):
+    if subscriptions.get(message.chat.id):
+        bot.reply_to(message, "Анализ уже запущен.")
+        return
+    subscriptions.put(Subscription(message.chat.id))
+    ensure_monitor()
+    bot.reply_to(message, "✅ Подписка на сигналы live-матчей включена. Фильтры: /filter")
+
+
+@bot.message_handler(commands=["stop_analiz"])
+def cmd_stop_analiz(message):
+    if not subscriptions.remove(message.chat.id):
+        bot.reply_to(message, "Анализ уже остановлен.")
+        return
+    # общий конвейер останавливаем, только когда не осталось подписчиков
+    if not len(subscriptions):
+        stop_monitor()
+    bot.reply_to(message, "⛔ Анализ остановлен. Бот больше не будет присылать сигналы в этот чат.")
+
+
+@bot.message_handler(commands=["filter"])
+def cmd_filter(message):
+    """
+    /filter — показать фильтры
+    /filter leagues NBA, Euroleague | /filter strategies 3Q | /filter quarters 3,4 | /filter reset
+    """
+    sub = subscriptions.get(message.chat.id)
+    if sub is None:
+        bot.reply_to(message, "Сначала включи анализ: /start_analiz")
+        return
+    parts = (message.text or "").split(maxsplit=2)
+    if len(parts) == 1:
+        bot.reply_to(message, sub.describe())
+        return
+    what = parts[1].lower()
+    arg = parts[2] if len(parts) > 2 else ""
+    leagues, strategies, quarters = list(sub.leagues), list(sub.strategies), list(sub.quarters)
+    try:
+        if what == "reset":
+            leagues, strategies, quarters = [], [], []
+        elif what == "leagues":
+            leagues = arg.split(",")  # в названиях лиг бывают пробелы
+        elif what == "strategies":
+            strategies = re.split(r"[,\s]+", arg)
+        elif what == "quarters":
+            quarters = [int(v) for v in re.split(r"[,\s]+", arg) if v]
+        else:
+            raise ValueError(what)
+    except ValueError:
+        bot.reply_to(message, "Формат: /filter leagues NBA, Euroleague | strategies 3Q,4Q | quarters 3,4 | reset")
+        return
+    sub = Subscription(message.chat.id, leagues, strategies, quarters)
+    subscriptions.put(sub)
+    bot.reply_to(message, "Фильтры обновлены.\n" + sub.describe())
+
+
+@bot.message_handler(commands=["checked"])
+def cmd_checked(message):
+    """
+    /checked — последние 10 проверок (из памяти)
+    /checked Lakers | /checked team=Lakers league=NBA date=2026-10-17 status=PASSED — поиск по истории
+    """
+    args = (message.text or "").split()[1:]
+    if not args:
+        entries = check_history.last(10)
+        if not entries:
+            bot.reply_to(message, "Пока нет проверенных матчей.")
+        else:
+            bot.reply_to(message, "Последние проверки:\n" + format_checks(entries))
+        return
+    filters = {"team": [], "league": "", "date": "", "status": ""}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if sep and key in ("league", "date", "status"):
+            filters[key] = value
+        elif sep and key == "team":
+            filters["team"].append(value)
+        else:
+            filters["team"].append(arg)
+    entries = check_history.query(
+        team=" ".join(filters["team"]), league=filters["league"], date=filters["date"], status=filters["status"].lower()
+    )
+    if not entries:
+        bot.reply_to(message, "Ничего не найдено.")
+    else:
+        bot.reply_to(message, "Найденные проверки:\n" + format_checks(entries))
+
+
+@bot.message_handler(commands=["stats"])
+def cmd_stats(message):
+    """
+    /stats — итоги сигналов за STATS_DEFAULT_DAYS дней по стратегиям и лигам
+    /stats 3Q | /stats 7d | /stats today | /stats all | /stats NBA | /stats 4Q 7d league=Liga ACB
+    """
+    strategy, league, days = parse_stats_args((message.text or "").split()[1:])
+    try:
+        text = stats_text(strategy, league, days)
+    except Exception as e:
+        count_error("stats", e)
+        text = "Статистика сейчас недоступна."
+    bot.reply_to(message, text)
 
 
 @bot.message_handler(commands=["status"])
 def cmd_status(message):
-    bot.reply_to(message, f"Анализ запущен: {analyzing}")
+    text = f"Анализ запущен: {analyzing}, подписчиков: {len(subscriptions)}"
+    text += f"\nЭтот чат подписан: {'да' if subscriptions.get(message.chat.id) else 'нет'}"
+    m = coordinator.summary() if coordinator is not None else (scheduler.metrics if scheduler is not None else None)
+    if analyzing and m is not None:
+        if "shards" in m:
+            text += f"\nПроцессов-шардов: {m['shards']}"
+        text += (
+            f"\nИгр в live: {m['games']}, в расписании: {m['scheduled']}, без изменений: {m['unchanged']}"
+            f"\nОчередь: {m['queue_depth']}, отставание: {m['lag_avg']:.2f}/{m['lag_max']:.2f} с"
+            f"\nЗапросов/с: {m['rps']:.1f}"
+        )
+    if outbox is not None:
+        o, lat = outbox.stats, outbox.latency()
+        text += (
+            f"\nTelegram: в очереди {outbox.depth()}, отправлено {o['sent']}, ошибок {o['failed']}, "
+            f"задержка p50/p95 {lat['p50']:.2f}/{lat['p95']:.2f} с"
+        )
+    c = http_cache.stats
+    text += (
+        f"\nКэш HTTP: hit {c['hits']}, 304 {c['not_modified']}, miss {c['misses']}, "
+        f"сэкономлено {c['bytes_saved'] // 1024} КБ"
+    )
+    for name, b in breakers.items():
+        if b.state != "closed":
+            text += f"\n⚠️ SofaScore {name}: недоступен, повтор через {b.retry_in():.0f} с"
+    p = http_pool_stats()
+    text += f"\nПул HTTP: в работе {p['in_flight']} из {p['limit']}"
+    if "in_use" in p:
+        text += f", соединений занято {p['in_use']}, свободно {p['idle']}"
+    bot.reply_to(message, text)
+
+
+# ------------ Обработка входящих обновлений (webhook) ------------
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # на всех воркеров; переполнение -> 503
+WEBHOOK_DEDUPE_SIZE = 10000  # сколько последних update_id помним
+WEBHOOK_SERVER = os.getenv("WEBHOOK_SERVER", "waitress")  # waitress | flask (встроенный dev-сервер)
+WEBHOOK_HTTP_THREADS = int(os.getenv("WEBHOOK_HTTP_THREADS", "8"))
+UPDATE_SECONDS = Histogram("webhook_update_seconds", "От приёма webhook до конца обработки обновления")
+UPDATES_TOTAL = Counter("webhook_updates_total", "Входящие обновления по результату")
+METRICS += [UPDATE_SECONDS, UPDATES_TOTAL]
+
+
+class UpdateDispatcher:
+    """
+    Webhook только кладёт сырое обновление в очередь и сразу отвечает 200.
+    Обработку (de_json + хендлеры) делает ограниченный пул потоков. Обновления одного чата
+    всегда попадают в один и тот же поток, поэтому порядок команд в чате сохраняется.
+    Повторы Telegram (тот же update_id) отбрасываются.
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        per_worker = max(1, queue_size // self.workers)
+        self._queues = [queue.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._worker, args=(q,), name=f"update-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stop(self, timeout: float = 5):
+        """Дообработать очередь и остановить потоки"""
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _first_seen(self, update_id) -> bool:
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            self._seen[update_id] = None
+            if len(self._seen) > WEBHOOK_DEDUPE_SIZE:
+                self._seen.popitem(last=False)
+            return True
+
+    def _forget(self, update_id):
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+    def submit(self, raw: bytes) -> bool:
+        """Принять обновление. False — очередь переполнена (ответим 503, Telegram повторит позже)"""
+        self.start()
+        try:
+            data = json_loads(raw)
+            update_id = data["update_id"]
+        except Exception as e:
+            count_error("webhook_parse", e)
+            UPDATES_TOTAL.inc(result="invalid")
+            return True  # повтор того же мусора не поможет
+        if not self._first_seen(update_id):
+            UPDATES_TOTAL.inc(result="duplicate")
+            return True
+        message = data.get("message") or data.get("edited_message") or safe_get(data, "callback_query", "message") or {}
+        key = safe_get(message, "chat", "id", default=update_id)
+        try:
+            self._queues[hash(key) % self.workers].put_nowait((time.monotonic(), data))
+        except queue.Full:
+            self._forget(update_id)
+            UPDATES_TOTAL.inc(result="rejected")
+            return False
+        UPDATES_TOTAL.inc(result="queued")
+        return True
+
+    def _worker(self, q: "queue.Queue"):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            received_at, data = item
+            try:
+                update = telebot.types.Update.de_json(data)
+                bot.process_new_updates([update])
+                UPDATES_TOTAL.inc(result="processed")
+            except Exception as e:
+                count_error("webhook_handler", e)
+            UPDATE_SECONDS.observe(time.monotonic() - received_at)
+
+
+update_dispatcher = UpdateDispatcher()
 
 
 # ------------ Webhook (Render) ------------
 @server.route(f"/{TOKEN}", methods=["POST"])
 def getMessage():
-    try:
-        json_str = request.get_data().decode("utf-8")
-        update = telebot.types.Update.de_json(json_str)
-        bot.process_new_updates([update])
-    except Exception:
-        pass
-    return "OK", 200
+    if update_dispatcher.submit(request.get_data()):
+        return "OK", 200
+    return "Busy", 503
 
 
 @server.route("/")
@@ -651,13 +3939,177 @@ def set_webhook_route():
         return f"Error setting webhook: {e}", 500
 
 
-# ------------ Запуск (локальный режим — для отладки) ------------
-if __name__ == "__main__":
+# ------------ Метрики / профайлер (HTTP) ------------
+register_gauge("monitor_running", "Общий конвейер мониторинга запущен", lambda: int(analyzing))
+register_gauge("monitor_tick_target_seconds", "Целевая длительность тика", lambda: LIVE_LIST_INTERVAL)
+register_gauge("subscribers", "Подписанные чаты", lambda: len(subscriptions))
+register_gauge("sent_signals_events", "Игр в состоянии отправленных сигналов", lambda: len(sent_signals))
+register_gauge("incident_states", "Игр с состоянием play-by-play", lambda: len(incident_states))
+register_gauge("pace_baselines", "Лиг и команд с базовым темпом", lambda: len(pace_baselines))
+register_gauge(
+    "scheduler", "Метрики планировщика за последний тик",
+    lambda: {(("metric", k),): v for k, v in scheduler.metrics.items()} if scheduler is not None else {},
+)
+register_gauge("http_cache", "Счётчики HTTP-кэша", lambda: {(("metric", k),): v for k, v in http_cache.stats.items()})
+register_gauge("http_pool", "Пул соединений к SofaScore", lambda: {(("metric", k),): v for k, v in http_pool_stats().items()})
+register_gauge(
+    "sofascore_breaker_open", "Breaker эндпойнта разомкнут (1) или пробный запрос (0.5)",
+    lambda: {(("endpoint", name),): {"closed": 0, "half-open": 0.5, "open": 1}[b.state] for name, b in breakers.items()},
+)
+register_gauge("http_cache_entries", "Записей в HTTP-кэше", lambda: len(http_cache))
+register_gauge("telegram_queue_depth", "Сообщений в очереди Telegram", lambda: outbox.depth() if outbox is not None else 0)
+register_gauge(
+    "telegram_outbox", "Счётчики очереди Telegram",
+    lambda: {(("metric", k),): v for k, v in outbox.stats.items()} if outbox is not None else {},
+)
+register_gauge("webhook_queue_depth", "Обновлений в очереди обработки", lambda: update_dispatcher.depth())
+register_gauge("db_queue_depth", "Операций в очереди записи SQLite", lambda: db_writer.pending() if db_writer is not None else 0)
+
+
+@server.route("/metrics")
+def metrics_route():
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@server.route("/debug/profile")
+def profile_route():
+    """/debug/profile?seconds=10&top=30 — сэмплировать стеки всех потоков и отдать самые горячие функции"""
+    if not PROFILER_ENABLED:
+        return "Профайлер выключен (PROFILER_ENABLED=1)", 404
+    seconds = min(float(request.args.get("seconds", 10)), 60)
+    top = int(request.args.get("top", 30))
+    return SamplingProfiler().run(seconds, top), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+# ------------ Запуск: polling или webhook ------------
+SHUTDOWN_FLUSH_TIMEOUT = float(os.getenv("SHUTDOWN_FLUSH_TIMEOUT", "10"))
+log = logging.getLogger("bot")
+
+
+class _Timer:
+    """Замер шагов запуска/остановки для лога"""
+
+    def __init__(self, title: str):
+        self.title = title
+        self.steps: List[tuple] = []
+        self._started = self._last = time.monotonic()
+
+    def step(self, name: str):
+        now = time.monotonic()
+        self.steps.append((name, (now - self._last) * 1000))
+        self._last = now
+
+    def report(self):
+        total = (time.monotonic() - self._started) * 1000
+        parts = ", ".join(f"{name} {ms:.0f} мс" for name, ms in self.steps)
+        log.info(f"{self.title}: {total:.0f} мс ({parts})")
+
+
+def startup(mode: str):
+    """Запуск компонентов по порядку: БД -> состояние -> loop и HTTP -> очередь Telegram -> сверка итогов и монитор"""
+    global settlement_future
+    timer = _Timer(f"Запуск ({mode})")
     init_db()
-    # если запускаешь локально без webhook, можно включить polling (не рекомендуем на Render)
-    server.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
+    timer.step("БД")
+    subscriptions.load()
+    restored = sent_signals.restore()
+    paced = pace_baselines.load()
+    check_history.load_recent()
+    timer.step(f"состояние ({len(subscriptions)} подписок, {restored} сигналов, {paced} четвертей для темпа)")
+    start_async_loop()
+    start_recorder()
+    run_coro(get_aio_session()).result(10)
+    timer.step(f"loop и HTTP-сессия (JSON: {json_backend}{' + проекции' if _projection_decoders else ''})")
+    unsent = run_coro(restore_unsent_messages()).result(10)
+    timer.step(f"очередь Telegram ({unsent} неотправленных)")
+    settlement_future = run_coro(settlement_loop())
+    if len(subscriptions):
+        ensure_monitor()
+    timer.step("сверка итогов и монитор")
+    try:
+        if mode == "webhook":
+            update_dispatcher.start()
+            if RENDER_EXTERNAL_URL:
+                set_webhook_route()
+        else:
+            # с активным webhook'ом getUpdates не работает
+            bot.remove_webhook()
+    except Exception as e:
+        count_error("startup", e)
+        log.warning(f"Telegram ({mode}): {e}")
+    timer.step(mode)
+    timer.report()
+
+
+async def _shutdown_async():
+    global analyzing, monitor_task_future, settlement_future
+    analyzing = False
+    for future in (monitor_task_future, settlement_future):
+        if future is not None:
+            future.cancel()
+            await asyncio.gather(asyncio.wrap_future(future), return_exceptions=True)
+    monitor_task_future = settlement_future = None
+    if outbox is not None:
+        save_unsent_messages(await outbox.close(SHUTDOWN_FLUSH_TIMEOUT))
+    await close_aio_session()
+
+
+def shutdown(mode: str):
+    """Остановка в обратном порядке: приём обновлений -> монитор -> очередь Telegram -> HTTP -> запись в БД"""
+    timer = _Timer(f"Остановка ({mode})")
+    if mode == "webhook":
+        update_dispatcher.stop()
+    else:
+        bot.stop_polling()
+    timer.step("приём обновлений")
+    if _loop_thread is not None:
+        try:
+            run_coro(_shutdown_async()).result(SHUTDOWN_FLUSH_TIMEOUT + 5)
+        except Exception as e:
+            count_error("shutdown", e)
+        _async_loop.call_soon_threadsafe(_async_loop.stop)
+    timer.step("монитор, Telegram, HTTP")
+    if recorder is not None:
+        recorder.stop()
+    if db_writer is not None:
+        db_writer.stop()
+    timer.step("БД")
+    timer.report()
+
+
+def main(argv=None):
+    default_mode = os.getenv("BOT_MODE") or ("webhook" if RENDER_EXTERNAL_URL else "polling")
+    parser = argparse.ArgumentParser(description="Telegram-бот сигналов по live-баскетболу")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=default_mode)
+    args = parser.parse_args(argv)
+
+    # SIGTERM (Render при деплое/рестарте) — как Ctrl+C: выходим через finally с остановкой
+    def _on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    startup(args.mode)
+    try:
+        if args.mode == "webhook":
+            host, port = "0.0.0.0", int(os.environ.get("PORT", 5000))
+            serve = None
+            if WEBHOOK_SERVER == "waitress":
+                # production WSGI-сервер: многопоточный, в одном процессе с монитором
+                try:
+                    from waitress import serve
+                except ImportError:
+                    log.warning("waitress не установлен (pip install -r requirements.txt) — запускаю встроенный сервер Flask")
+            if serve is not None:
+                serve(server, host=host, port=port, threads=WEBHOOK_HTTP_THREADS)
+            else:
+                server.run(host=host, port=port, threaded=True)
+        else:
+            bot.infinity_polling()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown(args.mode)
 
 
 if __name__ == "__main__":
-    print("Бот запущен...")
-    bot.infinity_polling()
+    main()
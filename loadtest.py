@@ -0,0 +1,462 @@
+# loadtest.py
+"""
+Нагрузочный тест бота на локальных заглушках SofaScore и Telegram Bot API.
+
+Заглушки работают в отдельном процессе (их CPU не смешивается с ботом):
+  - SofaScore: events/live, event/<id>, event/<id>/match-summary, event/<id>/incidents для N синтетических игр.
+    Игры идут в ускоренном времени (--speed игровых секунд за секунду), счёт и play-by-play растут
+    по случайной (с seed) ленте очков и фолов; закончившаяся игра сменяется новой.
+  - Telegram: /bot<token>/sendMessage. По тексту сигнала определяет игру и считает задержку
+    от момента, когда условие стратегии стало выполняться в данных SofaScore, до получения сообщения.
+  Обе поддерживают задержку ответа и долю ошибок (SofaScore — 500, Telegram — 429 с retry_after).
+
+Бот в этом процессе работает как обычно (supervise_monitor -> monitor_all_games -> планировщик -> analyze_single_event ->
+очередь Telegram -> SQLite), только с адресами заглушек. Для каждого числа игр отчёт:
+перцентили длительности тика, отставание планировщика, запросов/с, CPU, RSS, задержка сигналов.
+
+Примеры:
+    python loadtest.py
+    python loadtest.py --games 10,100,1000 --duration 60 --latency-ms 80 --error-rate 0.02
+    python loadtest.py --games 500 --tg-error-rate 0.1 --json
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+# bot.py требует токен при импорте; Telegram здесь — заглушка
+os.environ.setdefault("BOT_TOKEN", "0:loadtest")
+os.environ.pop("RECORD_DIR", None)
+
+import bot
+
+QUARTER_SECONDS = 600
+GAME_SECONDS = 4 * QUARTER_SECONDS
+SIGNAL_RE = re.compile(r"Сигнал \[(\d)Q\]\nМатч: Home (\d+) –")
+
+
+# ------------ Синтетическая игра ------------
+class FakeGame:
+    """Лента игры в игровых секундах: очки и фолы (время, команда, очки), счёт после каждого события"""
+
+    def __init__(self, event_id: int, seed: int, started_at: float, speed: float):
+        self.event_id = event_id
+        self.started_at = started_at  # wall time, когда игровое время было 0
+        self.speed = speed
+        rnd = random.Random(seed)
+        pace = rnd.uniform(0.05, 0.1)  # событий в игровую секунду
+        self.times: List[float] = []
+        self.incidents: List[Dict[str, Any]] = []
+        self.scores: List[tuple] = []  # счёт (home, away) после события i
+        home = away = 0
+        t = 0.0
+        marker = 1
+        while True:
+            t += rnd.expovariate(pace)
+            while marker < 4 and t >= marker * QUARTER_SECONDS:
+                self._add(marker * QUARTER_SECONDS, {"incidentType": "period", "text": f"Q{marker}"}, home, away)
+                marker += 1
+            if t >= GAME_SECONDS:
+                break
+            is_home = rnd.random() < 0.5
+            if rnd.random() < 0.2:
+                kind, pts = "foul", 0
+            else:
+                kind, pts = "goal", rnd.choice((1, 2, 2, 2, 3))
+            if is_home:
+                home += pts
+            else:
+                away += pts
+            self._add(t, {"incidentType": kind, "isHome": is_home,
+                          "team": {"id": event_id * 2 + (0 if is_home else 1)}}, home, away)
+
+    def _add(self, t: float, incident: Dict[str, Any], home: int, away: int):
+        incident.update(id=len(self.incidents), time=int(t), period=min(4, int(t // QUARTER_SECONDS) + 1),
+                        homeScore=home, awayScore=away)
+        self.times.append(t)
+        self.incidents.append(incident)
+        self.scores.append((home, away))
+
+    def game_time(self, now: float) -> float:
+        return (now - self.started_at) * self.speed
+
+    def wall_time(self, game_time: float) -> float:
+        return self.started_at + game_time / self.speed
+
+    def score_at(self, t: float) -> tuple:
+        i = bisect.bisect_right(self.times, t)
+        return self.scores[i - 1] if i else (0, 0)
+
+    def period_scores(self, t: float) -> List[tuple]:
+        """Очки по четвертям до момента t (текущая четверть — частично)"""
+        result = []
+        prev = (0, 0)
+        for q in range(1, min(4, int(t // QUARTER_SECONDS) + 1) + 1):
+            end = self.score_at(min(t, q * QUARTER_SECONDS - 1e-6))
+            result.append((end[0] - prev[0], end[1] - prev[1]))
+            prev = end
+        return result
+
+    def event(self, now: float) -> Dict[str, Any]:
+        t = min(self.game_time(now), GAME_SECONDS - 1)
+        period = int(t // QUARTER_SECONDS) + 1
+        home, away = self.score_at(t)
+        home_score: Dict[str, Any] = {"current": home, "display": home}
+        away_score: Dict[str, Any] = {"current": away, "display": away}
+        for i, (h, a) in enumerate(self.period_scores(t), 1):
+            home_score[f"period{i}"] = h
+            away_score[f"period{i}"] = a
+        return {
+            "id": self.event_id,
+            "tournament": {"name": f"League {self.event_id % 20}", "id": self.event_id % 20},
+            "homeTeam": {"id": self.event_id * 2, "name": f"Home {self.event_id}"},
+            "awayTeam": {"id": self.event_id * 2 + 1, "name": f"Away {self.event_id}"},
+            "status": {"code": 12 + period, "period": period, "description": f"{period}Q", "type": "inprogress"},
+            "time": {"played": int(t), "periodLength": QUARTER_SECONDS},
+            "homeScore": home_score,
+            "awayScore": away_score,
+        }
+
+    def summary(self, now: float) -> Dict[str, Any]:
+        periods = self.period_scores(min(self.game_time(now), GAME_SECONDS - 1))
+        return {"periods": [{"homeScore": h, "awayScore": a} for h, a in periods]}
+
+    def incidents_at(self, now: float) -> Dict[str, Any]:
+        n = bisect.bisect_right(self.times, self.game_time(now))
+        return {"incidents": self.incidents[:n][::-1]}  # как у SofaScore: новые сначала
+
+    def signal_time(self, quarter: int, min_3q: int, max_diff_4q: int) -> Optional[float]:
+        """Игровое время, когда условие стратегии впервые выполнилось (None — не выполнилось)"""
+        start = (quarter - 1) * QUARTER_SECONDS
+        base = self.score_at(start - 1e-6)
+        candidates = [start] + [t for t in self.times if start <= t < start + QUARTER_SECONDS]
+        for t in candidates:
+            home, away = self.score_at(t)
+            if quarter == 3 and (home - base[0]) + (away - base[1]) >= min_3q:
+                return t
+            if quarter == 4 and abs(home - away) <= max_diff_4q:
+                return t
+        return None
+
+
+# ------------ Заглушки SofaScore и Telegram (отдельный процесс) ------------
+class FakeServers:
+    def __init__(self):
+        self.games: List[FakeGame] = []
+        self.by_id: Dict[int, FakeGame] = {}
+        self.config: Dict[str, Any] = {}
+        self.next_id = 1
+        self.rnd = random.Random(0)
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.stats: Dict[str, Any] = {"requests": {}, "errors": 0, "tg_requests": 0, "tg_errors": 0, "signals": []}
+
+    def reset(self, config: Dict[str, Any]):
+        self.config = config
+        self.rnd = random.Random(config.get("seed", 0))
+        self.by_id = {}
+        self.finished = deque()
+        now = time.time()
+        # игры равномерно раскиданы по всем четвертям
+        self.games = [self._new_game(now - self.rnd.uniform(0, GAME_SECONDS) / config["speed"]) for _ in range(config["games"])]
+        self._reset_stats()
+
+    def _new_game(self, started_at: float) -> FakeGame:
+        game = FakeGame(self.next_id, self.rnd.randrange(1 << 30), started_at, self.config["speed"])
+        self.next_id += 1
+        self.by_id[game.event_id] = game
+        return game
+
+    def live(self, now: float) -> Dict[str, Any]:
+        for i, game in enumerate(self.games):
+            if game.game_time(now) >= GAME_SECONDS:
+                # игра закончилась — на её место новая; старая ещё отвечает на match-summary/incidents
+                self.games[i] = self._new_game(now)
+                self.finished.append(game.event_id)
+        while len(self.finished) > len(self.games):
+            self.by_id.pop(self.finished.popleft(), None)
+        return {"events": [game.event(now) for game in self.games]}
+
+    async def _delay(self, latency_ms: float):
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms / 1000 * self.rnd.uniform(0.5, 1.5))
+
+    async def sofascore(self, request):
+        from aiohttp import web
+        kind = request.match_info.get("kind", "event" if "event_id" in request.match_info else "live")
+        self.stats["requests"][kind] = self.stats["requests"].get(kind, 0) + 1
+        await self._delay(self.config.get("latency_ms", 0))
+        if self.rnd.random() < self.config.get("error_rate", 0):
+            self.stats["errors"] += 1
+            return web.Response(status=500)
+        now = time.time()
+        if kind == "live":
+            return web.json_response(self.live(now))
+        game = self.by_id.get(int(request.match_info["event_id"]))
+        if game is None:
+            return web.Response(status=404)
+        if kind == "event":
+            event = game.event(now)
+            if game.game_time(now) >= GAME_SECONDS:
+                event["status"] = {"code": 100, "type": "finished", "description": "Ended"}
+            return web.json_response({"event": event})
+        return web.json_response(game.summary(now) if kind == "match-summary" else game.incidents_at(now))
+
+    async def telegram(self, request):
+        from aiohttp import web
+        received = time.time()
+        self.stats["tg_requests"] += 1
+        params = dict(request.query)
+        if request.body_exists:
+            params.update(await request.post())
+        await self._delay(self.config.get("tg_latency_ms", 0))
+        if self.rnd.random() < self.config.get("tg_error_rate", 0):
+            self.stats["tg_errors"] += 1
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}}, status=429)
+        for quarter, event_id in SIGNAL_RE.findall(params.get("text", "")):
+            game = self.by_id.get(int(event_id))
+            t = game.signal_time(int(quarter), self.config["min_3q"], self.config["max_diff_4q"]) if game else None
+            if t is not None:
+                self.stats["signals"].append({"quarter": int(quarter), "latency": received - game.wall_time(t)})
+        chat_id = int(params.get("chat_id", 0))
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.stats["tg_requests"], "date": int(received),
+            "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", ""),
+        }})
+
+    async def control(self, request):
+        from aiohttp import web
+        if request.method == "POST":
+            self.reset(await request.json())
+            return web.json_response({"ok": True})
+        stats, self.stats["signals"] = dict(self.stats), []
+        return web.json_response(stats)
+
+
+def serve_fakes(port_queue):
+    from aiohttp import web
+
+    fakes = FakeServers()
+    # telebot передаёт текст в query string: склеенные сообщения дают длинные URL
+    app = web.Application(handler_args={"max_line_size": 1 << 16, "max_field_size": 1 << 16})
+    app.router.add_get("/api/v1/sport/basketball/events/live", fakes.sofascore)
+    app.router.add_get("/api/v1/event/{event_id}/{kind}", fakes.sofascore)
+    app.router.add_get("/api/v1/event/{event_id}", fakes.sofascore)
+    app.router.add_route("*", "/bot{token}/{method}", fakes.telegram)
+    app.router.add_route("*", "/_control", fakes.control)
+
+    async def run():
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port_queue.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+# ------------ Замеры в процессе бота ------------
+class TickRecorder:
+    """Подменяет bot.TICK_SECONDS: сохраняет каждое значение, чтобы считать точные перцентили"""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.values: List[float] = []
+
+    def observe(self, value: float, **labels):
+        self.values.append(value)
+        self.histogram.observe(value, **labels)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bot_pids() -> List[int]:
+    """Процесс бота и (MONITOR_SHARDS > 1) его процессы-шарды"""
+    pids = [os.getpid()]
+    if bot.coordinator is not None:
+        pids += [proc.pid for proc, _ in bot.coordinator.workers.values() if proc.pid]
+    return pids
+
+
+def rss_mb() -> float:
+    total = 0.0
+    for pid in bot_pids():
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) / 1024
+        except OSError:
+            if pid == os.getpid():
+                total += resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return total
+
+
+def cpu_by_pid() -> Dict[int, float]:
+    """CPU-секунды (user + sys) по процессам бота"""
+    result = {}
+    for pid in bot_pids():
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            result[pid] = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except OSError:
+            if pid == os.getpid():
+                r = resource.getrusage(resource.RUSAGE_SELF)
+                result[pid] = r.ru_utime + r.ru_stime
+    return result
+
+
+def control(base: str, method: str = "GET", payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    import requests
+    resp = requests.request(method, f"{base}/_control", json=payload, timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def run_level(base: str, games: int, args) -> Dict[str, Any]:
+    control(base, "POST", {
+        "games": games, "seed": args.seed, "speed": args.speed,
+        "latency_ms": args.latency_ms, "error_rate": args.error_rate,
+        "tg_latency_ms": args.tg_latency_ms, "tg_error_rate": args.tg_error_rate,
+        "min_3q": bot.STRATEGY_3Q_MIN_POINTS, "max_diff_4q": bot.STRATEGY_4Q_MAX_DIFF,
+    })
+    # состояние прошлого прогона не нужно (id игр новые)
+    bot.sent_signals = bot.SentSignalStore()
+    bot.incident_states.clear()
+    bot.checked_periods.clear()
+
+    ticks = bot.TICK_SECONDS = TickRecorder(bot.TICK_SECONDS.histogram if isinstance(bot.TICK_SECONDS, TickRecorder) else bot.TICK_SECONDS)
+    bot.analyzing = True
+    future = bot.run_coro(bot.supervise_monitor())
+    time.sleep(args.warmup)
+
+    ticks.values.clear()
+    control(base)  # сбросить счётчики заглушек за разогрев
+    lags, rss = [], []
+    cpu0, t0 = cpu_by_pid(), time.monotonic()
+    deadline = t0 + args.duration
+    while time.monotonic() < deadline:
+        time.sleep(1)
+        if bot.coordinator is not None:
+            lags.append(bot.coordinator.summary()["lag_max"])
+        elif bot.scheduler is not None:
+            lags.append(bot.scheduler.metrics["lag_max"])
+        rss.append(rss_mb())
+    elapsed = time.monotonic() - t0
+    cpu = sum(value - cpu0.get(pid, 0.0) for pid, value in cpu_by_pid().items())
+    stats = control(base)
+
+    bot.analyzing = False
+    future.cancel()
+    try:
+        future.result(10)
+    except BaseException:
+        pass
+    # хвост очереди Telegram не должен попасть в задержку сигналов следующего прогона
+    limit = time.monotonic() + 30
+    while bot.outbox is not None and bot.outbox.depth() and time.monotonic() < limit:
+        time.sleep(0.2)
+
+    latencies = [s["latency"] for s in stats["signals"]]
+    return {
+        "games": games,
+        "ticks": len(ticks.values),
+        "tick_p50_ms": percentile(ticks.values, 0.5) * 1000,
+        "tick_p95_ms": percentile(ticks.values, 0.95) * 1000,
+        "tick_p99_ms": percentile(ticks.values, 0.99) * 1000,
+        "tick_overruns": sum(1 for v in ticks.values if v > bot.LIVE_LIST_INTERVAL),
+        "lag_max_s": max(lags) if lags else 0.0,
+        "sofascore_rps": sum(stats["requests"].values()) / elapsed,
+        "requests": stats["requests"],
+        "sofascore_errors": stats["errors"],
+        "telegram_requests": stats["tg_requests"],
+        "telegram_errors": stats["tg_errors"],
+        "cpu_percent": cpu / elapsed * 100,
+        "rss_mb": max(rss) if rss else rss_mb(),
+        "signals": len(latencies),
+        "signal_p50_s": percentile(latencies, 0.5),
+        "signal_p95_s": percentile(latencies, 0.95),
+    }
+
+
+def print_row(r: Dict[str, Any]):
+    print(
+        f"{r['games']:>6} | тик p50/p95/p99 {r['tick_p50_ms']:7.1f}/{r['tick_p95_ms']:7.1f}/{r['tick_p99_ms']:7.1f} мс"
+        f" (>{bot.LIVE_LIST_INTERVAL:g} с: {r['tick_overruns']}) | отставание {r['lag_max_s']:5.2f} с"
+        f" | {r['sofascore_rps']:7.1f} запр/с | CPU {r['cpu_percent']:5.1f}% | RSS {r['rss_mb']:6.1f} МБ"
+        f" | сигналов {r['signals']:4}, задержка p50/p95 {r['signal_p50_s']:5.2f}/{r['signal_p95_s']:5.2f} с"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест на заглушках SofaScore и Telegram")
+    parser.add_argument("--games", default="10,100,500,1000", help="числа игр через запятую")
+    parser.add_argument("--duration", type=float, default=30, help="замер на каждое число игр, сек")
+    parser.add_argument("--warmup", type=float, default=5, help="разогрев перед замером, сек")
+    parser.add_argument("--speed", type=float, default=30, help="игровых секунд за секунду")
+    parser.add_argument("--latency-ms", type=float, default=50, help="задержка ответа SofaScore")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов SofaScore 500")
+    parser.add_argument("--tg-latency-ms", type=float, default=50, help="задержка ответа Telegram")
+    parser.add_argument("--tg-error-rate", type=float, default=0.0, help="доля ответов Telegram 429")
+    parser.add_argument("--chats", type=int, default=3, help="подписанных чатов")
+    parser.add_argument("--shards", type=int, default=bot.MONITOR_SHARDS, help="MONITOR_SHARDS (> 1 — анализ в процессах)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args(argv)
+
+    ctx = multiprocessing.get_context("spawn")
+    port_queue = ctx.Queue()
+    fakes = ctx.Process(target=serve_fakes, args=(port_queue,), daemon=True)
+    fakes.start()
+    port = port_queue.get(timeout=30)
+    base = f"http://127.0.0.1:{port}"
+
+    import telebot.apihelper
+    telebot.apihelper.API_URL = base + "/bot{0}/{1}"
+    bot.SOFASCORE_API = os.environ["SOFASCORE_API"] = base + "/api/v1"  # env — для процессов-шардов
+    bot.MONITOR_SHARDS = args.shards
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.chdir(workdir)  # signals.db и лог проверок — во временной папке
+    bot.init_db()
+    bot.start_async_loop()
+    for chat_id in range(1, args.chats + 1):
+        bot.subscriptions.put(bot.Subscription(chat_id))
+
+    results = []
+    try:
+        for games in [int(g) for g in args.games.split(",") if g.strip()]:
+            result = run_level(base, games, args)
+            results.append(result)
+            if not args.json:
+                print_row(result)
+    finally:
+        bot.SHUTDOWN_FLUSH_TIMEOUT = 2
+        bot.shutdown("webhook")
+        fakes.terminate()
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# bot.py требует токен при импорте; Telegram в тестах не используется
+os.environ.setdefault("BOT_TOKEN", "0:test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Чистая signals.db во временной папке; DBWriter останавливается после теста"""
+    monkeypatch.setattr(bot, "DB_PATH", str(tmp_path / "signals.db"))
+    monkeypatch.setattr(bot, "_conn", None)
+    monkeypatch.setattr(bot, "db_writer", None)
+    bot.init_db()
+    yield bot
+    bot.db_writer.stop()
+    bot._conn.close()
+
+
+def flush():
+    bot.db_writer.flush(5)
@@ -0,0 +1,62 @@
+import gzip
+import json
+import random
+
+import backtest
+
+
+def write_game(root, event_id, rnd):
+    """Запись игры в формате RECORD_DIR: снимок события и summary каждые 20 игровых секунд"""
+    pace = rnd.uniform(0.05, 0.12)  # очков в секунду на команду
+    periods, score, lines, t0 = [], [0, 0], [], 1_800_000_000.0 + event_id * 900  # игры частично пересекаются
+    for played in range(0, 2400, 20):
+        period = played // 600 + 1
+        if len(periods) < period:
+            periods.append([0, 0])
+        for side in (0, 1):
+            pts = sum(rnd.random() < pace for _ in range(20)) // 2 * 2
+            score[side] += pts
+            periods[-1][side] += pts
+        home = {"current": score[0], **{f"period{i}": p[0] for i, p in enumerate(periods, 1)}}
+        away = {"current": score[1], **{f"period{i}": p[1] for i, p in enumerate(periods, 1)}}
+        event = {
+            "id": event_id, "tournament": {"name": "L"},
+            "homeTeam": {"id": 1, "name": f"T{event_id % 3}"}, "awayTeam": {"id": 2, "name": f"T{event_id % 3 + 3}"},
+            "status": {"period": period, "description": f"{period}Q"},
+            "time": {"played": played, "periodLength": 600}, "homeScore": home, "awayScore": away,
+        }
+        summary = {"summary": {"periods": [{"homeScore": h, "awayScore": a} for h, a in periods]}}
+        lines.append({"t": t0 + played, "kind": "event", "data": event})
+        lines.append({"t": t0 + played + 0.5, "kind": "summary", "data": summary})
+    path = root / f"{event_id}.jsonl.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write("\n".join(json.dumps(line) for line in lines) + "\n")
+
+
+def run(root, workers, capsys):
+    assert backtest.main([str(root), "--workers", str(workers), "--json", "--set", "LINE_MODE=pace"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    report.pop("wall_seconds")
+    return report
+
+
+def test_result_does_not_depend_on_workers(tmp_path, capsys):
+    rnd = random.Random(7)
+    for event_id in range(1, 25):
+        write_game(tmp_path, event_id, rnd)
+    one = run(tmp_path, 1, capsys)
+    assert one["strategies"]
+    assert run(tmp_path, 3, capsys) == one
+
+
+def test_baselines_use_only_earlier_games(tmp_path):
+    rnd = random.Random(3)
+    for event_id in (1, 2, 5):
+        write_game(tmp_path, event_id, rnd)
+    games = [backtest.game_quarters(event_id, paths) for event_id, paths in sorted(backtest.find_games(str(tmp_path)).items())]
+    assert [len(g["quarters"]) for g in games] == [3, 3, 3]  # 4-я четверть в записи не закончилась
+    snapshots = backtest.baselines_before(games, 50, 4.0)
+    assert snapshots[1] == {}
+    # игра 2 началась через 900 с после игры 1: у той к этому времени закончилась только 1-я четверть
+    assert snapshots[2][("league", "L")][1] == 1
+    assert snapshots[5][("league", "L")][1] == 6
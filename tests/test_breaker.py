@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import bot
+
+
+def open_breaker(name="test"):
+    b = bot.CircuitBreaker(name)
+    for _ in range(bot.BREAKER_FAILURES):
+        b.failure()
+    assert b.state == "open" and not b.allow()
+    b.open_until = time.monotonic() - 1  # пауза прошла
+    return b
+
+
+def test_half_open_allows_one_probe():
+    b = open_breaker()
+    assert b.allow() and b.state == "half-open"
+    assert not b.allow()
+    b.failure(probe=True)
+    assert b.state == "open" and not b.allow()
+    assert b.opens == 2
+
+
+def test_probe_success_closes():
+    b = open_breaker()
+    assert b.allow()
+    b.success()
+    assert b.state == "closed" and b.allow()
+
+
+def test_rate_limit_opens_at_once_for_retry_after():
+    b = bot.CircuitBreaker("test")
+    b.failure(retry_after=30, rate_limited=True)
+    assert b.state == "open" and b.retry_in() > 29
+
+
+class _HangingSession:
+    def get(self, url, headers=None):
+        return self
+
+    async def __aenter__(self):
+        await asyncio.sleep(3600)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_cancelled_probe_releases_breaker(monkeypatch):
+    b = open_breaker("cancel-test")
+    monkeypatch.setitem(bot.breakers, "cancel-test", b)
+
+    async def session():
+        return _HangingSession()
+
+    monkeypatch.setattr(bot, "get_aio_session", session)
+
+    async def run():
+        task = asyncio.ensure_future(bot.fetch_json("http://sofascore.invalid/x", "cancel-test", ttl=0))
+        await asyncio.sleep(0.05)
+        assert b.state == "half-open" and not b.allow()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert b.allow()  # новый пробный запрос разрешён
+
+
+class _FailingSession:
+    """Все запросы отвечают 500 — после паузы, чтобы успели уйти одновременно"""
+
+    status = 500
+    headers = {}
+
+    def get(self, url, headers=None):
+        return self
+
+    async def __aenter__(self):
+        await asyncio.sleep(0.05)
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_concurrent_failures_open_once(monkeypatch):
+    b = bot.CircuitBreaker("burst-test")
+    monkeypatch.setitem(bot.breakers, "burst-test", b)
+
+    async def session():
+        return _FailingSession()
+
+    monkeypatch.setattr(bot, "get_aio_session", session)
+
+    async def run():
+        return await asyncio.gather(
+            *[bot.fetch_json(f"http://sofascore.invalid/{i}", "burst-test", ttl=0) for i in range(8)],
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, bot.SofaScoreError) for r in results)
+    assert b.state == "open" and b.opens == 1
+    assert b.retry_in() <= bot.BACKOFF_BASE
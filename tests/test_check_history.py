@@ -0,0 +1,56 @@
+from conftest import flush
+
+
+def test_status_filter_ignores_case(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "MATCH_LOG_PATH", str(tmp_path / "matches.log"))
+    history = db.CheckHistory()
+    history.add("A – B", "signal 3Q", 1, "A", "B", "NBA")
+    history.add("C – D", "passed 4Q", 2, "C", "D", "NBA")
+    history.add("E – F", "checked 3Q", 3, "E", "F", "NBA")
+    flush()
+    assert sorted(e["event_id"] for e in history.query(status="3q")) == [1, 3]
+    assert [e["event_id"] for e in history.query(status="signal 3q")] == [1]
+    assert [e["event_id"] for e in history.query(status="PASSED")] == [2]
+    assert history.query(status="%") == []
+
+
+def test_team_matches_any_word_of_name(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "MATCH_LOG_PATH", str(tmp_path / "matches.log"))
+    history = db.CheckHistory()
+    history.add("Los Angeles Lakers – Boston Celtics", "checked 1Q", 1, "Los Angeles Lakers", "Boston Celtics", "NBA")
+    history.add("Lakeland – Denver", "checked 1Q", 2, "Lakeland", "Denver", "NBA")
+    flush()
+    assert [e["event_id"] for e in history.query(team="Lakers")] == [1]
+    assert sorted(e["event_id"] for e in history.query(team="lake")) == [1, 2]
+    assert [e["event_id"] for e in history.query(team="los ang")] == [1]
+    assert [e["event_id"] for e in history.query(team="celtics", status="checked 1q")] == [1]
+    assert history.query(team="angeles boston den") == []
+
+
+def test_word_filters_use_index(db):
+    conn = db.read_db()
+    try:
+        plan = " ".join(
+            row[-1] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT check_id FROM check_terms WHERE kind = ? AND term >= ? AND term < ?",
+                ("status", "3q", "3q￿"),
+            )
+        )
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='checks'")}
+    finally:
+        conn.close()
+    assert "SEARCH check_terms" in plan
+    assert "idx_checks_status" not in indexes
+
+
+def test_terms_are_backfilled_for_old_history(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "MATCH_LOG_PATH", str(tmp_path / "matches.log"))
+    db.CheckHistory().add("A – B", "signal 3Q", 7, "Golden State", "B", "NBA")
+    flush()
+    db.db_writer.stop()
+    db._conn.execute("DROP TABLE check_terms")
+    db._conn.commit()
+    db._conn.close()
+    monkeypatch.setattr(db, "_conn", None)
+    monkeypatch.setattr(db, "db_writer", None)
+    assert [e["event_id"] for e in db.CheckHistory().query(team="state", status="3q")] == [7]
@@ -0,0 +1,43 @@
+import bot
+
+EVENT = {
+    "id": 9, "status": {"period": 3, "type": "inprogress", "description": "3rd quarter"},
+    "time": {"played": 1500}, "homeScore": {"current": 60, "period1": 25}, "awayScore": {"current": 55, "period1": 22},
+}
+
+
+def changed(**fields):
+    return {**EVENT, **fields}
+
+
+def test_fingerprint_ignores_clock_only():
+    fp = bot.event_fingerprint(EVENT)
+    assert fp is not None
+    assert bot.event_fingerprint(changed(time={"played": 1540})) == fp
+    assert bot.event_fingerprint(changed(status={**EVENT["status"], "description": "3Q 2:10"})) == fp
+    # порядок ключей счёта не важен
+    assert bot.event_fingerprint(changed(homeScore={"period1": 25, "current": 60})) == fp
+
+
+def test_fingerprint_tracks_score_and_period():
+    fp = bot.event_fingerprint(EVENT)
+    assert bot.event_fingerprint(changed(homeScore={"current": 62, "period1": 25})) != fp
+    assert bot.event_fingerprint(changed(awayScore={"current": 55, "period1": 22, "period2": 33})) != fp
+    assert bot.event_fingerprint(changed(status={**EVENT["status"], "period": 4})) != fp
+
+
+def test_unhashable_event_has_no_fingerprint():
+    assert bot.event_fingerprint(changed(homeScore={"current": [60]})) is None
+
+
+def test_unchanged_game_is_skipped_unless_result_pending():
+    s = bot.GameScheduler()
+    assert not s._is_unchanged(9, EVENT)
+    s._analyzed[9] = (bot.event_fingerprint(EVENT), 0.0)
+    assert s._is_unchanged(9, changed(time={"played": 1540}))
+    assert not s._is_unchanged(9, changed(homeScore={"current": 62, "period1": 25}))
+    bot.sent_signals.add(bot.SignalRecord(9, 2, "2Q", "", "A", "B", 40.5))
+    try:
+        assert not s._is_unchanged(9, EVENT)
+    finally:
+        bot.sent_signals.discard(9)
@@ -0,0 +1,100 @@
+import pytest
+
+from conftest import flush
+from test_signals_db import rows
+
+EVENT = {"id": 5, "tournament": {"name": "NBA"}, "homeTeam": {"name": "A"}, "awayTeam": {"name": "B"}}
+ROW = ("3Q", "NBA", "A", "B", 37.5, None, "2026-01-01T00:00:00")
+
+
+@pytest.fixture
+def signal(db, monkeypatch):
+    """PENDING-сигнал 3Q в БД и в памяти; /checked в тестах не пишем"""
+    monkeypatch.setattr(db, "log_match", lambda *a, **k: None)
+    monkeypatch.setattr(db.SETTLED_TOTAL, "_values", {})
+    db.sent_signals.add(db.SignalRecord(5, 3, "3Q", "NBA", "A", "B", 37.5))
+    db.save_signal_log(5, "NBA", "A", "B", "3Q", 37.5, "оптимальный", "PENDING", 20)
+    flush()
+    yield db
+    db.sent_signals.discard(5)
+
+
+def settled(db):
+    return {dict(key)["status"]: value for key, value in db.SETTLED_TOTAL._values.items()}
+
+
+def test_double_settlement_counts_once(signal):
+    signal.settle_signal(EVENT, 5, ROW, 44)
+    signal.settle_signal(EVENT, 5, ROW, 44)
+    flush()
+    assert rows(signal) == ([(5, "3Q", "PASSED", 44)], [("3Q", 1, 1, 0)])
+    assert settled(signal) == {"PASSED": 1}
+
+
+def test_settlement_after_live_result(signal):
+    signal.deliver_result(EVENT, 3, 44)  # запись ещё в очереди DBWriter
+    signal.settle_signal(EVENT, 5, ROW, 30)
+    flush()
+    assert rows(signal) == ([(5, "3Q", "PASSED", 44)], [("3Q", 1, 1, 0)])
+    assert settled(signal) == {}
+
+
+def test_settlement_without_memory_record(signal):
+    signal.sent_signals.discard(5)
+    signal.settle_signal(EVENT, 5, ROW, 30)
+    signal.settle_signal(EVENT, 5, ROW, 30)
+    flush()
+    assert rows(signal) == ([(5, "3Q", "FAILED", 30)], [("3Q", 1, 0, 1)])
+    assert settled(signal) == {"FAILED": 1}
+
+
+@pytest.fixture
+def pending(db, monkeypatch):
+    """PENDING-сигналы игр 1..5 (в порядке ts); свежие сигналы тоже берём в сверку"""
+    monkeypatch.setattr(db, "SETTLE_MIN_AGE", -60)
+    monkeypatch.setattr(db, "settle_checked", {})
+    monkeypatch.setitem(db.live_snapshot, "events", None)
+    for event_id in range(1, 6):
+        db.save_signal_log(event_id, "NBA", "A", "B", "3Q", 37.5, "оптимальный", "PENDING", 20)
+    flush()
+    return db
+
+
+def test_live_games_are_left_to_monitor(pending, monkeypatch):
+    monkeypatch.setitem(pending.live_snapshot, "events", [{"id": 1}, {"id": 3}])
+    monkeypatch.setitem(pending.live_snapshot, "at", pending.time.monotonic())
+    assert sorted(pending.pending_settlements()) == [2, 4, 5]
+
+
+def test_stale_live_list_does_not_block_settlement(pending, monkeypatch):
+    monkeypatch.setitem(pending.live_snapshot, "events", [{"id": 1}, {"id": 3}])
+    monkeypatch.setitem(pending.live_snapshot, "at", pending.time.monotonic() - 86400)
+    assert sorted(pending.pending_settlements()) == [1, 2, 3, 4, 5]
+
+
+def test_recently_checked_games_do_not_block_batch(pending):
+    assert sorted(pending.pending_settlements(limit=2)) == [1, 2]
+    now = pending.time.monotonic()
+    pending.settle_checked.update({1: now, 2: now, 99: now})  # 1 и 2 ещё не доиграны
+    assert sorted(pending.pending_settlements(limit=2)) == [3, 4]
+    assert 99 not in pending.settle_checked  # игры без PENDING забываются
+    pending.settle_checked.update({1: now - pending.SETTLE_RECHECK - 1})
+    assert sorted(pending.pending_settlements(limit=2)) == [1, 3]
+
+
+def test_finished_game_summary_uses_long_ttl(signal, monkeypatch):
+    signal.sent_signals.discard(5)
+    calls = []
+
+    async def fetch_json(url, endpoint, ttl=None):
+        calls.append((endpoint, ttl))
+        if endpoint == "event":  # в событии нет очков по четвертям
+            return {"event": {**EVENT, "status": {"type": "finished"}}}
+        return {"periods": [{"homeScore": 25, "awayScore": 22}] * 2 + [{"homeScore": 20, "awayScore": 21}]}
+
+    monkeypatch.setattr(signal, "fetch_json", fetch_json)
+    monkeypatch.setattr(signal, "pace_baselines", signal.PaceBaselines())
+    signal.asyncio.run(signal.settle_event(5, [ROW], signal.asyncio.Semaphore(1)))
+    flush()
+    assert calls == [("event", signal.SETTLE_RECHECK), ("match-summary", signal.CACHE_TTL["finished"])]
+    assert rows(signal) == ([(5, "3Q", "PASSED", 41)], [("3Q", 1, 1, 0)])
@@ -0,0 +1,88 @@
+import queue
+
+import pytest
+
+import bot
+
+
+def test_hash_ring_moves_only_removed_share():
+    ring = bot.HashRing(range(4))
+    before = {key: ring.node(key) for key in range(2000)}
+    assert set(before.values()) == {0, 1, 2, 3}
+    ring.remove(2)
+    after = {key: ring.node(key) for key in range(2000)}
+    assert 2 not in after.values()
+    assert all(after[k] == v for k, v in before.items() if v != 2)
+    ring.add(2)
+    assert {key: ring.node(key) for key in range(2000)} == before
+
+
+class FakeProc:
+    def __init__(self, pid):
+        self.pid = pid
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.exitcode is None
+
+
+@pytest.fixture
+def coord(monkeypatch):
+    """Координатор на двух шардах без настоящих процессов; часы — ручные"""
+    clock = [1000.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: clock[0])
+    c = bot.ShardCoordinator(2)
+    pids = iter(range(100, 200))
+
+    def spawn(shard):
+        c.workers[shard] = (FakeProc(next(pids)), queue.Queue())
+        c._started[shard] = clock[0]
+
+    monkeypatch.setattr(c, "_spawn", spawn)
+    for shard in range(2):
+        spawn(shard)
+        c.ring.add(shard)
+    c.clock = clock
+    return c
+
+
+def kill(c, shard):
+    c.workers[shard][0].exitcode = 1
+
+
+def report(c, shard, pid=None):
+    c._apply(("metrics", shard, pid or c.workers[shard][0].pid, {}))
+
+
+def test_dead_shard_leaves_ring_until_new_process_reports(coord):
+    events = [{"id": i} for i in range(200)]
+    coord.dispatch(events)
+    old_pid = coord.workers[1][0].pid
+    kill(coord, 1)
+    coord.check_workers()
+    assert 1 not in coord.ring
+    assert coord.workers[1][0].pid == old_pid  # перезапуск — после backoff
+    coord.dispatch(events)
+    assert set(coord.owner.values()) == {0}
+
+    coord.clock[0] += bot.BACKOFF_BASE
+    coord.check_workers()
+    assert coord.workers[1][0].pid != old_pid
+    report(coord, 1, old_pid)  # запоздалые метрики умершего процесса
+    assert 1 not in coord.ring
+    report(coord, 1)
+    assert 1 in coord.ring
+    coord.dispatch(events)
+    assert set(coord.owner.values()) == {0, 1}
+
+
+def test_crash_loop_backs_off(coord):
+    delays = []
+    for _ in range(4):
+        kill(coord, 0)
+        coord.check_workers()
+        delays.append(coord._retry_at[0] - coord.clock[0])
+        coord.clock[0] = coord._retry_at[0]
+        coord.check_workers()
+    assert delays == [bot.BACKOFF_BASE * 2 ** i for i in range(4)]
+    assert 0 not in coord.ring
@@ -0,0 +1,45 @@
+from conftest import flush
+
+
+def rows(db):
+    conn = db.read_db()
+    try:
+        signals = conn.execute("SELECT event_id, quarter, status, points_in_quarter FROM signals ORDER BY id").fetchall()
+        rollup = conn.execute(
+            "SELECT strategy, SUM(signals), SUM(passed), SUM(failed) FROM signal_rollup GROUP BY strategy"
+        ).fetchall()
+    finally:
+        conn.close()
+    return signals, rollup
+
+
+def test_result_updates_pending_row(db):
+    db.save_signal_log(1, "NBA", "A", "B", "3Q", 37.5, "оптимальный", "PENDING", 14)
+    db.save_signal_log(1, "NBA", "A", "B", "3Q", 37.5, "оптимальный", "PASSED", 40)
+    flush()
+    assert rows(db) == ([(1, "3Q", "PASSED", 40)], [("3Q", 1, 1, 0)])
+
+
+def test_result_without_pending_is_skipped(db):
+    db.save_signal_log(2, "NBA", "A", "B", "4Q", 39.5, "оптимальный", "FAILED", 30)
+    flush()
+    assert rows(db) == ([], [])
+
+
+def test_repeated_writes_do_not_double_count(db):
+    for status, points in (("PENDING", 0), ("PENDING", 0), ("FAILED", 30), ("PASSED", 45)):
+        db.save_signal_log(3, "NBA", "A", "B", "4Q", 39.5, "оптимальный", status, points)
+    flush()
+    assert rows(db) == ([(3, "4Q", "FAILED", 30)], [("4Q", 1, 0, 1)])
+
+
+def test_pace_load_uses_stored_period_length(db):
+    db.save_signal_log(4, "NBA", "A", "B", "3Q", 50.5, "оптимальный", "PENDING", 20, period_seconds=720)
+    db.save_signal_log(4, "NBA", "A", "B", "3Q", 50.5, "оптимальный", "PASSED", 60)
+    db.save_signal_log(5, "LKL", "C", "D", "3Q", 37.5, "оптимальный", "PENDING", 20)  # старая строка — без длины
+    db.save_signal_log(5, "LKL", "C", "D", "3Q", 37.5, "оптимальный", "FAILED", 30)
+    flush()
+    pace = db.PaceBaselines()
+    assert pace.load() == 2
+    assert pace.stats[("league", "NBA")][0] == 5.0  # 60 очков за 12 минут
+    assert pace.stats[("league", "LKL")][0] == 30 / (db.PACE_PERIOD_SECONDS / 60)
@@ -0,0 +1,66 @@
+import sqlite3
+
+from conftest import flush
+
+
+def settle(db, event_id, quarter, status, points=None):
+    db.save_signal_log(event_id, "NBA", "A", "B", quarter, 37.5, "оптимальный", "PENDING", 0)
+    if status != "PENDING":
+        db.save_signal_log(event_id, "NBA", "A", "B", quarter, 37.5, "оптимальный", status, points)
+
+
+def test_void_is_counted_separately(db):
+    for event_id, status in enumerate(("PASSED", "PASSED", "FAILED", "VOID", "VOID", "PENDING")):
+        settle(db, event_id, "3Q", status, 40)
+    flush()
+    stats = db.query_stats(days=1)
+    assert stats["strategies"] == [("3Q", 6, 2, 1, 2)]
+    assert stats["leagues"] == [("NBA", 6, 2, 1, 2)]
+    text = db.format_stats(stats, "", "", 1)
+    assert "прошло 2, не прошло 1, аннулировано 2, без итога 1, hit rate 66.7%" in text
+
+
+def test_only_void_has_no_results(db):
+    settle(db, 1, "4Q", "VOID")
+    flush()
+    assert db.format_stats(db.query_stats(days=1), "", "", 1).endswith(
+        "[4Q] сигналов 1, аннулировано 1, итогов пока нет\nЛиги:\n— NBA: сигналов 1, аннулировано 1, итогов пока нет\n"
+        f"ROI — при коэффициенте {db.STATS_ODDS}"
+    )
+
+
+def test_old_rollup_is_rebuilt(db, monkeypatch):
+    settle(db, 1, "3Q", "VOID")
+    settle(db, 2, "3Q", "PASSED", 40)
+    flush()
+    db.db_writer.stop()
+    db._conn.close()
+    conn = sqlite3.connect(db.DB_PATH)
+    for table, period, _ in db.ROLLUP_TABLES:  # сводка до колонки void
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"CREATE TABLE {table} ({period} TEXT, league TEXT, strategy TEXT, signals INTEGER, passed INTEGER, failed INTEGER)")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db, "_conn", None)
+    monkeypatch.setattr(db, "db_writer", None)
+    assert db.query_stats(days=None)["strategies"] == [("3Q", 2, 1, 0, 1)]
+
+
+def test_rollup_version_moves_after_commit(db):
+    seen = []
+
+    def write(cur):
+        db._write_signal(cur, "2026-10-17T00:00:00", 9, "NBA", "A", "B", "3Q", 37.5, "оптимальный", "PENDING", 0)
+        seen.append(db.rollup_version)  # внутри транзакции — ещё старая версия
+
+    def broken(cur):
+        db._write_signal(cur, "2026-10-17T00:00:00", 10, "NBA", "A", "B", "3Q", 37.5, "оптимальный", "PENDING", 0)
+        raise RuntimeError("откат")
+
+    before = db.rollup_version
+    db.db_writer.submit(write)
+    db.db_writer.submit(broken)
+    flush()
+    assert seen and set(seen) == {before}  # пачка с битой операцией повторяется по одной
+    assert db.rollup_version == before + 1  # откаченная запись версию не меняет
+    assert db.query_stats(days=None)["strategies"] == [("3Q", 1, 0, 0, 0)]
@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+
+import bot
+
+
+def event(period, home, away, played=None):
+    """Live-событие: home/away — очки по четвертям; без played — часов в событии нет"""
+    ev = {
+        "id": 77, "tournament": {"name": "NBA"}, "homeTeam": {"name": "A"}, "awayTeam": {"name": "B"},
+        "status": {"period": period},
+        "homeScore": {"current": sum(home), **{f"period{i}": p for i, p in enumerate(home, 1)}},
+        "awayScore": {"current": sum(away), **{f"period{i}": p for i, p in enumerate(away, 1)}},
+    }
+    if played is not None:
+        ev["time"] = {"played": played, "periodLength": 600}
+    return ev
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    yield
+    bot.sent_signals.discard(77)
+    bot.incident_states.pop(77, None)
+    bot.checked_periods.pop(77, None)
+
+
+def test_early_quarter_needs_nothing():
+    assert bot.plan_fetch(bot.Features(event(1, [10], [8], 300))) == set()
+
+
+def test_quiet_third_quarter_needs_nothing():
+    assert bot.plan_fetch(bot.Features(event(3, [25, 24, 4], [22, 20, 3], 1500))) == set()
+
+
+def test_firing_rule_needs_its_fields():
+    f = bot.Features(event(3, [25, 24, 8], [22, 20, 6], 1500))
+    assert bot.plan_fetch(f) == {"incidents"}
+    assert bot.plan_fetch(f.with_summary({"incidents": []})) == set()
+
+
+def test_unknown_input_needs_summary():
+    ev = event(3, [25, 24, 8], [22, 20, 6], 1500)
+    for side in ("homeScore", "awayScore"):
+        ev[side] = {"current": ev[side]["current"]}  # очков по четвертям в событии нет
+    assert bot.plan_fetch(bot.Features(ev)) == {"summary"}
+
+
+def test_sent_signal_waits_only_for_result():
+    bot.sent_signals.add(bot.SignalRecord(77, 3, "3Q", "NBA", "A", "B", 37.5))
+    assert bot.plan_fetch(bot.Features(event(3, [25, 24, 8], [22, 20, 6], 1500))) == set()
+    # итог 3Q в 4Q: очки четверти в событии — summary не нужен, иначе — нужен
+    assert bot.plan_fetch(bot.Features(event(4, [25, 24, 20, 2], [22, 20, 10, 0], 1820))) == set()
+    ev = event(4, [25, 24, 20, 2], [22, 20, 10, 0], 1820)
+    for side in ("homeScore", "awayScore"):
+        del ev[side]["period3"], ev[side]["period4"]
+    assert bot.plan_fetch(bot.Features(ev)) == {"summary"}
+
+
+def test_finished_game_details_are_cached_long(monkeypatch):
+    seen = []
+
+    async def summary(event_id, finished=False, parts=()):
+        seen.append((set(parts), finished))
+        return {}
+
+    monkeypatch.setattr(bot, "get_event_summary", summary)
+    monkeypatch.setattr(bot, "log_match", lambda *a, **k: None)
+    monkeypatch.setattr(bot, "deliver_signal", lambda *a, **k: None)
+    bot.sent_signals.add(bot.SignalRecord(77, 3, "3Q", "NBA", "A", "B", 37.5))
+    ev = event(4, [25, 24], [22, 20])
+    ev["status"]["type"] = "finished"
+    asyncio.run(bot._analyze_event(ev, 77))
+    assert seen and all(finished for _, finished in seen)
+    assert "summary" in seen[0][0]
+
+
+@pytest.fixture
+def extra_rule():
+    """Временное правило; после теста реестр возвращается к исходному"""
+    added = []
+
+    def register(rule):
+        added.append(rule.name)
+        return bot.register_strategy(rule)
+
+    yield register
+    for name in added:
+        bot.STRATEGIES.pop(name, None)
+    bot.compile_strategies()
+
+
+def rule(name, periods):
+    return bot.Strategy(
+        name, periods=periods, inputs=("total",), trigger=lambda f: True, line=lambda f: 10.5,
+        reason=lambda f: "test", fields=(), template="{home} – {away}",
+    )
+
+
+def test_polling_follows_registered_periods(extra_rule):
+    assert bot.poll_interval_for(event(1, [10], [8], 300)) == bot.POLL_SLOW
+    assert bot.poll_interval_for(event(3, [25, 24, 8], [22, 20, 6], 1300)) == bot.POLL_NORMAL
+    assert bot.poll_interval_for(event(5, [25, 24, 20, 20, 2], [22, 20, 21, 26, 0])) is None
+    extra_rule(rule("OT", (5,)))
+    assert bot.poll_interval_for(event(4, [25, 24, 20, 20], [22, 20, 21, 26], 1900)) == bot.POLL_NORMAL
+    assert bot.poll_interval_for(event(5, [25, 24, 20, 20, 2], [22, 20, 21, 26, 0])) == bot.POLL_NORMAL
+    extra_rule(rule("1Q", (1,)))
+    assert bot.poll_interval_for(event(1, [4], [2], 100)) == bot.POLL_NORMAL
+
+
+def test_signal_keeps_rule_name(db, extra_rule, monkeypatch):
+    sent = []
+    monkeypatch.setattr(bot, "enqueue_message", lambda chat_id, text, *a: sent.append(chat_id))
+    monkeypatch.setattr(bot, "log_match", lambda *a, **k: None)
+    monkeypatch.setattr(bot.SIGNALS_TOTAL, "_values", {})
+    monkeypatch.setattr(bot.RESULTS_TOTAL, "_values", {})
+    monkeypatch.setattr(bot, "subscriptions", bot.SubscriptionRegistry())
+    bot.subscriptions.put(bot.Subscription(1, strategies=["ot"]))
+    bot.subscriptions.put(bot.Subscription(2, strategies=["4Q"]))
+    extra_rule(rule("OT", (5,)))
+    ev = event(5, [25, 24, 20, 20, 2], [22, 20, 21, 26, 0], 2420)
+    try:
+        for _, sig in bot.evaluate_strategies(bot.Features(ev)):
+            bot.deliver_signal(ev, 5, sig)
+        bot.deliver_result(ev, 5, 12)
+        bot.db_writer.flush(5)
+    finally:
+        bot.sent_signals.discard(77)
+    assert sent == [1, 1]
+    assert bot.SIGNALS_TOTAL._values == {(("strategy", "OT"),): 1}
+    assert bot.RESULTS_TOTAL._values == {(("status", "PASSED"), ("strategy", "OT")): 1}
+    conn = bot.read_db()
+    try:
+        assert conn.execute("SELECT quarter, strategy, status FROM signals").fetchall() == [("5Q", "OT", "PASSED")]
+        assert conn.execute("SELECT strategy, signals, passed FROM signal_rollup").fetchall() == [("OT", 1, 1)]
+    finally:
+        conn.close()
+    assert bot.query_stats("ot", days=1)["strategies"] == [("OT", 1, 1, 0, 0)]
+
+
+def test_result_goes_to_signal_recipients(db, extra_rule, monkeypatch):
+    sent = []
+    monkeypatch.setattr(bot, "enqueue_message", lambda chat_id, text, *a: sent.append(chat_id))
+    monkeypatch.setattr(bot, "log_match", lambda *a, **k: None)
+    monkeypatch.setattr(bot, "subscriptions", bot.SubscriptionRegistry())
+    bot.subscriptions.put(bot.Subscription(1, strategies=["OT"]))
+    extra_rule(rule("OT", (5,)))
+    ev = event(5, [25, 24, 20, 20, 2], [22, 20, 21, 26, 0], 2420)
+    try:
+        for _, sig in bot.evaluate_strategies(bot.Features(ev)):
+            bot.deliver_signal(ev, 5, sig)
+        bot.db_writer.flush(5)
+        # после сигнала: чат 1 сменил фильтр, чат 2 подписался — итог всё равно только чату 1
+        bot.subscriptions.put(bot.Subscription(1, strategies=["4Q"]))
+        bot.subscriptions.put(bot.Subscription(2, strategies=["OT"]))
+        bot.sent_signals.discard(77)
+        bot.sent_signals.restore()
+        assert bot.sent_signals.get(77, 5).recipients == (1,)
+        bot.deliver_result(ev, 5, 12)
+        bot.db_writer.flush(5)
+    finally:
+        bot.sent_signals.discard(77)
+    assert sent == [1, 1]
@@ -0,0 +1,247 @@
+# tune.py
+"""
+Подбор порогов и линий стратегий по записанным играм (RECORD_DIR) — векторно на NumPy.
+
+Снимки игр загружаются в колоночные массивы (четверть, время, очки по четвертям,
+разница, фолы). Для каждой игры и каждого ограничения по фолам считается одно число —
+лучшее значение признака среди подходящих снимков (max очков в 3Q / min разницы в 4Q).
+Тогда "сигнал сработал" для всей сетки порогов — это одно сравнение-маска, а число
+попаданий для всех пар (порог, линия) — одно матричное произведение масок.
+
+Требуется numpy (pip install numpy).
+
+Примеры:
+    python tune.py records/ --cache snapshots.npz
+    python tune.py snapshots.npz --strategy 4Q --thresholds 0:15:1 --lines 34:46:0.5 --fouls 10:40:2
+"""
+import argparse
+import sys
+import time
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+import backtest
+import bot
+
+# колонки снимков
+COLUMNS = ("game", "period", "seconds_left", "q1", "q2", "q3", "q4", "diff", "fouls")
+
+
+# ------------ Загрузка снимков в колоночные массивы ------------
+def _quarter_points(event: Dict[str, Any], summary: Dict[str, Any], period: int) -> List[int]:
+    """Очки (сумма команд) по четвертям 1..4 на момент снимка; -1 — неизвестно"""
+    periods = bot.parse_period_scores(summary.get("summary")) if summary else []
+    points = [-1, -1, -1, -1]
+    for i in range(min(4, len(periods))):
+        points[i] = periods[i][0] + periods[i][1]
+    for i in range(4):
+        if points[i] < 0:
+            h = bot.safe_get(event, "homeScore", f"period{i + 1}")
+            a = bot.safe_get(event, "awayScore", f"period{i + 1}")
+            if h is not None and a is not None:
+                points[i] = int(h) + int(a)
+    # текущая четверть без периодных очков — как признак quarter_points в bot.py: общий счёт минус прошлые четверти
+    if 1 <= period <= 4 and points[period - 1] < 0 and all(p >= 0 for p in points[: period - 1]):
+        try:
+            total = int(bot.safe_get(event, "homeScore", "current", default=0)) + int(
+                bot.safe_get(event, "awayScore", "current", default=0)
+            )
+            points[period - 1] = total - sum(points[: period - 1])
+        except (TypeError, ValueError):
+            pass
+    return points
+
+
+def game_rows(records: List[Dict[str, Any]]) -> List[tuple]:
+    rows = []
+    event = None
+    summary: Dict[str, Any] = {}
+    state: Optional[bot.IncidentState] = None
+    for rec in records:
+        if rec["kind"] == "summary":
+            summary = {**summary, **rec["data"]}
+        else:
+            event = rec["data"]
+        if event is None:
+            continue
+        period, _ = bot.get_current_period_and_clock(event)
+        left = bot.get_period_seconds_left(event)
+        q = _quarter_points(event, summary, period)
+        try:
+            diff = abs(int(bot.safe_get(event, "homeScore", "current", default=0)) - int(
+                bot.safe_get(event, "awayScore", "current", default=0)
+            ))
+        except (TypeError, ValueError):
+            continue
+        fouls = -1
+        inc = summary.get("incidents") if summary else None
+        if inc is not None:
+            items = inc.get("incidents", []) if isinstance(inc, dict) else (inc or [])
+            if state is None:
+                state = bot.IncidentState(bot.safe_get(event, "homeTeam", "id"))
+            fouls = sum(state.update(items).fouls_total())
+        rows.append((period, -1 if left is None else left, q[0], q[1], q[2], q[3], diff, fouls))
+    return rows
+
+
+def load_snapshots(root: str) -> Dict[str, np.ndarray]:
+    """Все игры из RECORD_DIR -> словарь колонок (строка = снимок, отсортировано по game)"""
+    cols: Dict[str, List[int]] = {c: [] for c in COLUMNS}
+    for game_idx, (event_id, paths) in enumerate(sorted(backtest.find_games(root).items())):
+        for row in game_rows(backtest.load_game(paths)):
+            cols["game"].append(game_idx)
+            for name, value in zip(COLUMNS[1:], row):
+                cols[name].append(value)
+    return {name: np.asarray(values, dtype=np.int32) for name, values in cols.items()}
+
+
+def load(path: str, cache: Optional[str] = None) -> Dict[str, np.ndarray]:
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return {name: data[name] for name in COLUMNS}
+    snaps = load_snapshots(path)
+    if cache:
+        np.savez_compressed(cache, **snaps)
+    return snaps
+
+
+# ------------ Векторная оценка сетки ------------
+def final_quarter_points(snaps: Dict[str, np.ndarray], n_games: int, quarter: int) -> np.ndarray:
+    """Очки в четверти по последнему снимку игры, где четверть уже завершилась (-1 — нет данных)"""
+    col = snaps[f"q{quarter}"]
+    done = snaps["period"] > quarter if quarter < 4 else snaps["period"] >= 4
+    final = np.full(n_games, -1, dtype=np.int32)
+    idx = np.nonzero(done & (col >= 0))[0]
+    final[snaps["game"][idx]] = col[idx]  # снимки отсортированы по времени — останется последний
+    return final
+
+
+def best_feature(snaps: Dict[str, np.ndarray], n_games: int, quarter: int, fouls: np.ndarray) -> np.ndarray:
+    """
+    [игра, лимит фолов] -> лучшее значение признака среди снимков этой четверти с фолами <= лимита:
+    max очков в 3Q или min разницы в 4Q. Стратегия срабатывает, если это значение проходит порог.
+    """
+    in_q = snaps["period"] == quarter
+    if quarter == 3:
+        feature, empty, reduce = snaps["q3"], -1, np.maximum
+    else:
+        feature, empty, reduce = snaps["diff"], np.iinfo(np.int32).max, np.minimum
+    sel = np.nonzero(in_q & (feature >= 0))[0]
+    out = np.full((n_games, len(fouls)), empty, dtype=np.int32)
+    if not len(sel):
+        return out
+    games = snaps["game"][sel]
+    ok = snaps["fouls"][sel, None] <= fouls[None, :]
+    values = np.where(ok, feature[sel, None], empty)
+    starts = np.r_[0, np.nonzero(np.diff(games))[0] + 1]
+    out[games[starts]] = reduce.reduceat(values, starts, axis=0)
+    return out
+
+
+def evaluate_grid(snaps, quarter: int, thresholds: np.ndarray, lines: np.ndarray, fouls: np.ndarray):
+    """
+    Возвращает (signals[T, F], hits[T, F, L]) для всех комбинаций
+    порога T, лимита фолов F и линии L.
+    """
+    n_games = int(snaps["game"].max()) + 1 if len(snaps["game"]) else 0
+    best = best_feature(snaps, n_games, quarter, fouls)  # [G, F]
+    final = final_quarter_points(snaps, n_games, quarter)  # [G]
+    settled = final >= 0
+    best, final = best[settled], final[settled]
+    if quarter == 3:
+        fired = best[:, None, :] >= thresholds[None, :, None]  # [G, T, F]
+    else:
+        fired = best[:, None, :] <= thresholds[None, :, None]
+    passed = (final[:, None] > lines[None, :]).astype(np.float32)  # [G, L] — ставим ТБ
+    fired_flat = fired.reshape(len(final), -1).astype(np.float32)  # [G, T*F]
+    signals = fired_flat.sum(axis=0).reshape(len(thresholds), len(fouls))
+    hits = (fired_flat.T @ passed).reshape(len(thresholds), len(fouls), len(lines))
+    return signals, hits
+
+
+def rank(signals, hits, thresholds, lines, fouls, min_signals: int, top: int, odds: float):
+    n = np.broadcast_to(signals[:, :, None], hits.shape)
+    rate = np.divide(hits, n, out=np.zeros_like(hits), where=n > 0)
+    rate = np.where(n >= min_signals, rate, -1.0)
+    order = np.lexsort((-n.ravel(), -rate.ravel()))[:top]
+    result = []
+    for flat in order:
+        t, f, l = np.unravel_index(flat, hits.shape)
+        if rate[t, f, l] < 0:
+            break
+        cnt, hit = int(n[t, f, l]), int(hits[t, f, l])
+        result.append({
+            "threshold": float(thresholds[t]),
+            "max_fouls": None if fouls[f] == np.iinfo(np.int32).max else int(fouls[f]),
+            "line": float(lines[l]),
+            "signals": cnt,
+            "hits": hit,
+            "hit_rate": hit / cnt,
+            "pnl": hit * (odds - 1) - (cnt - hit),
+        })
+    return result
+
+
+def parse_range(spec: str) -> np.ndarray:
+    """"start:stop:step" (stop включительно) или одно число"""
+    parts = [float(p) for p in spec.split(":")]
+    if len(parts) == 1:
+        return np.asarray(parts)
+    start, stop, step = parts if len(parts) == 3 else (parts[0], parts[1], 1.0)
+    return np.arange(start, stop + step / 2, step)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сетка порогов/линий стратегий по записанным играм")
+    parser.add_argument("source", help="папка с записями (RECORD_DIR) или .npz со снимками")
+    parser.add_argument("--cache", help="сохранить загруженные снимки в .npz")
+    parser.add_argument("--strategy", choices=("3Q", "4Q"), default="3Q")
+    parser.add_argument("--thresholds", help="порог: очки в 3Q (>=) или разница в 4Q (<=), start:stop:step")
+    parser.add_argument("--lines", help="линии ТБ, start:stop:step")
+    parser.add_argument("--fouls", help="лимит фолов на момент сигнала, start:stop:step (по умолчанию без лимита)")
+    parser.add_argument("--min-signals", type=int, default=30)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--odds", type=float, default=1.87)
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    snaps = load(args.source, args.cache)
+    loaded = time.monotonic()
+    n_games = len(np.unique(snaps["game"]))
+    print(f"Снимков: {len(snaps['game'])}, игр: {n_games}, загрузка {loaded - started:.2f} с")
+    if not n_games:
+        return 1
+
+    quarter = 3 if args.strategy == "3Q" else 4
+    if quarter == 3:
+        thresholds = parse_range(args.thresholds or "0:40:1")
+        lines = parse_range(args.lines or "30:60:0.5")
+        current = (bot.STRATEGY_3Q_MIN_POINTS, bot.STRATEGY_3Q_LINE)
+    else:
+        thresholds = parse_range(args.thresholds or "0:20:1")
+        lines = parse_range(args.lines or "30:60:0.5")
+        current = (bot.STRATEGY_4Q_MAX_DIFF, bot.STRATEGY_4Q_LINE)
+    no_limit = np.asarray([np.iinfo(np.int32).max])
+    fouls = parse_range(args.fouls).astype(np.int32) if args.fouls else no_limit
+
+    signals, hits = evaluate_grid(snaps, quarter, thresholds, lines, fouls)
+    evaluated = time.monotonic()
+    print(f"Комбинаций: {hits.size}, оценка {evaluated - loaded:.3f} с")
+
+    # текущие настройки bot.py — для сравнения
+    cs, ch = evaluate_grid(snaps, quarter, np.asarray([current[0]]), np.asarray([current[1]]), no_limit)
+    if cs[0, 0]:
+        print(f"Сейчас ({current[0]}, линия {current[1]}): сигналов {int(cs[0, 0])}, hit rate {ch[0, 0, 0] / cs[0, 0]:.1%}")
+
+    for r in rank(signals, hits, thresholds, lines, fouls, args.min_signals, args.top, args.odds):
+        fouls_text = "" if r["max_fouls"] is None else f", фолов <= {r['max_fouls']}"
+        print(
+            f"порог {r['threshold']:g}{fouls_text}, линия {r['line']:g}: сигналов {r['signals']}, "
+            f"hit rate {r['hit_rate']:.1%}, PnL {r['pnl']:+.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())